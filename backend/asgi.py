@@ -0,0 +1,11 @@
+from __future__ import annotations
+
+from dotenv import load_dotenv
+
+from kity_api.asgi import create_asgi_app
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Async serving mode: `uvicorn asgi:app --port 8787`
+app = create_asgi_app()
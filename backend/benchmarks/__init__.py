@@ -0,0 +1 @@
+"""Stand-alone performance checks; run each module with `python -m benchmarks.<name>`."""
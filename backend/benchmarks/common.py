@@ -0,0 +1,122 @@
+"""Shared helpers: isolated settings, synthetic data, timing and JSON reports."""
+from __future__ import annotations
+
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+  sys.path.insert(0, str(BACKEND_DIR))
+
+from kity_api.config import Settings, load_settings  # noqa: E402
+
+STATUSES = ("active_trial", "ended_trial", "paid_monthly", "paid_annually", "free_user")
+_SEED_BATCH = 5000
+
+
+def bench_settings(data_dir: Path, **env: str) -> Settings:
+  """
+  Settings pointing at `data_dir`, with the scheduler and write-behind off so
+  nothing runs behind the measured code. Extra env vars override defaults.
+  """
+  os.environ.update({"DATA_DIR": str(data_dir), "APP_ROLE": "web", "WRITE_BEHIND": "false", **env})
+  from kity_api import ensure_schema
+
+  settings = load_settings()
+  ensure_schema(settings)
+  return settings
+
+
+def synthetic_entries(count: int, seed: int = 7, offset: int = 0) -> Iterator[Dict[str, Any]]:
+  """ExtPay-shaped user entries with a realistic spread of statuses and dates."""
+  rng = random.Random(seed + offset)
+  base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+  for index in range(offset, offset + count):
+    status = rng.choice(STATUSES)
+    started = base + timedelta(minutes=rng.randrange(0, 60 * 24 * 600))
+    entry: Dict[str, Any] = {
+      "email": f"user{index}@bench.example",
+      "name": f"User {index}" if rng.random() < 0.7 else None,
+      "status": status,
+    }
+    if status in {"active_trial", "ended_trial"}:
+      entry["trialStartedAt"] = started.isoformat()
+    elif status.startswith("paid"):
+      entry["subscriptionStartedAt"] = started.isoformat()
+    yield entry
+
+
+def seed_users(settings: Settings, count: int, seed: int = 7) -> float:
+  """Insert `count` synthetic users in batched transactions; returns seconds taken."""
+  from kity_api.storage import prepare_user_params, upsert_users_bulk
+
+  started = time.perf_counter()
+  batch: List[Dict[str, Optional[str]]] = []
+  for entry in synthetic_entries(count, seed):
+    batch.append(
+      prepare_user_params(
+        entry["email"],
+        name=entry["name"],
+        status=entry["status"],
+        trial_started_at=entry.get("trialStartedAt"),
+        subscription_started_at=entry.get("subscriptionStartedAt"),
+      )
+    )
+    if len(batch) >= _SEED_BATCH:
+      upsert_users_bulk(settings, batch)
+      batch = []
+  upsert_users_bulk(settings, batch)
+  return time.perf_counter() - started
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+  """Latency summary in milliseconds."""
+  ordered = sorted(samples)
+
+  def pct(p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+  return {
+    "n": len(ordered),
+    "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+    "p50_ms": round(pct(0.50), 4),
+    "p95_ms": round(pct(0.95), 4),
+    "p99_ms": round(pct(0.99), 4),
+    "max_ms": round(ordered[-1] * 1000, 4),
+  }
+
+
+def measure(func: Callable[[], Any], iterations: int, warmup: int = 3) -> Dict[str, float]:
+  """Call `func` repeatedly and summarize per-call wall time."""
+  for _ in range(warmup):
+    func()
+  samples = []
+  for _ in range(iterations):
+    started = time.perf_counter()
+    func()
+    samples.append(time.perf_counter() - started)
+  return summarize(samples)
+
+
+def emit(benchmark: str, results: Dict[str, Any], json_path: Optional[str] = None) -> Dict[str, Any]:
+  """Print a report (and optionally write it) in the shape every benchmark shares."""
+  report = {
+    "benchmark": benchmark,
+    "recorded_at": datetime.now(timezone.utc).isoformat(),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "results": results,
+  }
+  output = json.dumps(report, indent=2)
+  print(output)
+  if json_path:
+    Path(json_path).write_text(output + "\n")
+  return report
@@ -0,0 +1,125 @@
+"""
+A local stand-in for the ExtPay user export, serving synthetic users either as
+one JSON document or page by page (`?page=N&per_page=M`), with optional latency
+and injected 429/503 failures to exercise retries.
+
+  python -m benchmarks.fake_extpay --users 100000 --port 8799
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from .common import synthetic_entries
+
+
+class FakeExtPay(ThreadingHTTPServer):
+  daemon_threads = True
+
+  def __init__(
+    self,
+    address: Tuple[str, int],
+    users: int,
+    latency_per_1000: float = 0.0,
+    failure_rate: float = 0.0,
+    api_key: str = "bench-key",
+  ) -> None:
+    super().__init__(address, _Handler)
+    self.entries = list(synthetic_entries(users))
+    self.latency_per_1000 = latency_per_1000
+    self.failure_rate = failure_rate
+    self.api_key = api_key
+    self.requests_served = 0
+    self.failures_injected = 0
+    self._stats_lock = threading.Lock()
+    self._rng = random.Random(11)
+
+  @property
+  def url(self) -> str:
+    host, port = self.server_address[:2]
+    return f"http://{host}:{port}/users"
+
+  def should_fail(self) -> bool:
+    with self._stats_lock:
+      self.requests_served += 1
+      if self.failure_rate and self._rng.random() < self.failure_rate:
+        self.failures_injected += 1
+        return True
+    return False
+
+
+class _Handler(BaseHTTPRequestHandler):
+  server: FakeExtPay
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, format: str, *args: object) -> None:
+    pass
+
+  def _send(self, status: int, body: bytes, headers: Optional[dict] = None) -> None:
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    for name, value in (headers or {}).items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self) -> None:
+    if self.headers.get("Authorization") != f"Bearer {self.server.api_key}":
+      self._send(401, b'{"error":"unauthorized"}')
+      return
+    if self.server.should_fail():
+      status = random.choice((429, 503))
+      self._send(status, b'{"error":"try again"}', {"Retry-After": "0"})
+      return
+
+    query = parse_qs(urlparse(self.path).query)
+    entries: List[dict] = self.server.entries
+    if "page" in query:
+      page = int(query["page"][0])
+      per_page = int(query.get("per_page", ["1000"])[0])
+      entries = entries[(page - 1) * per_page : page * per_page]
+    # Latency scales with the amount of data sent, like a real export.
+    time.sleep(self.server.latency_per_1000 * max(1, len(entries)) / 1000)
+    self._send(200, json.dumps({"users": entries}).encode("utf-8"))
+
+
+def serve_in_thread(
+  users: int, latency_per_1000: float = 0.0, failure_rate: float = 0.0
+) -> FakeExtPay:
+  """Start a fake server on a free loopback port; call `.shutdown()` when done."""
+  server = FakeExtPay(
+    ("127.0.0.1", 0), users, latency_per_1000=latency_per_1000, failure_rate=failure_rate
+  )
+  threading.Thread(target=server.serve_forever, name="fake-extpay", daemon=True).start()
+  return server
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--users", type=int, default=10_000)
+  parser.add_argument("--port", type=int, default=8799)
+  parser.add_argument(
+    "--latency-ms-per-1000", type=float, default=50.0, help="simulated latency per 1000 users sent"
+  )
+  parser.add_argument("--failure-rate", type=float, default=0.0)
+  args = parser.parse_args()
+
+  server = FakeExtPay(
+    ("127.0.0.1", args.port),
+    args.users,
+    latency_per_1000=args.latency_ms_per_1000 / 1000,
+    failure_rate=args.failure_rate,
+  )
+  print(f"Fake ExtPay serving {args.users} users at {server.url} (API key {server.api_key})")
+  server.serve_forever()
+
+
+if __name__ == "__main__":
+  main()
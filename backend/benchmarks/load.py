@@ -0,0 +1,131 @@
+"""
+HTTP load driver for /users. Without --url it seeds a temporary store and serves
+the app in-process (threaded werkzeug, rate limits off). Each client thread keeps
+one keep-alive session and mixes paged reads with upserts.
+
+  python -m benchmarks.load --seconds 10 --clients 8 --write-ratio 0.2 --json load.json
+  python -m benchmarks.load --url http://127.0.0.1:8787 --seconds 30
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .common import bench_settings, emit, seed_users, summarize
+
+
+def _start_local_server(data_dir: Path, rows: int) -> Any:
+  from werkzeug.serving import make_server
+
+  settings = bench_settings(data_dir, RATE_LIMITS="", MAX_PENDING_WRITES="0", METRICS_ENABLED="false")
+  seed_users(settings, rows)
+
+  from kity_api import create_app
+
+  server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+  threading.Thread(target=server.serve_forever, name="bench-http", daemon=True).start()
+  return server
+
+
+def _client(
+  base_url: str,
+  deadline: float,
+  write_ratio: float,
+  seed: int,
+  samples: Dict[str, List[float]],
+  statuses: Counter,
+  lock: threading.Lock,
+) -> None:
+  import requests
+
+  rng = random.Random(seed)
+  session = requests.Session()
+  local: Dict[str, List[float]] = {"GET /users": [], "POST /users": []}
+  local_statuses: Counter = Counter()
+  while time.perf_counter() < deadline:
+    started = time.perf_counter()
+    if rng.random() < write_ratio:
+      name = "POST /users"
+      response = session.post(
+        f"{base_url}/users",
+        json={"email": f"load{rng.randrange(50_000)}@bench.example", "status": "active_trial"},
+      )
+    else:
+      name = "GET /users"
+      response = session.get(f"{base_url}/users", params={"limit": 50})
+    local[name].append(time.perf_counter() - started)
+    local_statuses[f"{name} {response.status_code}"] += 1
+  with lock:
+    for name, values in local.items():
+      samples[name].extend(values)
+    statuses.update(local_statuses)
+
+
+def run(
+  url: Optional[str], seconds: float, clients: int, write_ratio: float, rows: int
+) -> Dict[str, Any]:
+  with tempfile.TemporaryDirectory() as tmp:
+    server = None
+    if not url:
+      server = _start_local_server(Path(tmp), rows)
+      url = f"http://127.0.0.1:{server.server_port}"
+    try:
+      samples: Dict[str, List[float]] = {"GET /users": [], "POST /users": []}
+      statuses: Counter = Counter()
+      lock = threading.Lock()
+      deadline = time.perf_counter() + seconds
+      threads = [
+        threading.Thread(
+          target=_client, args=(url, deadline, write_ratio, index, samples, statuses, lock)
+        )
+        for index in range(clients)
+      ]
+      started = time.perf_counter()
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+      elapsed = time.perf_counter() - started
+    finally:
+      if server is not None:
+        server.shutdown()
+
+  total = sum(len(values) for values in samples.values())
+  return {
+    "target": "in-process" if server is not None else url,
+    "clients": clients,
+    "seconds": round(elapsed, 3),
+    "write_ratio": write_ratio,
+    "seeded_rows": rows if server is not None else None,
+    "requests": total,
+    "requests_per_second": round(total / elapsed, 1) if elapsed else None,
+    "statuses": dict(statuses),
+    "latency": {name: summarize(values) for name, values in samples.items() if values},
+  }
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--url", help="base URL of a running API; omit to start one in-process")
+  parser.add_argument("--seconds", type=float, default=10.0)
+  parser.add_argument("--clients", type=int, default=8)
+  parser.add_argument("--write-ratio", type=float, default=0.2)
+  parser.add_argument("--rows", type=int, default=10_000, help="users seeded for the in-process server")
+  parser.add_argument("--json", dest="json_path")
+  args = parser.parse_args()
+
+  emit(
+    "load",
+    run(args.url, args.seconds, max(1, args.clients), args.write_ratio, args.rows),
+    args.json_path,
+  )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,81 @@
+"""
+Microbenchmarks for the storage and metrics hot paths at several store sizes.
+
+  python -m benchmarks.micro --sizes 10000,100000 --json micro.json
+  python -m benchmarks.micro --sizes 1000000     # slow: seeds a million rows
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+from .common import bench_settings, emit, measure, seed_users
+
+
+def bench_size(rows: int, iterations: int) -> Dict[str, Any]:
+  from kity_api.extensionpay import map_extpay_status
+  from kity_api.metrics import snapshot_user_count
+  from kity_api.readmodel import UserReadModel
+  from kity_api.storage import find_user_by_email, read_users, read_users_page, upsert_user
+
+  with tempfile.TemporaryDirectory() as tmp:
+    settings = bench_settings(Path(tmp))
+    seed_seconds = seed_users(settings, rows)
+    counter = itertools.count()
+    # Full scans get slow at large sizes; fewer iterations keep runs bounded.
+    scan_iterations = max(3, min(iterations, 2_000_000 // max(rows, 1)))
+
+    results: Dict[str, Any] = {
+      "seed_seconds": round(seed_seconds, 3),
+      "upsert_user_insert": measure(
+        lambda: upsert_user(settings, f"new{next(counter)}@bench.example", name="New"),
+        iterations,
+      ),
+      "upsert_user_update": measure(
+        lambda: upsert_user(
+          settings, f"user{next(counter) % rows}@bench.example", status="paid_monthly"
+        ),
+        iterations,
+      ),
+      "read_users_page_100": measure(lambda: read_users_page(settings, 100), iterations),
+      "read_users_full": measure(lambda: read_users(settings), scan_iterations, warmup=1),
+      "snapshot_user_count": measure(lambda: snapshot_user_count(settings), iterations),
+      "find_user_by_email": measure(
+        lambda: find_user_by_email(settings, f"user{next(counter) % rows}@bench.example"),
+        iterations,
+      ),
+    }
+    model = UserReadModel(settings)
+    results["read_model_load"] = measure(lambda: model._load_all(0), 3, warmup=0)
+    model._ensure_fresh()
+    results["read_model_find_by_email"] = measure(
+      lambda: model.find_by_email(f"user{next(counter) % rows}@bench.example"), iterations
+    )
+    results["read_model_page_100"] = measure(lambda: model.read_users_page(100), iterations)
+    results["read_model_full"] = measure(lambda: list(model.iter_users()), scan_iterations, warmup=1)
+  statuses = [("trialing", None), ("active", "Monthly"), ("canceled", None), ("active", "Yearly")]
+  cycle = itertools.cycle(statuses)
+  results["map_extpay_status"] = measure(lambda: map_extpay_status(*next(cycle)), iterations * 10)
+  return results
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--sizes", default="10000,100000", help="comma-separated row counts")
+  parser.add_argument("--iterations", type=int, default=200)
+  parser.add_argument("--json", dest="json_path")
+  args = parser.parse_args()
+
+  sizes: List[int] = [int(size) for size in args.sizes.split(",") if size.strip()]
+  emit(
+    "micro",
+    {str(rows): bench_size(rows, max(1, args.iterations)) for rows in sizes},
+    args.json_path,
+  )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,145 @@
+"""
+ExtPay entry normalization: `ExtPayNormalizer` against the per-entry path it
+replaced (`map_extpay_status` + `prepare_user_params`). Every synthetic entry
+is checked for identical parameters, fingerprints and errors first, and the run
+exits non-zero on any mismatch. The edge-case corpus lives in
+tests/test_normalize.py, which runs the same check under pytest.
+
+  python -m benchmarks.normalize --entries 200000 --json normalize.json
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .common import emit, synthetic_entries
+
+# Fields the two paths fill with fresh values on every call.
+_VOLATILE = ("id", "created_at")
+
+
+def reference_normalize(entry: object) -> Tuple[Dict[str, Optional[str]], str]:
+  """The per-entry mapping the sync used before `ExtPayNormalizer`, kept verbatim."""
+  from kity_api.extensionpay import map_extpay_status
+  from kity_api.storage import prepare_user_params
+  from kity_api.utils import string_or_null
+
+  if not isinstance(entry, dict):
+    raise ValueError("missing email")
+  email = string_or_null(entry.get("email"))
+  if not email:
+    raise ValueError("missing email")
+
+  plan = entry.get("planNickname") or entry.get("plan")
+  raw_status = entry.get("status") or entry.get("planStatus")
+  params = prepare_user_params(
+    email,
+    name=string_or_null(entry.get("name")),
+    status=map_extpay_status(raw_status, plan_nickname=plan),
+    trial_started_at=entry.get("trialStartedAt") or entry.get("trial_started_at"),
+    subscription_started_at=(
+      entry.get("subscriptionStartedAt") or entry.get("subscription_started_at")
+    ),
+  )
+  mapped = (
+    params["requested_status"],
+    plan if isinstance(plan, str) else None,
+    params["name"],
+    params["trial_started_at"],
+    params["subscription_started_at"],
+  )
+  fingerprint = hashlib.blake2b(
+    "\x1f".join(value or "" for value in mapped).encode("utf-8"), digest_size=16
+  ).hexdigest()
+  return params, fingerprint
+
+
+def _outcome(normalize, entry: Any) -> Tuple[Any, ...]:
+  try:
+    params, fingerprint = normalize(entry)
+  except ValueError as exc:
+    return ("error", str(exc))
+  stable = {key: value for key, value in params.items() if key not in _VOLATILE}
+  return ("ok", stable, fingerprint, sorted(params))
+
+
+def check_parity(entries: List[Any]) -> List[Dict[str, Any]]:
+  from kity_api.normalize import ExtPayNormalizer
+
+  normalizer = ExtPayNormalizer()
+  mismatches = []
+  for index, entry in enumerate(entries):
+    expected = _outcome(reference_normalize, entry)
+    # Twice, so the second pass goes through the memo tables.
+    for _ in range(2):
+      actual = _outcome(normalizer.normalize, entry)
+      if actual != expected:
+        mismatches.append(
+          {"index": index, "entry": repr(entry), "expected": repr(expected), "actual": repr(actual)}
+        )
+        break
+  return mismatches
+
+
+def _time_batches(entries: List[Any], batch_size: int, repeat: int) -> Dict[str, float]:
+  from kity_api.normalize import ExtPayNormalizer
+
+  def reference(pairs):
+    errors = []
+    for idx, entry in pairs:
+      try:
+        reference_normalize(entry)
+      except ValueError as exc:
+        errors.append(f"[{idx}] {exc}")
+
+  best = {"reference": float("inf"), "normalizer": float("inf")}
+  pairs = list(enumerate(entries))
+  for _ in range(repeat):
+    for label in best:
+      # A fresh normalizer per round, as each sync run starts with one.
+      run = reference if label == "reference" else ExtPayNormalizer().normalize_batch
+      started = time.perf_counter()
+      for offset in range(0, len(pairs), batch_size):
+        run(pairs[offset : offset + batch_size])
+      best[label] = min(best[label], time.perf_counter() - started)
+  return best
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--entries", type=int, default=100_000)
+  parser.add_argument("--batch-size", type=int, default=1000)
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--json", dest="json_path")
+  args = parser.parse_args()
+
+  entries: List[Any] = list(synthetic_entries(args.entries))
+  # Real exports carry second-resolution timestamps that repeat across users.
+  for entry in entries[::3]:
+    entry["trialStartedAt"] = datetime(2024, 5, 1).isoformat()
+  mismatches = check_parity(entries)
+  best = _time_batches(entries, max(1, args.batch_size), max(1, args.repeat))
+
+  results: Dict[str, Any] = {
+    "entries": len(entries),
+    "parity_mismatches": len(mismatches),
+    "mismatch_samples": mismatches[:10],
+  }
+  for label, seconds in best.items():
+    results[label] = {
+      "seconds": round(seconds, 4),
+      "entries_per_second": round(len(entries) / seconds) if seconds else None,
+    }
+  if best["normalizer"]:
+    results["speedup"] = round(best["reference"] / best["normalizer"], 2)
+  emit("normalize", results, args.json_path)
+  if mismatches:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,37 @@
+"""
+Seed a users.db with synthetic users, e.g. to run the API against a large store.
+
+  python -m benchmarks.seed --rows 100000 --data-dir /tmp/kity-bench
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+from .common import bench_settings, emit, seed_users
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--rows", type=int, default=10_000)
+  parser.add_argument("--data-dir", required=True, help="directory for users.db (created if missing)")
+  parser.add_argument("--seed", type=int, default=7)
+  parser.add_argument("--json", dest="json_path")
+  args = parser.parse_args()
+
+  settings = bench_settings(Path(args.data_dir))
+  seconds = seed_users(settings, args.rows, seed=args.seed)
+  emit(
+    "seed",
+    {
+      "rows": args.rows,
+      "db_path": str(settings.db_path),
+      "seconds": round(seconds, 3),
+      "rows_per_second": round(args.rows / seconds) if seconds else None,
+    },
+    args.json_path,
+  )
+
+
+if __name__ == "__main__":
+  main()
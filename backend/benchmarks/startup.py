@@ -0,0 +1,102 @@
+"""
+Measure worker boot latency: `create_app()` in a fresh interpreter, timed by
+`python -X importtime` plus wall clock, for each APP_ROLE.
+
+  python -m benchmarks.startup --runs 5 --json startup.json
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from .common import BACKEND_DIR, emit
+
+_BOOT_SNIPPET = """
+import time
+started = time.perf_counter()
+from kity_api import create_app
+create_app()
+print(f"boot_ms={(time.perf_counter() - started) * 1000:.3f}")
+import sys
+print("heavy=" + ",".join(m for m in ("stripe", "requests", "apscheduler") if m in sys.modules))
+"""
+
+
+def _parse_importtime(stderr: str) -> Dict[str, int]:
+  """Top-level cumulative import time (µs) per package from `-X importtime` output."""
+  cumulative: Dict[str, int] = {}
+  for line in stderr.splitlines():
+    if not line.startswith("import time:"):
+      continue
+    parts = line[len("import time:") :].split("|")
+    if len(parts) != 3 or not parts[1].strip().isdigit():
+      continue
+    name = parts[2].rstrip()
+    # Only modules imported directly at nesting depth 0 or 1 matter for the summary.
+    depth = (len(name) - len(name.lstrip())) // 2
+    if depth <= 1:
+      package = name.strip().split(".")[0]
+      cumulative[package] = max(cumulative.get(package, 0), int(parts[1]))
+  return cumulative
+
+
+def boot_once(role: str, data_dir: Path) -> Tuple[float, float, Dict[str, int], List[str]]:
+  env = {**os.environ, "APP_ROLE": role, "DATA_DIR": str(data_dir), "PYTHONDONTWRITEBYTECODE": "1"}
+  started = time.perf_counter()
+  proc = subprocess.run(
+    [sys.executable, "-X", "importtime", "-c", _BOOT_SNIPPET],
+    cwd=BACKEND_DIR,
+    env=env,
+    capture_output=True,
+    text=True,
+    check=True,
+  )
+  wall_ms = (time.perf_counter() - started) * 1000
+  values = dict(line.split("=", 1) for line in proc.stdout.splitlines() if "=" in line)
+  heavy = [name for name in values.get("heavy", "").split(",") if name]
+  return wall_ms, float(values["boot_ms"]), _parse_importtime(proc.stderr), heavy
+
+
+def run(roles: List[str], runs: int) -> Dict[str, object]:
+  results: Dict[str, object] = {}
+  with tempfile.TemporaryDirectory() as tmp:
+    for role in roles:
+      walls, boots = [], []
+      imports: Dict[str, int] = {}
+      heavy: List[str] = []
+      for _ in range(runs):
+        wall_ms, boot_ms, imports, heavy = boot_once(role, Path(tmp))
+        walls.append(wall_ms)
+        boots.append(boot_ms)
+      top = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:10]
+      results[role] = {
+        "runs": runs,
+        "process_ms_median": round(statistics.median(walls), 3),
+        "create_app_ms_median": round(statistics.median(boots), 3),
+        "create_app_ms_min": round(min(boots), 3),
+        "heavy_modules_loaded": heavy,
+        "top_imports_ms": {name: round(us / 1000, 3) for name, us in top},
+      }
+  return results
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--runs", type=int, default=5)
+  parser.add_argument("--roles", default="web,all", help="comma-separated APP_ROLE values")
+  parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+  args = parser.parse_args()
+
+  roles = [role.strip() for role in args.roles.split(",") if role.strip()]
+  emit("startup", run(roles, max(1, args.runs)), args.json_path)
+
+
+if __name__ == "__main__":
+  main()
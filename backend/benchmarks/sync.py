@@ -0,0 +1,85 @@
+"""
+End-to-end `sync_extensionpay_users` against the local fake ExtPay server, in
+single-request and paginated modes, on a fresh store and again on an unchanged one.
+
+  python -m benchmarks.sync --users 100000 --json sync.json
+"""
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from .common import bench_settings, emit
+from .fake_extpay import serve_in_thread
+
+MODES: Dict[str, Dict[str, str]] = {
+  "single": {},
+  "paged": {
+    "EXTPAY_SYNC_PAGE_PARAM": "page",
+    "EXTPAY_SYNC_PAGE_SIZE_PARAM": "per_page",
+    "EXTPAY_SYNC_PAGE_SIZE": "1000",
+  },
+}
+
+
+def bench_mode(
+  mode: str, users: int, latency_per_1000: float, failure_rate: float, concurrency: int
+) -> Dict[str, Any]:
+  from kity_api.extensionpay import sync_extensionpay_users
+
+  server = serve_in_thread(users, latency_per_1000=latency_per_1000, failure_rate=failure_rate)
+  try:
+    with tempfile.TemporaryDirectory() as tmp:
+      settings = bench_settings(
+        Path(tmp),
+        EXTPAY_SYNC_URL=server.url,
+        EXTPAY_API_KEY=server.api_key,
+        EXTPAY_SYNC_CONCURRENCY=str(concurrency),
+        EXTPAY_SYNC_BACKOFF="0.01",
+        **{"EXTPAY_SYNC_PAGE_PARAM": "", "EXTPAY_SYNC_PAGE_SIZE_PARAM": "", **MODES[mode]},
+      )
+      runs: Dict[str, Any] = {}
+      for label in ("cold", "warm"):
+        started = time.perf_counter()
+        created, updated, errors = sync_extensionpay_users(settings)
+        seconds = time.perf_counter() - started
+        runs[label] = {
+          "seconds": round(seconds, 3),
+          "rows_per_second": round((created + updated) / seconds) if seconds else None,
+          "created": created,
+          "updated": updated,
+          "errors": len(errors),
+        }
+      runs["http_requests"] = server.requests_served
+      runs["failures_injected"] = server.failures_injected
+      return runs
+  finally:
+    server.shutdown()
+    server.server_close()
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--users", type=int, default=20_000)
+  parser.add_argument("--modes", default="single,paged")
+  parser.add_argument("--latency-ms-per-1000", type=float, default=50.0)
+  parser.add_argument("--failure-rate", type=float, default=0.0)
+  parser.add_argument("--concurrency", type=int, default=4)
+  parser.add_argument("--json", dest="json_path")
+  args = parser.parse_args()
+
+  results = {
+    mode: bench_mode(
+      mode, args.users, args.latency_ms_per_1000 / 1000, args.failure_rate, args.concurrency
+    )
+    for mode in args.modes.split(",")
+    if mode.strip()
+  }
+  emit("sync", {"users": args.users, "modes": results}, args.json_path)
+
+
+if __name__ == "__main__":
+  main()
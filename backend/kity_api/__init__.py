@@ -2,10 +2,26 @@ from __future__ import annotations
 
 from flask import Flask
 
-from .config import load_settings
+from .config import Settings, load_settings
 from .cors import attach_cors
+from .extensionpay import ensure_sync_tables
+from .idempotency import ensure_idempotency_table
+from .instrumentation import attach_instrumentation, set_recording
+from .jobs import ensure_job_tables
+from .metrics import ensure_metrics_table
+from .readmodel import warm_read_model
 from .routes import create_api_blueprint
 from .scheduler import start_scheduler
+from .storage import ensure_store
+
+
+def ensure_schema(settings: Settings) -> None:
+  """Create every table the app and its jobs use; safe to call from each process."""
+  ensure_store(settings)
+  ensure_metrics_table(settings)
+  ensure_sync_tables(settings)
+  ensure_idempotency_table(settings)
+  ensure_job_tables(settings)
 
 
 def create_app() -> Flask:
@@ -13,14 +29,30 @@ def create_app() -> Flask:
 
   app = Flask(__name__)
   app.config["PORT"] = settings.port
+  app.config["MAX_CONTENT_LENGTH"] = settings.max_body_bytes
 
+  # Schema bootstrap happens once here instead of on every request.
+  ensure_schema(settings)
+  warm_read_model(settings)
+
+  set_recording(settings.metrics_enabled)
+  if settings.metrics_enabled:
+    # Registered first so request timings include CORS and rate-limit checks.
+    attach_instrumentation(app, settings)
   attach_cors(app, settings)
 
   api = create_api_blueprint(settings)
   app.register_blueprint(api)
 
-  # Background jobs (ExtPay sync, user count snapshots)
-  start_scheduler(settings)
+  # Background jobs (ExtPay sync, user count snapshots); web-only workers leave them
+  # to a separate `python worker.py` process.
+  if settings.app_role in {"worker", "all"}:
+    start_scheduler(settings)
+
+  @app.errorhandler(413)
+  def body_too_large(_error):
+    # Raised by Werkzeug once a body passes MAX_CONTENT_LENGTH.
+    return {"error": f"Request body is limited to {settings.max_body_bytes} bytes"}, 413
 
   @app.route("/health", methods=["GET"])
   def health():
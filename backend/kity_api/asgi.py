@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from flask import Flask
+
+from .config import Settings, load_settings
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+_END = object()
+_QUEUE_DEPTH = 8
+
+# Requests that wait on Stripe get their own executor lane so they can never take
+# threads away from the fast SQLite-backed endpoints.
+SLOW_ROUTES = {("POST", "/donations/checkout")}
+
+
+class _BodyTooLarge(Exception):
+  pass
+
+
+def _unsupported_write(data: bytes) -> None:
+  raise NotImplementedError("The WSGI write() callable is not supported; return an iterable")
+
+
+def _build_environ(scope: Scope, body: bytes) -> Dict[str, Any]:
+  server = scope.get("server") or ("localhost", 80)
+  client = scope.get("client") or ("", 0)
+  root_path = scope.get("root_path", "")
+  path = scope["path"]
+  if root_path and path.startswith(root_path):
+    path = path[len(root_path) :]
+  environ: Dict[str, Any] = {
+    "REQUEST_METHOD": scope["method"],
+    "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+    "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+    "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+    "SERVER_NAME": server[0],
+    "SERVER_PORT": str(server[1] or 80),
+    "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+    "REMOTE_ADDR": client[0],
+    "REMOTE_PORT": str(client[1]),
+    "wsgi.version": (1, 0),
+    "wsgi.url_scheme": scope.get("scheme", "http"),
+    "wsgi.input": io.BytesIO(body),
+    # The body is already fully buffered, so its length is known even when the
+    # client sent it chunked or over HTTP/2 without a Content-Length.
+    "wsgi.input_terminated": True,
+    "wsgi.errors": sys.stderr,
+    "wsgi.multithread": True,
+    "wsgi.multiprocess": True,
+    "wsgi.run_once": False,
+  }
+  for raw_name, raw_value in scope.get("headers", []):
+    name = raw_name.decode("latin-1").upper().replace("-", "_")
+    value = raw_value.decode("latin-1")
+    if name == "CONTENT_TYPE":
+      environ["CONTENT_TYPE"] = value
+      continue
+    if name == "CONTENT_LENGTH":
+      # Taken from the buffered body below instead.
+      continue
+    key = f"HTTP_{name}"
+    environ[key] = f"{environ[key]},{value}" if key in environ else value
+  environ["CONTENT_LENGTH"] = str(len(body))
+  return environ
+
+
+class AsgiApp:
+  """
+  Serve the Flask app under an ASGI server (e.g. `uvicorn asgi:app`).
+
+  The event loop only shuttles bytes: each request runs on a bounded thread
+  pool, so SQLite work never blocks the loop, and routes listed in SLOW_ROUTES
+  (Stripe checkout) are awaited on a separate, smaller pool.
+  """
+
+  def __init__(self, flask_app: Flask, settings: Settings) -> None:
+    self.flask_app = flask_app
+    self.settings = settings
+    self.fast_executor = ThreadPoolExecutor(
+      max_workers=max(1, settings.asgi_threads), thread_name_prefix="kity-asgi"
+    )
+    # One spare thread so requests over the Stripe limit still get a quick 503.
+    self.slow_executor = ThreadPoolExecutor(
+      max_workers=max(1, settings.stripe_max_concurrency) + 1,
+      thread_name_prefix="kity-asgi-stripe",
+    )
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] == "lifespan":
+      await self._lifespan(receive, send)
+      return
+    if scope["type"] != "http":
+      raise RuntimeError(f"Unsupported ASGI scope type '{scope['type']}'")
+    await self._http(scope, receive, send)
+
+  async def _lifespan(self, receive: Receive, send: Send) -> None:
+    while True:
+      message = await receive()
+      if message["type"] == "lifespan.startup":
+        await send({"type": "lifespan.startup.complete"})
+      elif message["type"] == "lifespan.shutdown":
+        self.fast_executor.shutdown(wait=False)
+        self.slow_executor.shutdown(wait=False)
+        await send({"type": "lifespan.shutdown.complete"})
+        return
+
+  async def _read_body(self, scope: Scope, receive: Receive) -> Optional[bytes]:
+    """
+    Buffer the request body, or return None if the client disconnected before
+    sending all of it. A body over `max_body_bytes` raises _BodyTooLarge as soon
+    as the limit is crossed, so it is never buffered in full.
+    """
+    limit = self.settings.max_body_bytes
+    for name, value in scope.get("headers", []):
+      if name.lower() == b"content-length" and value.isdigit() and int(value) > limit:
+        raise _BodyTooLarge()
+    chunks: List[bytes] = []
+    size = 0
+    while True:
+      message = await receive()
+      if message["type"] == "http.disconnect":
+        return None
+      chunk = message.get("body", b"")
+      size += len(chunk)
+      if size > limit:
+        raise _BodyTooLarge()
+      chunks.append(chunk)
+      if not message.get("more_body"):
+        return b"".join(chunks)
+
+  async def _http(self, scope: Scope, receive: Receive, send: Send) -> None:
+    try:
+      body = await self._read_body(scope, receive)
+    except _BodyTooLarge:
+      payload = json.dumps(
+        {"error": f"Request body is limited to {self.settings.max_body_bytes} bytes"}
+      ).encode("utf-8")
+      await send(
+        {
+          "type": "http.response.start",
+          "status": 413,
+          "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode("latin-1")),
+            (b"connection", b"close"),
+          ],
+        }
+      )
+      await send({"type": "http.response.body", "body": payload, "more_body": False})
+      return
+    if body is None:
+      # A truncated body must never reach a view (a partial NDJSON batch would
+      # still be written); there is nobody left to answer anyway.
+      return
+    environ = _build_environ(scope, body)
+    lane = (
+      self.slow_executor
+      if (environ["REQUEST_METHOD"], environ["PATH_INFO"]) in SLOW_ROUTES
+      else self.fast_executor
+    )
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=_QUEUE_DEPTH)
+    cancelled = threading.Event()
+
+    def put(item: object) -> None:
+      if not cancelled.is_set():
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def run() -> None:
+      # The whole request, including iterating a streamed body, stays on one
+      # thread so its pooled SQLite connection is never shared.
+      response_start: Dict[str, Any] = {}
+
+      def start_response(
+        status: str, headers: List[Tuple[str, str]], exc_info: Optional[Any] = None
+      ) -> Callable[[bytes], None]:
+        response_start["status"] = int(status.split(" ", 1)[0])
+        response_start["headers"] = [
+          (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers
+        ]
+        return _unsupported_write
+
+      try:
+        result = self.flask_app(environ, start_response)
+        try:
+          put(response_start)
+          for chunk in result:
+            if cancelled.is_set():
+              break
+            if chunk:
+              put(chunk)
+        finally:
+          close = getattr(result, "close", None)
+          if close:
+            close()
+      finally:
+        put(_END)
+
+    task = loop.run_in_executor(lane, run)
+    try:
+      started = False
+      while True:
+        item = await queue.get()
+        if item is _END:
+          break
+        if not started:
+          await send(
+            {"type": "http.response.start", "status": item["status"], "headers": item["headers"]}
+          )
+          started = True
+          continue
+        await send({"type": "http.response.body", "body": item, "more_body": True})
+      await task
+      await send({"type": "http.response.body", "body": b"", "more_body": False})
+    except BaseException:
+      # Client went away (or the app failed): unblock the worker thread and let it finish.
+      cancelled.set()
+      while not task.done():
+        try:
+          queue.get_nowait()
+        except asyncio.QueueEmpty:
+          await asyncio.sleep(0.01)
+      raise
+
+
+def create_asgi_app(flask_app: Flask | None = None) -> AsgiApp:
+  from . import create_app
+
+  settings = load_settings()
+  return AsgiApp(flask_app or create_app(), settings)
+
+
+__all__ = ["AsgiApp", "create_asgi_app", "SLOW_ROUTES"]
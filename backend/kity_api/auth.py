@@ -1,24 +1,80 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Tuple
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
 
 from flask import jsonify, request
 
+from .cache import TTLCache
 from .config import Settings
-from .storage import find_user_by_token, read_store
+from .storage import (
+  add_token_revoke_listener,
+  add_user_write_listener,
+  find_user_by_token,
+  hash_token,
+)
+
+_token_cache: TTLCache | None = None
+_token_cache_lock = threading.Lock()
+
+
+def _get_token_cache(settings: Settings) -> TTLCache:
+  global _token_cache
+
+  if _token_cache is None:
+    with _token_cache_lock:
+      if _token_cache is None:
+        _token_cache = TTLCache(
+          settings.auth_cache_size,
+          settings.auth_cache_ttl,
+          name="auth_tokens",
+          index=lambda user: user["email"],
+        )
+  return _token_cache
+
+
+def _invalidate_users(emails: Iterable[str]) -> None:
+  """Drop cached token lookups for users whose record (e.g. status) was just written."""
+  if not _token_cache or not len(_token_cache):
+    return
+  _token_cache.discard_indexed(emails)
+
+
+def _invalidate_token(token_hash: str) -> None:
+  """Stop honouring a revoked token in this process straight away."""
+  if _token_cache:
+    _token_cache.pop(token_hash)
+
+
+add_user_write_listener(_invalidate_users)
+add_token_revoke_listener(_invalidate_token)
+
+
+def authenticate(settings: Settings, token: str) -> Optional[Dict[str, Any]]:
+  """Return the user owning `token`, going through the in-process token cache."""
+  cache = _get_token_cache(settings)
+  key = hash_token(token)
+  user = cache.get(key)
+  if user is None:
+    user = find_user_by_token(settings, token)
+    if user:
+      cache.set(key, user)
+  return user or None
 
 
 def require_auth(
   settings: Settings,
-) -> Tuple[Dict[str, Any], Dict[str, Any]] | Tuple[Any, int]:
+) -> Dict[str, Any] | Tuple[Any, int]:
+  """
+  Resolve the request's bearer token to a user.
+  Returns the user dict, or an error response tuple when the token is missing or invalid.
+  """
   header = request.headers.get("Authorization") or ""
   token = header.replace("Bearer", "").strip()
   if not token:
     return jsonify({"error": "Missing bearer token"}), 401
 
-  store = read_store(settings)
-  user = find_user_by_token(store["users"], token)
-  if not user:
+  user = authenticate(settings, token)
+  if user is None:
     return jsonify({"error": "Invalid token"}), 401
-
-  return store, user
+  return user
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from .instrumentation import record_cache_lookup
+
+_MISSING = object()
+
+
+class TTLCache:
+  """
+  Thread-safe, size-bounded LRU cache whose entries expire after `ttl` seconds.
+  A `name` reports its hit ratio through instrumentation. With `index`, entries
+  are also indexed by `index(value)`, so `discard_indexed` can drop every entry
+  for a given index key without scanning the cache.
+  """
+
+  def __init__(
+    self,
+    maxsize: int,
+    ttl: float,
+    name: Optional[str] = None,
+    index: Optional[Callable[[Any], Hashable]] = None,
+  ) -> None:
+    self.maxsize = max(1, int(maxsize))
+    self.ttl = float(ttl)
+    self.name = name
+    self._data: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+    self._index_of = index
+    self._index: Dict[Hashable, Set[Hashable]] = {}
+    self._lock = threading.Lock()
+
+  def _unindex(self, key: Hashable, value: Any) -> None:
+    if self._index_of is None:
+      return
+    index_key = self._index_of(value)
+    keys = self._index.get(index_key)
+    if keys is not None:
+      keys.discard(key)
+      if not keys:
+        del self._index[index_key]
+
+  def get(self, key: Hashable, default: Any = None) -> Any:
+    now = time.monotonic()
+    with self._lock:
+      entry = self._data.get(key, _MISSING)
+      if entry is not _MISSING and entry[0] <= now:
+        del self._data[key]
+        self._unindex(key, entry[1])
+        entry = _MISSING
+      if entry is not _MISSING:
+        self._data.move_to_end(key)
+    record_cache_lookup(self.name, entry is not _MISSING)
+    return default if entry is _MISSING else entry[1]
+
+  def set(self, key: Hashable, value: Any) -> None:
+    expires_at = time.monotonic() + self.ttl
+    with self._lock:
+      previous = self._data.get(key)
+      if previous is not None:
+        self._unindex(key, previous[1])
+      self._data[key] = (expires_at, value)
+      self._data.move_to_end(key)
+      if self._index_of is not None:
+        self._index.setdefault(self._index_of(value), set()).add(key)
+      while len(self._data) > self.maxsize:
+        evicted, (_, evicted_value) = self._data.popitem(last=False)
+        self._unindex(evicted, evicted_value)
+
+  def pop(self, key: Hashable) -> Optional[Any]:
+    with self._lock:
+      entry = self._data.pop(key, None)
+      if entry is not None:
+        self._unindex(key, entry[1])
+    return entry[1] if entry else None
+
+  def discard_indexed(self, index_keys: Iterable[Hashable]) -> int:
+    """Drop every entry indexed under one of `index_keys`; returns how many were dropped."""
+    dropped = 0
+    with self._lock:
+      for index_key in index_keys:
+        for key in self._index.pop(index_key, ()):
+          if self._data.pop(key, None) is not None:
+            dropped += 1
+    return dropped
+
+  def discard_where(self, predicate: Callable[[Any], bool]) -> int:
+    """Drop every entry whose value matches `predicate`; returns how many were dropped."""
+    with self._lock:
+      stale = [key for key, (_, value) in self._data.items() if predicate(value)]
+      for key in stale:
+        self._unindex(key, self._data.pop(key)[1])
+    return len(stale)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._data.clear()
+      self._index.clear()
+
+  def __len__(self) -> int:
+    return len(self._data)
+
+
+__all__ = ["TTLCache"]
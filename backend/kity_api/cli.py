@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import IO, Iterator, List, Optional
+
+from .config import Settings, load_settings
+from .maintenance import CHECKPOINT_MODES, run_maintenance, vacuum_database
+from .storage import parse_user_fields
+from .transfer import (
+  DEFAULT_BACKUP_PAGES,
+  DEFAULT_IMPORT_BATCH,
+  EXPORT_FORMATS,
+  ImportResult,
+  backup_database,
+  export_users,
+  format_for_path,
+  import_users,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def _open_text(path: str, mode: str) -> Iterator[IO[str]]:
+  """Open `path` for text I/O, with `-` meaning stdin or stdout."""
+  if path == "-":
+    yield sys.stdout if "w" in mode else sys.stdin
+    return
+  with open(path, mode, encoding="utf-8", newline="") as handle:
+    yield handle
+
+
+def _export(settings: Settings, args: argparse.Namespace) -> int:
+  fmt = args.format or format_for_path(args.output)
+  with _open_text(args.output, "w") as out:
+    count = export_users(
+      settings, out, fmt, fields=parse_user_fields(args.fields), status=args.status
+    )
+  logger.info("Exported %s users as %s to %s", count, fmt, args.output)
+  return 0
+
+
+def _import(settings: Settings, args: argparse.Namespace) -> int:
+  fmt = args.format or format_for_path(args.input)
+
+  def report(result: ImportResult) -> None:
+    logger.info(
+      "Imported %s records (created=%s updated=%s failed=%s)",
+      result.processed,
+      result.created,
+      result.updated,
+      result.failed,
+    )
+
+  with _open_text(args.input, "r") as source:
+    result = import_users(settings, source, fmt, batch_size=args.batch_size, progress=report)
+  logger.info(
+    "Import finished: %s records, %s created, %s updated, %s skipped",
+    result.processed,
+    result.created,
+    result.updated,
+    result.failed,
+  )
+  for error in result.errors:
+    logger.warning("Skipped %s", error)
+  if result.failed > len(result.errors):
+    logger.warning("... and %s more invalid records", result.failed - len(result.errors))
+  return 1 if result.failed else 0
+
+
+def _backup(settings: Settings, args: argparse.Namespace) -> int:
+  if args.destination:
+    destination = Path(args.destination)
+  else:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    destination = settings.data_dir / "backups" / f"users-{stamp}.db"
+  last_logged = [-1]
+
+  def report(remaining: int, total: int) -> None:
+    percent = 100 * (total - remaining) // max(total, 1)
+    if percent // 10 != last_logged[0]:
+      last_logged[0] = percent // 10
+      logger.info("Backup %s%% (%s of %s pages)", percent, total - remaining, total)
+
+  backup_database(settings, destination, pages=args.pages, pause=args.pause, progress=report)
+  print(destination)
+  return 0
+
+
+def _maintain(settings: Settings, args: argparse.Namespace) -> int:
+  run_maintenance(settings, force_analyze=args.analyze, checkpoint=args.checkpoint)
+  return 0
+
+
+def _vacuum(settings: Settings, args: argparse.Namespace) -> int:
+  saved = vacuum_database(settings)
+  logger.info("Rebuilt %s with auto_vacuum=INCREMENTAL; %s pages saved", settings.db_path, saved)
+  return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+  parser = argparse.ArgumentParser(prog="manage.py", description="Kity backend maintenance commands.")
+  commands = parser.add_subparsers(dest="command", required=True)
+
+  export = commands.add_parser("export", help="stream users to NDJSON or CSV")
+  export.add_argument("output", nargs="?", default="-", help="file to write, or - for stdout")
+  export.add_argument("--format", choices=EXPORT_FORMATS, help="default: from the file name, else ndjson")
+  export.add_argument("--fields", help="comma-separated user fields (default: all)")
+  export.add_argument("--status", help="only users with this status")
+  export.set_defaults(handler=_export)
+
+  load = commands.add_parser("import", help="upsert users from NDJSON or CSV")
+  load.add_argument("input", nargs="?", default="-", help="file to read, or - for stdin")
+  load.add_argument("--format", choices=EXPORT_FORMATS, help="default: from the file name, else ndjson")
+  load.add_argument("--batch-size", type=int, default=DEFAULT_IMPORT_BATCH, help="rows per transaction")
+  load.set_defaults(handler=_import)
+
+  backup = commands.add_parser("backup", help="snapshot the live database with the online backup API")
+  backup.add_argument("destination", nargs="?", help="default: DATA_DIR/backups/users-<utc time>.db")
+  backup.add_argument("--pages", type=int, default=DEFAULT_BACKUP_PAGES, help="pages copied per step")
+  backup.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between steps")
+  backup.set_defaults(handler=_backup)
+
+  maintain = commands.add_parser("maintenance", help="run the scheduled database maintenance now")
+  maintain.add_argument("--analyze", action="store_true", help="force a full ANALYZE")
+  maintain.add_argument(
+    "--checkpoint",
+    choices=CHECKPOINT_MODES,
+    help="WAL checkpoint mode (default: DB_MAINTENANCE_CHECKPOINT); truncate waits for readers",
+  )
+  maintain.set_defaults(handler=_maintain)
+
+  vacuum = commands.add_parser(
+    "vacuum", help="one-off full VACUUM enabling incremental vacuum (stop the app first)"
+  )
+  vacuum.set_defaults(handler=_vacuum)
+  return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+  args = build_parser().parse_args(argv)
+  settings = load_settings()
+  try:
+    return args.handler(settings, args)
+  except ValueError as exc:
+    logger.error("%s", exc)
+    return 2
+
+
+__all__ = ["main", "build_parser"]
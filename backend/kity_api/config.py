@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import math
 import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
+
+# "web" serves HTTP only, "worker" runs scheduled jobs only, "all" does both.
+APP_ROLES = ("web", "worker", "all")
 
 
 @dataclass
@@ -11,23 +15,95 @@ class Settings:
   port: int
   allowed_origins: List[str]
   extension_origin: str
+  cors_max_age: int
   data_dir: Path
   db_path: Path
+  users_page_max_limit: int
+  users_batch_max_size: int
+  max_body_bytes: int
+  auth_cache_size: int
+  response_cache_size: int
+  idempotency_ttl: float
+  idempotency_cache_size: int
+  response_cache_ttl: float
+  response_cache_max_body_bytes: int
+  auth_cache_ttl: float
+  sqlite_busy_timeout_ms: int
+  sqlite_cache_size_kib: int
   extpay_api_key: str | None
   extpay_sync_url: str | None
   extpay_sync_timeout: float
   extpay_sync_enabled: bool
   extpay_sync_timezone: str
+  extpay_sync_batch_size: int
+  extpay_sync_incremental: bool
+  extpay_sync_cursor_param: str | None
+  extpay_sync_page_param: str | None
+  extpay_sync_page_size_param: str | None
+  extpay_sync_page_size: int
+  extpay_sync_first_page: int
+  extpay_sync_concurrency: int
+  extpay_sync_max_retries: int
+  extpay_sync_backoff: float
   stripe_secret_key: str | None
   stripe_success_url: str
   stripe_cancel_url: str
   stripe_currency: str
   stripe_donation_link: str | None
+  stripe_api_base: str | None
+  stripe_timeout: float
+  stripe_max_retries: int
+  stripe_max_concurrency: int
+  asgi_threads: int
+  rate_limits: Dict[str, Tuple[float, int]]
+  rate_limit_backend: str
+  max_pending_writes: int
+  shed_retry_after: float
+  shed_lock_wait_ms: int
+  write_behind: bool
+  write_behind_window_ms: int
+  write_behind_batch_size: int
+  write_behind_max_pending: int
+  app_role: str
+  job_lease_seconds: int
+  job_history_days: int
+  db_maintenance_vacuum_pages: int
+  db_maintenance_max_seconds: float
+  db_maintenance_checkpoint: str
+  user_counts_daily_after_days: int
+  user_counts_retention_days: int
+  metrics_enabled: bool
+  read_model_enabled: bool
+  read_model_max_staleness_ms: int
+  metrics_allowed_ips: List[str]
+
+
+def parse_rate_limits(value: str) -> Dict[str, Tuple[float, int]]:
+  """
+  Parse `METHOD /rule=rate[:burst]` entries separated by commas, e.g.
+  `POST /users=5:20` allows 5 requests/second per client with bursts of 20.
+  """
+  limits: Dict[str, Tuple[float, int]] = {}
+  for entry in value.split(","):
+    route, sep, spec = entry.strip().rpartition("=")
+    if not sep or not route.strip():
+      continue
+    rate_text, _, burst_text = spec.partition(":")
+    rate = float(rate_text)
+    if rate <= 0:
+      continue
+    burst = int(burst_text) if burst_text else max(1, math.ceil(rate))
+    limits[" ".join(route.split())] = (rate, max(1, burst))
+  return limits
 
 
 def load_settings() -> Settings:
   base_dir = Path(__file__).resolve().parent.parent
-  data_dir = base_dir / "data"
+  data_dir = Path(os.environ.get("DATA_DIR") or base_dir / "data")
+
+  app_role = os.environ.get("APP_ROLE", "all").strip().lower()
+  if app_role not in APP_ROLES:
+    raise ValueError(f"APP_ROLE must be one of {', '.join(APP_ROLES)}, got '{app_role}'")
 
   allowed_env = [
     origin.strip()
@@ -48,14 +124,40 @@ def load_settings() -> Settings:
     extension_origin=os.environ.get(
       "EXTENSION_ORIGIN", "chrome-extension://<your-extension-id>"
     ),
+    cors_max_age=int(os.environ.get("CORS_MAX_AGE", "7200")),
     data_dir=data_dir,
     db_path=data_dir / "users.db",
+    users_page_max_limit=int(os.environ.get("USERS_PAGE_MAX_LIMIT", "1000")),
+    users_batch_max_size=int(os.environ.get("USERS_BATCH_MAX_SIZE", "1000")),
+    max_body_bytes=int(os.environ.get("MAX_BODY_BYTES", str(8 * 1024 * 1024))),
+    auth_cache_size=int(os.environ.get("AUTH_CACHE_SIZE", "10000")),
+    response_cache_size=int(os.environ.get("RESPONSE_CACHE_SIZE", "256")),
+    idempotency_ttl=float(os.environ.get("IDEMPOTENCY_TTL", "86400")),
+    idempotency_cache_size=int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "1024")),
+    response_cache_ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "300")),
+    response_cache_max_body_bytes=int(
+      os.environ.get("RESPONSE_CACHE_MAX_BODY_BYTES", str(4 * 1024 * 1024))
+    ),
+    auth_cache_ttl=float(os.environ.get("AUTH_CACHE_TTL", "60")),
+    sqlite_busy_timeout_ms=int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    sqlite_cache_size_kib=int(os.environ.get("SQLITE_CACHE_SIZE_KIB", "16384")),
     extpay_api_key=os.environ.get("EXTPAY_API_KEY"),
     extpay_sync_url=os.environ.get("EXTPAY_SYNC_URL"),
     extpay_sync_timeout=float(os.environ.get("EXTPAY_SYNC_TIMEOUT", "15")),
     extpay_sync_enabled=os.environ.get("EXTPAY_SYNC_ENABLED", "false").lower()
     in {"1", "true", "yes", "on"},
     extpay_sync_timezone=os.environ.get("EXTPAY_SYNC_TIMEZONE", "UTC"),
+    extpay_sync_batch_size=int(os.environ.get("EXTPAY_SYNC_BATCH_SIZE", "1000")),
+    extpay_sync_incremental=os.environ.get("EXTPAY_SYNC_INCREMENTAL", "false").lower()
+    in {"1", "true", "yes", "on"},
+    extpay_sync_cursor_param=os.environ.get("EXTPAY_SYNC_CURSOR_PARAM") or None,
+    extpay_sync_page_param=os.environ.get("EXTPAY_SYNC_PAGE_PARAM") or None,
+    extpay_sync_page_size_param=os.environ.get("EXTPAY_SYNC_PAGE_SIZE_PARAM") or None,
+    extpay_sync_page_size=int(os.environ.get("EXTPAY_SYNC_PAGE_SIZE", "1000")),
+    extpay_sync_first_page=int(os.environ.get("EXTPAY_SYNC_FIRST_PAGE", "1")),
+    extpay_sync_concurrency=int(os.environ.get("EXTPAY_SYNC_CONCURRENCY", "4")),
+    extpay_sync_max_retries=int(os.environ.get("EXTPAY_SYNC_MAX_RETRIES", "4")),
+    extpay_sync_backoff=float(os.environ.get("EXTPAY_SYNC_BACKOFF", "0.5")),
     stripe_secret_key=os.environ.get("STRIPE_SECRET_KEY"),
     stripe_success_url=os.environ.get(
       "STRIPE_SUCCESS_URL",
@@ -67,4 +169,36 @@ def load_settings() -> Settings:
     ),
     stripe_currency=os.environ.get("STRIPE_CURRENCY", "usd").lower(),
     stripe_donation_link=os.environ.get("STRIPE_DONATION_LINK"),
+    stripe_api_base=os.environ.get("STRIPE_API_BASE") or None,
+    stripe_timeout=float(os.environ.get("STRIPE_TIMEOUT", "10")),
+    stripe_max_retries=int(os.environ.get("STRIPE_MAX_RETRIES", "0")),
+    stripe_max_concurrency=int(os.environ.get("STRIPE_MAX_CONCURRENCY", "4")),
+    asgi_threads=int(os.environ.get("ASGI_THREADS", "16")),
+    rate_limits=parse_rate_limits(
+      os.environ.get("RATE_LIMITS", "POST /users=10:30,POST /users/batch=1:5,POST /donations/checkout=1:5")
+    ),
+    rate_limit_backend=os.environ.get("RATE_LIMIT_BACKEND", "memory").lower(),
+    max_pending_writes=int(os.environ.get("MAX_PENDING_WRITES", "64")),
+    shed_retry_after=float(os.environ.get("SHED_RETRY_AFTER", "1")),
+    shed_lock_wait_ms=int(os.environ.get("SHED_LOCK_WAIT_MS", "250")),
+    write_behind=os.environ.get("WRITE_BEHIND", "false").lower() in {"1", "true", "yes", "on"},
+    write_behind_window_ms=int(os.environ.get("WRITE_BEHIND_WINDOW_MS", "50")),
+    write_behind_batch_size=int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", "500")),
+    write_behind_max_pending=int(os.environ.get("WRITE_BEHIND_MAX_PENDING", "10000")),
+    app_role=app_role,
+    job_lease_seconds=int(os.environ.get("JOB_LEASE_SECONDS", "60")),
+    job_history_days=int(os.environ.get("JOB_HISTORY_DAYS", "90")),
+    db_maintenance_vacuum_pages=int(os.environ.get("DB_MAINTENANCE_VACUUM_PAGES", "256")),
+    db_maintenance_max_seconds=float(os.environ.get("DB_MAINTENANCE_MAX_SECONDS", "30")),
+    db_maintenance_checkpoint=os.environ.get("DB_MAINTENANCE_CHECKPOINT", "passive").lower(),
+    user_counts_daily_after_days=int(os.environ.get("USER_COUNTS_DAILY_AFTER_DAYS", "30")),
+    user_counts_retention_days=int(os.environ.get("USER_COUNTS_RETENTION_DAYS", "0")),
+    metrics_enabled=os.environ.get("METRICS_ENABLED", "true").lower() in {"1", "true", "yes", "on"},
+    read_model_enabled=os.environ.get("READ_MODEL", "false").lower() in {"1", "true", "yes", "on"},
+    read_model_max_staleness_ms=int(os.environ.get("READ_MODEL_MAX_STALENESS_MS", "1000")),
+    metrics_allowed_ips=[
+      ip.strip()
+      for ip in os.environ.get("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+      if ip.strip()
+    ],
   )
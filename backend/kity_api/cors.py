@@ -1,38 +1,111 @@
 from __future__ import annotations
 
-from flask import Flask, request, make_response, jsonify
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from flask import Flask, g, request, make_response, jsonify
 
 from .config import Settings
 
+_EXTENSION_PREFIX = "chrome-extension://"
+
+_policy: "CorsPolicy | None" = None
+_policy_lock = threading.Lock()
+
+
+class CorsPolicy:
+  """
+  Allowed origins compiled once: exact origins go into a frozenset, entries with
+  `*` (e.g. `https://*.kity.app`, or `*.kity.app` for any scheme) into one regex.
+  """
+
+  def __init__(self, settings: Settings) -> None:
+    self.settings = settings
+    exact: set[str] = set()
+    patterns: List[str] = []
+    for origin in [*settings.allowed_origins, settings.extension_origin]:
+      origin = origin.strip().rstrip("/")
+      if not origin:
+        continue
+      if "*" not in origin:
+        exact.add(origin)
+        continue
+      scheme, sep, rest = origin.partition("://")
+      if not sep:
+        scheme, rest = "", origin
+      prefix = re.escape(scheme + "://") if scheme else r"[a-z][a-z0-9+.\-]*://"
+      patterns.append(prefix + r"[^/]*".join(re.escape(part) for part in rest.split("*")))
+
+    self.exact = frozenset(exact)
+    self._pattern = re.compile("|".join(f"(?:{p})" for p in patterns)) if patterns else None
+    self.allows = lru_cache(maxsize=1024)(self._allows)  # type: ignore[method-assign]
+
+    self.headers: Dict[str, str] = {
+      "Access-Control-Allow-Headers": "Content-Type, Authorization, Idempotency-Key, If-None-Match",
+      "Access-Control-Allow-Methods": "GET,POST,OPTIONS",
+      "Access-Control-Expose-Headers": "ETag, Retry-After",
+    }
+    self.preflight_headers = {
+      **self.headers,
+      "Access-Control-Max-Age": str(max(0, settings.cors_max_age)),
+    }
+
+  def _allows(self, origin: Optional[str]) -> bool:
+    if origin is None:
+      return True
+    if origin in self.exact:
+      return True
+    if origin.startswith(_EXTENSION_PREFIX):
+      return True
+    return bool(self._pattern and self._pattern.fullmatch(origin))
+
+
+def get_cors_policy(settings: Settings) -> CorsPolicy:
+  """The policy for `settings`, compiled on first use and shared afterwards."""
+  global _policy
+
+  policy = _policy
+  if policy is None or policy.settings is not settings:
+    with _policy_lock:
+      policy = _policy
+      if policy is None or policy.settings is not settings:
+        policy = _policy = CorsPolicy(settings)
+  return policy
+
 
 def is_origin_allowed(origin: str | None, settings: Settings) -> bool:
-  if origin is None:
-    return True
-  if origin == settings.extension_origin:
-    return True
-  if origin.startswith("chrome-extension://"):
-    return True
-  return origin in settings.allowed_origins
+  return get_cors_policy(settings).allows(origin)
 
 
 def attach_cors(app: Flask, settings: Settings) -> None:
+  policy = get_cors_policy(settings)
+
   @app.before_request
   def _enforce_cors():
+    origin = request.headers.get("Origin")
+    # Decide once per request; the after-request hook reuses it.
+    g.cors_origin_allowed = allowed = policy.allows(origin)
+
     if request.method == "OPTIONS":
       response = make_response("", 204)
-      return _add_cors_headers(response)
+      response.headers.update(policy.preflight_headers)
+      return response
 
-    origin = request.headers.get("Origin")
-    if origin and not is_origin_allowed(origin, settings):
+    if origin and not allowed:
       return jsonify({"error": "Origin not allowed"}), 403
     return None
 
   @app.after_request
   def _add_cors_headers(response):
     origin = request.headers.get("Origin")
-    if is_origin_allowed(origin, settings):
+    allowed = g.get("cors_origin_allowed")
+    if allowed is None:
+      allowed = policy.allows(origin)
+    if allowed:
       response.headers["Access-Control-Allow-Origin"] = origin or "*"
       response.headers["Vary"] = "Origin"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
-    response.headers["Access-Control-Allow-Methods"] = "GET,POST,OPTIONS"
+    if request.method != "OPTIONS":
+      response.headers.update(policy.headers)
     return response
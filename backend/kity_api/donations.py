@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import threading
+from decimal import Decimal, InvalidOperation
+from types import ModuleType
+from typing import Optional
+
+from .config import Settings
+
+_slots: threading.BoundedSemaphore | None = None
+_slots_lock = threading.Lock()
+# The Stripe SDK takes most of a worker's import time, so it is loaded on the first checkout.
+_stripe: Optional[ModuleType] = None
+_stripe_lock = threading.Lock()
+
+
+class CheckoutBusy(RuntimeError):
+  """Raised when the configured number of concurrent Stripe calls is already in flight."""
+
+
+class CheckoutUnavailable(RuntimeError):
+  """Raised when Stripe could not be reached or did not answer in time."""
+
+
+class CheckoutFailed(RuntimeError):
+  """Raised when Stripe rejected the checkout session."""
+
+
+def configure_stripe(settings: Settings) -> ModuleType:
+  import stripe
+
+  if settings.stripe_secret_key:
+    stripe.api_key = settings.stripe_secret_key
+  if settings.stripe_api_base:
+    # Lets a local Stripe stand-in replace api.stripe.com (tests, load runs).
+    stripe.api_base = settings.stripe_api_base
+  # Bound every Stripe call so a slow response can't hold a worker indefinitely.
+  # The timeout applies per attempt, and the SDK retries twice by default, so
+  # retries are off unless configured.
+  stripe.default_http_client = stripe.RequestsClient(timeout=settings.stripe_timeout)
+  stripe.max_network_retries = max(0, settings.stripe_max_retries)
+  return stripe
+
+
+def _get_stripe(settings: Settings) -> ModuleType:
+  global _stripe
+
+  if _stripe is None:
+    with _stripe_lock:
+      if _stripe is None:
+        _stripe = configure_stripe(settings)
+  return _stripe
+
+
+def _get_slots(settings: Settings) -> threading.BoundedSemaphore:
+  global _slots
+
+  if _slots is None:
+    with _slots_lock:
+      if _slots is None:
+        _slots = threading.BoundedSemaphore(max(1, settings.stripe_max_concurrency))
+  return _slots
+
+
+def parse_amount_cents(amount: object) -> int:
+  """Validate a donation amount and convert it to the smallest currency unit."""
+  try:
+    amount_decimal = Decimal(str(amount))
+  except (InvalidOperation, TypeError):
+    raise ValueError("Invalid amount")
+
+  if not amount_decimal.is_finite():
+    raise ValueError("Invalid amount")
+  if amount_decimal <= 0:
+    raise ValueError("Amount must be greater than zero")
+
+  # Convert to smallest currency unit (cents) and enforce two decimal places.
+  return int((amount_decimal * 100).quantize(Decimal("1")))
+
+
+def create_checkout_session(
+  settings: Settings, cents: int, idempotency_key: str | None = None
+) -> str:
+  """
+  Create a Stripe Checkout Session and return its URL.
+  At most `stripe_max_concurrency` calls run at once; extra callers get
+  CheckoutBusy immediately instead of queueing behind a slow Stripe.
+  A client's idempotency key is forwarded so Stripe also dedupes retries.
+  Stripe errors surface as CheckoutUnavailable or CheckoutFailed.
+  """
+  stripe = _get_stripe(settings)
+  slots = _get_slots(settings)
+  if not slots.acquire(blocking=False):
+    raise CheckoutBusy("Too many checkout sessions in progress; retry shortly")
+  try:
+    session = stripe.checkout.Session.create(
+      mode="payment",
+      line_items=[
+        {
+          "price_data": {
+            "currency": settings.stripe_currency,
+            "product_data": {"name": "Kity Support"},
+            "unit_amount": cents,
+          },
+          "quantity": 1,
+        }
+      ],
+      success_url=settings.stripe_success_url,
+      cancel_url=settings.stripe_cancel_url,
+      idempotency_key=idempotency_key or None,
+    )
+  except stripe.error.APIConnectionError as exc:  # type: ignore[attr-defined]
+    raise CheckoutUnavailable(str(exc)) from exc
+  except stripe.error.StripeError as exc:  # type: ignore[attr-defined]
+    raise CheckoutFailed(str(exc)) from exc
+  finally:
+    slots.release()
+  return session.url
+
+
+__all__ = [
+  "CheckoutBusy",
+  "CheckoutUnavailable",
+  "CheckoutFailed",
+  "configure_stripe",
+  "parse_amount_cents",
+  "create_checkout_session",
+]
@@ -1,16 +1,41 @@
 from __future__ import annotations
 
 import logging
-from typing import Dict, Iterable, List, Optional, Tuple
-
-import requests
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
 
 from .config import Settings
-from .storage import STATUS_VALUES, DEFAULT_STATUS, upsert_user
-from .utils import string_or_null
+from .instrumentation import EXTPAY_PHASE_SECONDS, EXTPAY_RETRIES
+from .jsonstream import iter_json_users
+from .normalize import ExtPayNormalizer, NormalizedEntry
+from .storage import (
+  STATUS_VALUES,
+  DEFAULT_STATUS,
+  get_connection,
+  upsert_users_bulk,
+)
+
+if TYPE_CHECKING:
+  import requests
 
 logger = logging.getLogger(__name__)
 
+_STREAM_CHUNK_SIZE = 64 * 1024
+_MAX_BACKOFF = 30.0
+_LOOKUP_BATCH = 500
+_LAST_SUCCESS_KEY = "extpay_last_success"
+
+# requests is imported lazily, so web workers never load it.
+_session: "requests.Session | None" = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
 
 def map_extpay_status(
   status: Optional[str], plan_nickname: Optional[str] = None
@@ -32,96 +57,325 @@ def map_extpay_status(
   return DEFAULT_STATUS
 
 
-def fetch_extensionpay_payload(settings: Settings) -> List[Dict[str, object]]:
+def ensure_sync_tables(settings: Settings) -> None:
+  """Create the tables backing incremental ExtPay syncs if they don't exist."""
+  with get_connection(settings) as conn:
+    conn.execute(
+      """
+      CREATE TABLE IF NOT EXISTS extpay_fingerprints (
+        email TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        synced_at TEXT NOT NULL
+      )
+      """
+    )
+    conn.execute(
+      """
+      CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+      )
+      """
+    )
+
+
+def _read_sync_state(settings: Settings, key: str) -> Optional[str]:
+  with get_connection(settings) as conn:
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+  return row["value"] if row else None
+
+
+def _write_sync_state(settings: Settings, key: str, value: str) -> None:
+  with get_connection(settings) as conn:
+    conn.execute(
+      """
+      INSERT INTO sync_state (key, value) VALUES (?, ?)
+      ON CONFLICT(key) DO UPDATE SET value = excluded.value
+      """,
+      (key, value),
+    )
+
+
+def _load_fingerprints(settings: Settings, emails: Sequence[str]) -> Dict[str, str]:
+  known: Dict[str, str] = {}
+  with get_connection(settings) as conn:
+    for start in range(0, len(emails), _LOOKUP_BATCH):
+      batch = emails[start : start + _LOOKUP_BATCH]
+      placeholders = ", ".join("?" for _ in batch)
+      for row in conn.execute(
+        f"SELECT email, fingerprint FROM extpay_fingerprints WHERE email IN ({placeholders})",
+        batch,
+      ):
+        known[row["email"]] = row["fingerprint"]
+  return known
+
+
+def _store_fingerprints(settings: Settings, pairs: Sequence[Tuple[str, str]]) -> None:
+  synced_at = datetime.now(timezone.utc).isoformat()
+  with get_connection(settings) as conn:
+    conn.executemany(
+      """
+      INSERT INTO extpay_fingerprints (email, fingerprint, synced_at) VALUES (?, ?, ?)
+      ON CONFLICT(email) DO UPDATE SET
+        fingerprint = excluded.fingerprint,
+        synced_at = excluded.synced_at
+      """,
+      [(email, fingerprint, synced_at) for email, fingerprint in pairs],
+    )
+
+
+def _get_session(settings: Settings) -> "requests.Session":
+  """One pooled session per process, sized for the concurrent page fetches."""
+  global _session, _session_pid
+
+  import requests
+  from requests.adapters import HTTPAdapter
+
+  if _session is None or _session_pid != os.getpid():
+    with _session_lock:
+      if _session is None or _session_pid != os.getpid():
+        session = requests.Session()
+        pool_size = max(1, settings.extpay_sync_concurrency)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(
+          {"Authorization": f"Bearer {settings.extpay_api_key}", "Accept": "application/json"}
+        )
+        _session, _session_pid = session, os.getpid()
+  return _session
+
+
+def _backoff_delay(settings: Settings, attempt: int, retry_after: Optional[str]) -> float:
+  if retry_after and retry_after.strip().isdigit():
+    return min(_MAX_BACKOFF, float(retry_after))
+  # Exponential backoff with "equal jitter": half fixed, half random.
+  ceiling = min(_MAX_BACKOFF, settings.extpay_sync_backoff * (2 ** attempt))
+  return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+def _open_response(
+  settings: Settings, params: Optional[Dict[str, str]]
+) -> "requests.Response":
+  """
+  GET the export with retries on connection errors, 429 and 5xx responses.
+  The body is left unread (streamed) for the caller.
+  """
+  import requests
+
+  session = _get_session(settings)
+  attempt = 0
+  while True:
+    retry_after = None
+    try:
+      with EXTPAY_PHASE_SECONDS.timer("request"):
+        resp = session.get(
+          settings.extpay_sync_url,
+          params=params,
+          timeout=settings.extpay_sync_timeout,
+          stream=True,
+        )
+    except (requests.ConnectionError, requests.Timeout) as exc:
+      if attempt >= settings.extpay_sync_max_retries:
+        raise
+      reason = str(exc)
+      EXTPAY_RETRIES.inc(type(exc).__name__)
+    else:
+      retryable = resp.status_code == 429 or resp.status_code >= 500
+      if resp.ok:
+        return resp
+      if not retryable or attempt >= settings.extpay_sync_max_retries:
+        resp.close()
+        resp.raise_for_status()
+      retry_after = resp.headers.get("Retry-After")
+      reason = f"HTTP {resp.status_code}"
+      EXTPAY_RETRIES.inc(str(resp.status_code))
+      resp.close()
+    delay = _backoff_delay(settings, attempt, retry_after)
+    logger.warning(
+      "ExtPay fetch %s failed (%s); retry %s/%s in %.2fs",
+      params or {},
+      reason,
+      attempt + 1,
+      settings.extpay_sync_max_retries,
+      delay,
+    )
+    time.sleep(delay)
+    attempt += 1
+
+
+def _fetch_page(settings: Settings, params: Dict[str, str]) -> List[object]:
+  with _open_response(settings, params) as resp, EXTPAY_PHASE_SECONDS.timer("body"):
+    return list(iter_json_users(resp.iter_content(chunk_size=_STREAM_CHUNK_SIZE)))
+
+
+def _iter_pages(settings: Settings, params: Optional[Dict[str, str]]) -> Iterator[object]:
+  """
+  Fetch numbered pages with up to `extpay_sync_concurrency` requests in flight,
+  yielding entries in page order. An empty page ends the export, and so does a
+  page shorter than `extpay_sync_page_size` when that size is actually sent as
+  `extpay_sync_page_size_param`. Pages already requested past the end are
+  discarded.
+  """
+  page_param = settings.extpay_sync_page_param
+  page_size = max(1, settings.extpay_sync_page_size)
+  base_params = dict(params or {})
+  # Without a page-size parameter the endpoint picks its own page size, so only
+  # an empty page proves the export is over.
+  short_page_ends = bool(settings.extpay_sync_page_size_param)
+  if short_page_ends:
+    base_params[settings.extpay_sync_page_size_param] = str(page_size)
+
+  concurrency = max(1, settings.extpay_sync_concurrency)
+  next_page = settings.extpay_sync_first_page
+  in_flight: Deque[Future] = deque()
+  with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="kity-extpay") as pool:
+    try:
+      while True:
+        while len(in_flight) < concurrency:
+          page_params = {**base_params, page_param: str(next_page)}
+          in_flight.append(pool.submit(_fetch_page, settings, page_params))
+          next_page += 1
+        entries = in_flight.popleft().result()
+        yield from entries
+        if len(entries) > page_size and short_page_ends:
+          # The endpoint ignores the page-size parameter; stop on empty pages instead.
+          logger.warning(
+            "ExtPay returned %s entries for page size %s; ignoring %s",
+            len(entries),
+            page_size,
+            settings.extpay_sync_page_size_param,
+          )
+          short_page_ends = False
+        if not entries or (short_page_ends and len(entries) < page_size):
+          return
+    finally:
+      for future in in_flight:
+        future.cancel()
+
+
+def iter_extensionpay_users(
+  settings: Settings, params: Optional[Dict[str, str]] = None
+) -> Iterator[object]:
+  """
+  Stream the ExtPay user export and yield entries one at a time.
+  Accepts either a top-level list or {"users": [...]} per response. With
+  `extpay_sync_page_param` set, the export is read page by page concurrently.
+  """
   if not settings.extpay_sync_url or not settings.extpay_api_key:
     raise RuntimeError("ExtPay sync URL or API key missing; set EXTPAY_SYNC_URL and EXTPAY_API_KEY")
 
-  headers = {
-    "Authorization": f"Bearer {settings.extpay_api_key}",
-    "Accept": "application/json",
-  }
-  resp = requests.get(
-    settings.extpay_sync_url,
-    headers=headers,
-    timeout=settings.extpay_sync_timeout,
-  )
-  resp.raise_for_status()
-  data = resp.json()
+  if settings.extpay_sync_page_param:
+    yield from _iter_pages(settings, params)
+    return
 
-  # Accept either a top-level list or {"users": [...]}
-  if isinstance(data, list):
-    return data  # type: ignore[return-value]
-  users = data.get("users") or []
-  if not isinstance(users, Iterable):
-    raise RuntimeError("Unexpected ExtPay response shape; expected a list of users")
-  return list(users)  # type: ignore[arg-type]
+  # The body of a single streamed export is read as the sync consumes it, so its
+  # time shows up in the sync job rather than as a separate fetch phase.
+  with _open_response(settings, params) as resp:
+    yield from iter_json_users(resp.iter_content(chunk_size=_STREAM_CHUNK_SIZE))
+
+
+def fetch_extensionpay_payload(settings: Settings) -> List[object]:
+  return list(iter_extensionpay_users(settings))
 
 
 def sync_extensionpay_users(settings: Settings) -> Tuple[int, int, List[str]]:
   """
   Pull users from ExtensionPay and upsert into our DB.
+  Entries are validated up front and written in chunks of
+  `extpay_sync_batch_size`, one transaction per chunk. In incremental mode,
+  entries whose fingerprint is unchanged since the last sync are skipped.
   Returns (created_count, updated_count, errors).
   """
   created = 0
   updated = 0
+  skipped = 0
+  failed = False
   errors: List[str] = []
 
+  incremental = settings.extpay_sync_incremental
+  request_params: Dict[str, str] = {}
+  if incremental:
+    ensure_sync_tables(settings)
+    cursor_param = settings.extpay_sync_cursor_param
+    last_success = _read_sync_state(settings, _LAST_SUCCESS_KEY)
+    if cursor_param and last_success:
+      request_params[cursor_param] = last_success
+  run_started_at = datetime.now(timezone.utc).isoformat()
+
+  batch_size = max(1, settings.extpay_sync_batch_size)
+  started = time.perf_counter()
+  normalizer = ExtPayNormalizer()
+  raw_chunk: List[Tuple[int, object]] = []
+  chunk: List[NormalizedEntry] = []
+
+  def flush() -> None:
+    nonlocal created, updated, skipped, failed, chunk
+    chunk, invalid = normalizer.normalize_batch(raw_chunk)
+    raw_chunk.clear()
+    errors.extend(invalid)
+    if not chunk:
+      return
+    pending = chunk
+    try:
+      if incremental:
+        known = _load_fingerprints(settings, [params["email"] for _, params, _ in chunk])
+        pending = [item for item in chunk if known.get(item[1]["email"]) != item[2]]
+        skipped += len(chunk) - len(pending)
+      flags = upsert_users_bulk(settings, [params for _, params, _ in pending])
+      if incremental and pending:
+        _store_fingerprints(
+          settings, [(params["email"], fingerprint) for _, params, fingerprint in pending]
+        )
+    except Exception as exc:  # pragma: no cover - defensive logging
+      logger.exception(
+        "ExtPay sync failed to write entries %s-%s: %s",
+        chunk[0][0],
+        chunk[-1][0],
+        exc,
+      )
+      errors.extend(f"[{idx}] {exc}" for idx, _, _ in chunk)
+      failed = True
+    else:
+      was_created = sum(flags)
+      created += was_created
+      updated += len(flags) - was_created
+      logger.debug("ExtPay sync applied %s users (created=%s)", len(flags), was_created)
+    chunk.clear()
+
+  # Entries are consumed straight off the HTTP stream, so memory stays bounded
+  # by one chunk no matter how large the export is.
   try:
-    payload = fetch_extensionpay_payload(settings)
+    for idx, entry in enumerate(iter_extensionpay_users(settings, request_params or None)):
+      raw_chunk.append((idx, entry))
+      if len(raw_chunk) >= batch_size:
+        flush()
   except Exception as exc:  # pragma: no cover - network error handling
     logger.exception("ExtPay sync failed to fetch payload: %s", exc)
-    return created, updated, [str(exc)]
+    errors.append(str(exc))
+    failed = True
+  if raw_chunk:
+    flush()
 
-  for idx, entry in enumerate(payload):
-    try:
-      email = string_or_null(entry.get("email")) if isinstance(entry, dict) else None
-      if not email:
-        errors.append(f"[{idx}] missing email")
-        continue
-
-      name = string_or_null(entry.get("name") if isinstance(entry, dict) else None)
-      trial_started_at = (
-        entry.get("trialStartedAt")  # type: ignore[union-attr]
-        if isinstance(entry, dict)
-        else None
-      ) or (entry.get("trial_started_at") if isinstance(entry, dict) else None)
-      subscription_started_at = (
-        entry.get("subscriptionStartedAt")  # type: ignore[union-attr]
-        if isinstance(entry, dict)
-        else None
-      ) or (entry.get("subscription_started_at") if isinstance(entry, dict) else None)
-
-      plan = (
-        entry.get("planNickname")
-        if isinstance(entry, dict)
-        else None
-      ) or (entry.get("plan") if isinstance(entry, dict) else None)
-      raw_status = (
-        entry.get("status")
-        if isinstance(entry, dict)
-        else None
-      ) or (entry.get("planStatus") if isinstance(entry, dict) else None)
-
-      status = map_extpay_status(raw_status, plan_nickname=plan)
-
-      record, was_created = upsert_user(
-        settings=settings,
-        email=email,
-        name=name,
-        status=status,
-        trial_started_at=trial_started_at,
-        subscription_started_at=subscription_started_at,
-      )
-      if was_created:
-        created += 1
-      else:
-        updated += 1
-      logger.debug("ExtPay sync applied user %s (created=%s)", record["email"], was_created)
-    except Exception as exc:  # pragma: no cover - defensive logging
-      logger.exception("ExtPay sync failed for entry %s: %s", idx, exc)
-      errors.append(f"[{idx}] {exc}")
+  # Only advance the cursor when the export was read to its end and every
+  # fetched entry made it to the database.
+  if incremental and not failed:
+    _write_sync_state(settings, _LAST_SUCCESS_KEY, run_started_at)
 
+  elapsed = time.perf_counter() - started
+  written = created + updated
+  logger.info(
+    "ExtPay sync wrote %s users in %.2fs (%.0f rows/s; created=%s, updated=%s, "
+    "unchanged=%s, errors=%s)",
+    written,
+    elapsed,
+    written / elapsed if elapsed > 0 else 0.0,
+    created,
+    updated,
+    skipped,
+    len(errors),
+  )
   return created, updated, errors
 
 
-__all__ = ["sync_extensionpay_users", "map_extpay_status"]
+__all__ = ["sync_extensionpay_users", "map_extpay_status", "ensure_sync_tables"]
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import hashlib
+from datetime import datetime
+from typing import Any, Callable, Hashable, Optional
+
+from flask import Response, current_app, request
+
+from .cache import TTLCache
+from .instrumentation import record_cache_lookup
+
+
+def make_etag(*parts: object) -> str:
+  """Derive a strong ETag value from the inputs that fully determine a response body."""
+  digest = hashlib.blake2b(digest_size=12)
+  for part in parts:
+    digest.update(str(part).encode("utf-8"))
+    digest.update(b"\x1f")
+  return digest.hexdigest()
+
+
+def is_not_modified(etag: str, last_modified: Optional[datetime] = None) -> bool:
+  """Evaluate If-None-Match / If-Modified-Since against validators known before building a body."""
+  if request.if_none_match:
+    return request.if_none_match.contains(etag)
+  since = request.if_modified_since
+  if since is not None and last_modified is not None:
+    return last_modified.replace(microsecond=0) <= since
+  return False
+
+
+def add_validators(
+  response: Response, etag: str, last_modified: Optional[datetime] = None
+) -> Response:
+  response.set_etag(etag)
+  if last_modified is not None:
+    response.last_modified = last_modified
+  response.headers["Cache-Control"] = "no-cache"
+  return response
+
+
+def not_modified_response(etag: str, last_modified: Optional[datetime] = None) -> Response:
+  return add_validators(Response(status=304), etag, last_modified)
+
+
+class ResponseCache:
+  """
+  Serialized JSON bodies keyed by route and query parameters. An entry is only
+  served while the store generation it was built from is still current.
+  """
+
+  def __init__(self, maxsize: int, ttl: float, max_body_bytes: int) -> None:
+    self._entries = TTLCache(maxsize, ttl)
+    self.max_body_bytes = max_body_bytes
+
+  def json_response(
+    self, key: Hashable, generation: int, build: Callable[[], Any]
+  ) -> Response:
+    """
+    Answer a cacheable GET: 304 when the client already holds this generation,
+    otherwise the cached body or a freshly serialized one.
+    """
+    etag = make_etag(generation, key)
+    if is_not_modified(etag):
+      return not_modified_response(etag)
+
+    entry = self._entries.get(key)
+    # An entry from an older generation counts as a miss.
+    hit = entry is not None and entry[0] == generation
+    record_cache_lookup("responses", hit)
+    if hit:
+      body = entry[1]
+    else:
+      body = current_app.json.dumps(build()).encode("utf-8") + b"\n"
+      if len(body) <= self.max_body_bytes:
+        self._entries.set(key, (generation, body))
+    return add_validators(Response(body, mimetype="application/json"), etag)
+
+
+def static_json_response(body: bytes, etag: str, status: int = 200) -> Response:
+  """Serve a body serialized once up front, honouring If-None-Match."""
+  if status == 200 and is_not_modified(etag):
+    return not_modified_response(etag)
+  return add_validators(Response(body, status=status, mimetype="application/json"), etag)
+
+
+__all__ = [
+  "make_etag",
+  "is_not_modified",
+  "add_validators",
+  "not_modified_response",
+  "ResponseCache",
+  "static_json_response",
+]
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import hashlib
+import itertools
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, NamedTuple, Optional
+
+from flask import Response, jsonify, make_response, request
+
+from .cache import TTLCache
+from .config import Settings
+from .storage import get_connection
+
+HEADER = "Idempotency-Key"
+_MAX_KEY_LENGTH = 255
+# Expired rows are purged on every Nth stored response rather than on every write.
+_PURGE_EVERY = 100
+# A key is reserved with a placeholder row (status 0) while its first request
+# runs. The reservation lapses after this many seconds, so a worker that dies
+# mid-request cannot block the key until IDEMPOTENCY_TTL.
+_PENDING = 0
+_PENDING_TTL = 120.0
+
+_front_cache: TTLCache | None = None
+_front_cache_lock = threading.Lock()
+_store_counter = itertools.count(1)
+
+
+class StoredResponse(NamedTuple):
+  fingerprint: str
+  status: int
+  body: bytes
+  mimetype: str
+
+
+def ensure_idempotency_table(settings: Settings) -> None:
+  """Create the idempotency_keys table if it doesn't exist."""
+  with get_connection(settings) as conn:
+    conn.execute(
+      """
+      CREATE TABLE IF NOT EXISTS idempotency_keys (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        status INTEGER NOT NULL,
+        body BLOB NOT NULL,
+        mimetype TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (scope, key)
+      )
+      """
+    )
+    conn.execute(
+      "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at)"
+    )
+
+
+def _get_front_cache(settings: Settings) -> TTLCache:
+  global _front_cache
+
+  if _front_cache is None:
+    with _front_cache_lock:
+      if _front_cache is None:
+        _front_cache = TTLCache(
+          settings.idempotency_cache_size, settings.idempotency_ttl, name="idempotency"
+        )
+  return _front_cache
+
+
+def lookup_response(settings: Settings, scope: str, key: str) -> Optional[StoredResponse]:
+  cache = _get_front_cache(settings)
+  stored = cache.get((scope, key))
+  if stored is not None:
+    return stored
+  with get_connection(settings) as conn:
+    row = conn.execute(
+      """
+      SELECT fingerprint, status, body, mimetype FROM idempotency_keys
+      WHERE scope = ? AND key = ? AND expires_at > ?
+      """,
+      (scope, key, time.time()),
+    ).fetchone()
+  if not row:
+    return None
+  stored = StoredResponse(row["fingerprint"], row["status"], bytes(row["body"]), row["mimetype"])
+  if stored.status != _PENDING:
+    cache.set((scope, key), stored)
+  return stored
+
+
+def reserve_key(settings: Settings, scope: str, key: str, fingerprint: str) -> bool:
+  """
+  Claim `key` for a request that is about to run. Returns False if another
+  request already holds it or has stored a response for it.
+  """
+  now = time.time()
+  with get_connection(settings) as conn:
+    claimed = conn.execute(
+      """
+      INSERT INTO idempotency_keys (scope, key, fingerprint, status, body, mimetype, expires_at)
+      VALUES (?, ?, ?, ?, X'', '', ?)
+      ON CONFLICT (scope, key) DO UPDATE SET
+        fingerprint = excluded.fingerprint,
+        status = excluded.status,
+        body = excluded.body,
+        mimetype = excluded.mimetype,
+        expires_at = excluded.expires_at
+      WHERE idempotency_keys.expires_at <= ?
+      """,
+      (scope, key, fingerprint, _PENDING, now + _PENDING_TTL, now),
+    ).rowcount
+  return claimed > 0
+
+
+def release_key(settings: Settings, scope: str, key: str, fingerprint: str) -> None:
+  """Drop a reservation whose request produced no response worth storing."""
+  with get_connection(settings) as conn:
+    conn.execute(
+      "DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND fingerprint = ? AND status = ?",
+      (scope, key, fingerprint, _PENDING),
+    )
+
+
+def store_response(settings: Settings, scope: str, key: str, stored: StoredResponse) -> None:
+  now = time.time()
+  with get_connection(settings) as conn:
+    conn.execute(
+      """
+      INSERT OR REPLACE INTO idempotency_keys
+        (scope, key, fingerprint, status, body, mimetype, expires_at)
+      VALUES (?, ?, ?, ?, ?, ?, ?)
+      """,
+      (scope, key, stored.fingerprint, stored.status, stored.body, stored.mimetype,
+       now + settings.idempotency_ttl),
+    )
+    if next(_store_counter) % _PURGE_EVERY == 0:
+      conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+  _get_front_cache(settings).set((scope, key), stored)
+
+
+def idempotent(settings: Settings, scope: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+  """
+  Honour an `Idempotency-Key` header on a POST route: the first response for a key
+  is stored, and retries with the same key and body replay it without running the
+  view again. The key is reserved before the view runs, so a duplicate that
+  arrives meanwhile gets `409` instead of running it twice. Server errors are
+  not stored so they can be retried.
+  """
+
+  def decorator(view: Callable[..., Any]) -> Callable[..., Any]:
+    @wraps(view)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+      key = (request.headers.get(HEADER) or "").strip()
+      if not key:
+        return view(*args, **kwargs)
+      if len(key) > _MAX_KEY_LENGTH:
+        return jsonify({"error": f"{HEADER} must be at most {_MAX_KEY_LENGTH} characters"}), 400
+
+      fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+      stored = lookup_response(settings, scope, key)
+      if stored is None and not reserve_key(settings, scope, key, fingerprint):
+        # Lost the race to a concurrent request with the same key.
+        stored = lookup_response(settings, scope, key)
+        if stored is None:
+          stored = StoredResponse(fingerprint, _PENDING, b"", "")
+      if stored is not None:
+        if stored.fingerprint != fingerprint:
+          return jsonify({"error": f"{HEADER} was already used with a different request body"}), 422
+        if stored.status == _PENDING:
+          conflict = jsonify({"error": f"A request with this {HEADER} is still in progress"})
+          conflict.status_code = 409
+          conflict.headers["Retry-After"] = "1"
+          return conflict
+        replay = Response(stored.body, status=stored.status, mimetype=stored.mimetype)
+        replay.headers["Idempotent-Replayed"] = "true"
+        return replay
+
+      try:
+        response = make_response(view(*args, **kwargs))
+      except BaseException:
+        release_key(settings, scope, key, fingerprint)
+        raise
+      if response.status_code < 500 and response.status_code != 429 and not response.is_streamed:
+        store_response(
+          settings,
+          scope,
+          key,
+          StoredResponse(fingerprint, response.status_code, response.get_data(), response.mimetype),
+        )
+      else:
+        release_key(settings, scope, key, fingerprint)
+      return response
+
+    return wrapper
+
+  return decorator
+
+
+__all__ = [
+  "idempotent",
+  "ensure_idempotency_table",
+  "lookup_response",
+  "store_response",
+  "reserve_key",
+  "release_key",
+  "HEADER",
+]
@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+  from flask import Flask
+
+  from .config import Settings
+
+# Seconds; spans sub-millisecond SQLite reads up to slow ExtPay syncs.
+DEFAULT_BUCKETS = (
+  0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+# Off when METRICS_ENABLED is false: counters, histograms and the storage timers
+# then skip their work entirely, not just the /metrics endpoint.
+_recording = True
+
+
+def set_recording(enabled: bool) -> None:
+  """Turn metric recording on or off for this process."""
+  global _recording
+
+  _recording = enabled
+
+
+def _escape(value: str) -> str:
+  return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+  pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+  if extra:
+    pairs.append(extra)
+  return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+  if value == float("inf"):
+    return "+Inf"
+  return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+  """Monotonic counter with an optional fixed set of label names."""
+
+  kind = "counter"
+
+  def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+    self.name = name
+    self.help = help_text
+    self.labelnames = tuple(labelnames)
+    self._values: Dict[Labels, float] = {}
+    self._lock = threading.Lock()
+
+  def inc(self, *labels: str, amount: float = 1.0) -> None:
+    if not _recording:
+      return
+    with self._lock:
+      self._values[labels] = self._values.get(labels, 0.0) + amount
+
+  def value(self, *labels: str) -> float:
+    return self._values.get(labels, 0.0)
+
+  def samples(self) -> Iterator[str]:
+    with self._lock:
+      items = list(self._values.items())
+    for labels, value in items:
+      yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge:
+  """Value read from a callback when metrics are scraped."""
+
+  kind = "gauge"
+
+  def __init__(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+    self.name = name
+    self.help = help_text
+    self.read = read
+
+  def samples(self) -> Iterator[str]:
+    yield f"{self.name} {_format_value(self.read())}"
+
+
+class Histogram:
+  """Cumulative-bucket histogram; `observe` is one bisect and one lock hold."""
+
+  kind = "histogram"
+
+  def __init__(
+    self,
+    name: str,
+    help_text: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+  ) -> None:
+    self.name = name
+    self.help = help_text
+    self.labelnames = tuple(labelnames)
+    self.buckets = tuple(sorted(buckets))
+    # labels -> [per-bucket counts..., +Inf count], sum
+    self._series: Dict[Labels, Tuple[List[int], List[float]]] = {}
+    self._lock = threading.Lock()
+
+  def observe(self, value: float, *labels: str) -> None:
+    if not _recording:
+      return
+    index = bisect_left(self.buckets, value)
+    with self._lock:
+      series = self._series.get(labels)
+      if series is None:
+        series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+      series[0][index] += 1
+      series[1][0] += value
+
+  @contextmanager
+  def timer(self, *labels: str) -> Iterator[None]:
+    if not _recording:
+      yield
+      return
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - started, *labels)
+
+  def count(self, *labels: str) -> int:
+    series = self._series.get(labels)
+    return sum(series[0]) if series else 0
+
+  def samples(self) -> Iterator[str]:
+    with self._lock:
+      items = [(labels, list(counts), total[0]) for labels, (counts, total) in self._series.items()]
+    for labels, counts, total in items:
+      cumulative = 0
+      for bound, count in zip((*self.buckets, float("inf")), counts):
+        cumulative += count
+        le = f'le="{_format_value(bound)}"'
+        yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+      yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+      yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+  def __init__(self) -> None:
+    self._metrics: Dict[str, Any] = {}
+    self._lock = threading.Lock()
+
+  def register(self, metric: Any) -> Any:
+    with self._lock:
+      # Re-registering (e.g. a second create_app) keeps the first instance.
+      return self._metrics.setdefault(metric.name, metric)
+
+  def render(self) -> str:
+    lines: List[str] = []
+    for metric in list(self._metrics.values()):
+      lines.append(f"# HELP {metric.name} {metric.help}")
+      lines.append(f"# TYPE {metric.name} {metric.kind}")
+      lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+  return REGISTRY.register(Counter(name, help_text, labelnames))
+
+
+def histogram(
+  name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+) -> Histogram:
+  return REGISTRY.register(Histogram(name, help_text, labelnames, buckets))
+
+
+def gauge(name: str, help_text: str, read: Callable[[], float]) -> Gauge:
+  return REGISTRY.register(Gauge(name, help_text, read))
+
+
+HTTP_REQUEST_SECONDS = histogram(
+  "kity_http_request_duration_seconds",
+  "Time spent handling a request, by route template.",
+  ("method", "route", "status"),
+)
+STORAGE_CALL_SECONDS = histogram(
+  "kity_storage_call_duration_seconds",
+  "Time spent in storage-layer calls.",
+  ("operation",),
+)
+STORAGE_CALL_ERRORS = counter(
+  "kity_storage_call_errors_total", "Storage-layer calls that raised.", ("operation",)
+)
+SQLITE_CONNECTIONS = counter(
+  "kity_sqlite_connection_requests_total",
+  "Pooled connection lookups; result is hit (reused) or miss (newly opened).",
+  ("database", "result"),
+)
+CACHE_REQUESTS = counter(
+  "kity_cache_requests_total", "In-process cache lookups by result.", ("cache", "result")
+)
+EXTPAY_PHASE_SECONDS = histogram(
+  "kity_extpay_fetch_phase_duration_seconds",
+  "ExtPay fetch time per request: `request` until response headers, `body` to download and parse.",
+  ("phase",),
+)
+EXTPAY_RETRIES = counter(
+  "kity_extpay_retries_total", "ExtPay requests retried, by reason.", ("reason",)
+)
+JOB_SECONDS = histogram(
+  "kity_job_duration_seconds",
+  "Scheduled job run time, by job and outcome.",
+  ("job", "status"),
+)
+JOB_ROWS = counter("kity_job_rows_processed_total", "Rows processed by scheduled jobs.", ("job",))
+RATE_LIMITED = counter(
+  "kity_rate_limited_requests_total", "Requests rejected with 429 or shed with 503.", ("route", "reason")
+)
+
+
+def timed(operation: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+  """Record the wall time and failures of a storage-layer function."""
+
+  def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+      if not _recording:
+        return func(*args, **kwargs)
+      started = time.perf_counter()
+      try:
+        return func(*args, **kwargs)
+      except Exception:
+        STORAGE_CALL_ERRORS.inc(operation)
+        raise
+      finally:
+        STORAGE_CALL_SECONDS.observe(time.perf_counter() - started, operation)
+
+    return wrapper
+
+  return decorator
+
+
+def record_cache_lookup(cache: Optional[str], hit: bool) -> None:
+  if cache:
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+def render_metrics() -> str:
+  return REGISTRY.render()
+
+
+def attach_instrumentation(app: Flask, settings: Settings) -> None:
+  """
+  Time every request by route template and serve all metrics in Prometheus text
+  format at /metrics, answering only `metrics_allowed_ips` (loopback by default).
+  """
+  from flask import Response, abort, g, request
+
+  allowed_ips = frozenset(settings.metrics_allowed_ips)
+
+  @app.before_request
+  def _start_timer():
+    g.request_started = time.perf_counter()
+
+  @app.after_request
+  def _observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+      route = request.url_rule.rule if request.url_rule else "<unmatched>"
+      HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - started, request.method, route, str(response.status_code)
+      )
+    return response
+
+  @app.route("/metrics", methods=["GET"])
+  def metrics():
+    if request.remote_addr not in allowed_ips:
+      abort(404)
+    return Response(render_metrics(), mimetype=PROMETHEUS_MIMETYPE)
+
+
+__all__ = [
+  "Counter",
+  "Gauge",
+  "Histogram",
+  "REGISTRY",
+  "counter",
+  "gauge",
+  "histogram",
+  "timed",
+  "set_recording",
+  "record_cache_lookup",
+  "render_metrics",
+  "attach_instrumentation",
+  "PROMETHEUS_MIMETYPE",
+  "HTTP_REQUEST_SECONDS",
+  "STORAGE_CALL_SECONDS",
+  "STORAGE_CALL_ERRORS",
+  "SQLITE_CONNECTIONS",
+  "CACHE_REQUESTS",
+  "EXTPAY_PHASE_SECONDS",
+  "EXTPAY_RETRIES",
+  "JOB_SECONDS",
+  "JOB_ROWS",
+  "RATE_LIMITED",
+]
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from .config import Settings
+from .instrumentation import JOB_ROWS, JOB_SECONDS
+from .storage import close_connections, get_connection
+
+logger = logging.getLogger(__name__)
+
+# What a job reports back: rows it processed and any per-row errors worth keeping.
+JobResult = Tuple[int, List[str]]
+
+_MAX_STORED_ERRORS = 20
+_owners: dict[int, str] = {}
+
+
+def owner_id() -> str:
+  """
+  Identity used for leases, unique per process (and per fork, so gunicorn workers
+  forked from one parent never share it).
+  """
+  pid = os.getpid()
+  if pid not in _owners:
+    _owners[pid] = f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}"
+  return _owners[pid]
+
+
+def ensure_job_tables(settings: Settings) -> None:
+  """Create the job lease and run history tables if they don't exist."""
+  with get_connection(settings) as conn:
+    conn.execute(
+      """
+      CREATE TABLE IF NOT EXISTS job_leases (
+        job_id TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        run_id INTEGER,
+        expires_at REAL NOT NULL
+      )
+      """
+    )
+    conn.execute(
+      """
+      CREATE TABLE IF NOT EXISTS job_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id TEXT NOT NULL,
+        firing TEXT NOT NULL,
+        owner TEXT NOT NULL,
+        status TEXT NOT NULL,
+        started_at TEXT NOT NULL,
+        finished_at TEXT,
+        duration_ms REAL,
+        rows_processed INTEGER,
+        error TEXT,
+        UNIQUE (job_id, firing)
+      )
+      """
+    )
+
+
+def _firing_key(now: float) -> str:
+  # Cron jobs fire on whole minutes, so every worker woken by the same firing
+  # derives the same key even if their clocks tick a little apart.
+  return datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%dT%H:%MZ")
+
+
+def _acquire_lease(settings: Settings, job_id: str, firing: str) -> Optional[int]:
+  """
+  Take the job's lease and claim this firing in one transaction.
+  Returns the new job_runs id, or None when another process holds the lease or
+  has already claimed the firing.
+  """
+  now = time.time()
+  started_at = datetime.now(timezone.utc).isoformat()
+  owner = owner_id()
+  with get_connection(settings) as conn:
+    conn.execute("BEGIN IMMEDIATE")
+    lease = conn.execute(
+      "SELECT owner, run_id, expires_at FROM job_leases WHERE job_id = ?", (job_id,)
+    ).fetchone()
+    if lease and lease["expires_at"] > now:
+      return None
+    if lease and lease["run_id"] is not None:
+      # The previous holder stopped heartbeating without finishing its run.
+      conn.execute(
+        "UPDATE job_runs SET status = 'abandoned' WHERE id = ? AND status = 'running'",
+        (lease["run_id"],),
+      )
+    row = conn.execute(
+      """
+      INSERT INTO job_runs (job_id, firing, owner, status, started_at)
+      VALUES (?, ?, ?, 'running', ?)
+      ON CONFLICT (job_id, firing) DO NOTHING
+      RETURNING id
+      """,
+      (job_id, firing, owner, started_at),
+    ).fetchone()
+    if row is None:
+      return None
+    conn.execute(
+      """
+      INSERT INTO job_leases (job_id, owner, run_id, expires_at) VALUES (?, ?, ?, ?)
+      ON CONFLICT (job_id) DO UPDATE SET
+        owner = excluded.owner, run_id = excluded.run_id, expires_at = excluded.expires_at
+      """,
+      (job_id, owner, row["id"], now + settings.job_lease_seconds),
+    )
+  return row["id"]
+
+
+def _heartbeat(settings: Settings, job_id: str, stop: threading.Event) -> None:
+  interval = max(1.0, settings.job_lease_seconds / 3)
+  owner = owner_id()
+  try:
+    while not stop.wait(interval):
+      with get_connection(settings) as conn:
+        renewed = conn.execute(
+          "UPDATE job_leases SET expires_at = ? WHERE job_id = ? AND owner = ?",
+          (time.time() + settings.job_lease_seconds, job_id, owner),
+        ).rowcount
+      if not renewed:
+        logger.warning("Lost the lease for job %s while it was still running", job_id)
+        return
+  except Exception:
+    logger.exception("Heartbeat for job %s failed", job_id)
+  finally:
+    close_connections()
+
+
+def _finish_run(
+  settings: Settings,
+  job_id: str,
+  run_id: int,
+  status: str,
+  duration_ms: float,
+  rows: Optional[int],
+  errors: List[str],
+) -> None:
+  error = "\n".join(errors[:_MAX_STORED_ERRORS]) or None
+  if len(errors) > _MAX_STORED_ERRORS:
+    error += f"\n... and {len(errors) - _MAX_STORED_ERRORS} more"
+  with get_connection(settings) as conn:
+    conn.execute(
+      """
+      UPDATE job_runs
+      SET status = ?, finished_at = ?, duration_ms = ?, rows_processed = ?, error = ?
+      WHERE id = ?
+      """,
+      (status, datetime.now(timezone.utc).isoformat(), round(duration_ms, 3), rows, error, run_id),
+    )
+    conn.execute("DELETE FROM job_leases WHERE job_id = ? AND owner = ?", (job_id, owner_id()))
+    if settings.job_history_days > 0:
+      cutoff = datetime.fromtimestamp(
+        time.time() - settings.job_history_days * 86400, timezone.utc
+      ).isoformat()
+      conn.execute(
+        "DELETE FROM job_runs WHERE job_id = ? AND started_at < ?", (job_id, cutoff)
+      )
+
+
+def run_exclusive(
+  settings: Settings, job_id: str, job: Callable[[], JobResult], firing: Optional[str] = None
+) -> Optional[int]:
+  """
+  Run `job` only if this process wins its lease for the current cron firing, so
+  N workers woken at the same time run it once between them. The lease is kept
+  alive by a heartbeat while the job runs, and every run is recorded in job_runs.
+  Returns the job_runs id, or None when the run was left to another process.
+  """
+  firing = firing or _firing_key(time.time())
+  run_id = _acquire_lease(settings, job_id, firing)
+  if run_id is None:
+    logger.info("Job %s (%s) is running or ran elsewhere; skipping", job_id, firing)
+    return None
+
+  stop = threading.Event()
+  heartbeat = threading.Thread(
+    target=_heartbeat, args=(settings, job_id, stop), name=f"kity-lease-{job_id}", daemon=True
+  )
+  heartbeat.start()
+  started = time.perf_counter()
+  status, rows, errors = "ok", None, []
+  try:
+    rows, errors = job()
+    if errors:
+      status = "partial"
+  except Exception as exc:
+    status, errors = "error", [f"{type(exc).__name__}: {exc}"]
+    logger.exception("Job %s (%s) failed", job_id, firing)
+  finally:
+    stop.set()
+    heartbeat.join()
+    duration_ms = (time.perf_counter() - started) * 1000
+    JOB_SECONDS.observe(duration_ms / 1000, job_id, status)
+    if rows:
+      JOB_ROWS.inc(job_id, amount=rows)
+    _finish_run(settings, job_id, run_id, status, duration_ms, rows, errors)
+  logger.info(
+    "Job %s (%s) finished: %s, %s rows in %.0f ms", job_id, firing, status, rows, duration_ms
+  )
+  return run_id
+
+
+def read_job_runs(settings: Settings, job_id: Optional[str] = None, limit: int = 50) -> List[dict]:
+  """Most recent runs first, optionally for one job."""
+  query = "SELECT * FROM job_runs"
+  params: list = []
+  if job_id:
+    query += " WHERE job_id = ?"
+    params.append(job_id)
+  query += " ORDER BY id DESC LIMIT ?"
+  params.append(limit)
+  with get_connection(settings) as conn:
+    return [dict(row) for row in conn.execute(query, params)]
+
+
+__all__ = ["ensure_job_tables", "run_exclusive", "read_job_runs", "JobResult", "owner_id"]
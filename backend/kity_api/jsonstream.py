@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import codecs
+import json
+from typing import Any, Iterable, Iterator
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_TAIL = "0123456789.eE+-"
+_SHAPE_ERROR = "Unexpected ExtPay response shape; expected a list of users"
+
+_decoder = json.JSONDecoder()
+
+
+class _TextReader:
+  """Incrementally decoded text buffer over an iterable of byte chunks."""
+
+  def __init__(self, chunks: Iterable[bytes]) -> None:
+    self._chunks = iter(chunks)
+    self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    self.buf = ""
+    self.pos = 0
+    self.eof = False
+
+  def fill(self) -> None:
+    """Append the next decoded chunk, dropping text that was already consumed."""
+    for chunk in self._chunks:
+      text = self._decoder.decode(chunk)
+      if text:
+        self.buf = self.buf[self.pos :] + text
+        self.pos = 0
+        return
+    self.buf = self.buf[self.pos :] + self._decoder.decode(b"", final=True)
+    self.pos = 0
+    self.eof = True
+
+  def peek(self) -> str:
+    """Return the next non-whitespace character without consuming it ('' at end)."""
+    while True:
+      while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+        self.pos += 1
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if self.eof:
+        return ""
+      self.fill()
+
+  def take(self) -> str:
+    char = self.peek()
+    if not char:
+      raise ValueError("Unexpected end of JSON stream")
+    self.pos += 1
+    return char
+
+  def value(self) -> Any:
+    """Decode the next complete JSON value, reading more input as needed."""
+    self.peek()
+    while True:
+      try:
+        value, end = _decoder.raw_decode(self.buf, self.pos)
+      except json.JSONDecodeError:
+        if self.eof:
+          raise
+        self.fill()
+        continue
+      # A number cut at the buffer edge ("12" of "12.5e3") decodes early; only trust
+      # the end offset once a character that cannot continue a number follows it.
+      if not self.eof and (end == len(self.buf) or self.buf[end] in _NUMBER_TAIL):
+        self.fill()
+        continue
+      self.pos = end
+      return value
+
+
+def _iter_array(reader: _TextReader) -> Iterator[Any]:
+  if reader.take() != "[":
+    raise RuntimeError(_SHAPE_ERROR)
+  if reader.peek() == "]":
+    reader.take()
+    return
+  while True:
+    yield reader.value()
+    separator = reader.take()
+    if separator == "]":
+      return
+    if separator != ",":
+      raise ValueError("Malformed JSON array in ExtPay response")
+
+
+def _expect_end(reader: _TextReader) -> None:
+  if reader.peek():
+    raise ValueError("Unexpected data after the JSON document")
+
+
+def iter_json_users(chunks: Iterable[bytes], strict: bool = False) -> Iterator[Any]:
+  """
+  Yield user entries one at a time from a streamed JSON document shaped either
+  as a top-level list or as {"users": [...]}. Only one entry is held in memory.
+  With `strict`, an object without a "users" array and anything but whitespace
+  after the document are errors rather than an empty or ignored result.
+  """
+  reader = _TextReader(chunks)
+  first = reader.peek()
+  if first == "[":
+    yield from _iter_array(reader)
+    if strict:
+      _expect_end(reader)
+    return
+  if first != "{":
+    raise RuntimeError(_SHAPE_ERROR)
+
+  reader.take()
+  found = False
+  if reader.peek() == "}":
+    reader.take()
+  else:
+    while True:
+      key = reader.value()
+      if reader.take() != ":":
+        raise ValueError("Malformed JSON object in ExtPay response")
+      if key == "users" and not found:
+        found = True
+        if reader.peek() == "[":
+          yield from _iter_array(reader)
+        elif strict or reader.value():
+          raise RuntimeError(_SHAPE_ERROR)
+        if not strict:
+          return
+      else:
+        reader.value()
+      separator = reader.take()
+      if separator == "}":
+        break
+      if separator != ",":
+        raise ValueError("Malformed JSON object in ExtPay response")
+  if strict:
+    if not found:
+      raise RuntimeError(_SHAPE_ERROR)
+    _expect_end(reader)
+
+
+__all__ = ["iter_json_users"]
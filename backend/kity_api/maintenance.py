@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+from .config import Settings
+from .metrics import PRUNED_AT_KEY, ensure_metrics_table
+from .storage import get_connection
+
+logger = logging.getLogger(__name__)
+
+# A full ANALYZE runs at most this often; PRAGMA optimize covers the runs between.
+_ANALYZE_INTERVAL = 7 * 86400
+_LAST_ANALYZE_KEY = "maintenance_last_analyze"
+# Rows sampled per index by ANALYZE and PRAGMA optimize, which keeps either one
+# fast on large tables while still giving the planner usable statistics.
+_ANALYSIS_LIMIT = 1000
+_AUTO_VACUUM_INCREMENTAL = 2
+# PASSIVE never waits. RESTART and TRUNCATE wait up to busy_timeout for readers
+# and block new writers meanwhile, so they are opt-in for a live database.
+CHECKPOINT_MODES = ("passive", "restart", "truncate")
+
+
+@dataclass
+class MaintenanceReport:
+  pages_reclaimed: int = 0
+  free_pages_left: int = 0
+  analyzed: bool = False
+  checkpointed_pages: int = 0
+  snapshots_removed: int = 0
+  wal_frames: int = 0
+  checkpoint_busy: bool = False
+  duration_ms: float = 0.0
+
+
+def _pragma(conn: sqlite3.Connection, name: str) -> int:
+  return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def _cutoff(days: int) -> str:
+  return datetime.fromtimestamp(time.time() - days * 86400, timezone.utc).strftime(
+    "%Y-%m-%dT%H:%M:%SZ"
+  )
+
+
+def prune_user_counts(settings: Settings) -> int:
+  """
+  Thin `user_counts` snapshots older than `user_counts_daily_after_days` to the
+  newest one of each day, then drop any older than `user_counts_retention_days`.
+  Bucketed queries keep the newest snapshot per bucket, so day, week and month
+  results for thinned periods don't change; any removal still moves the
+  validators of /metrics/user-counts on. Returns the rows removed.
+  """
+  ensure_metrics_table(settings)
+  removed = 0
+  with get_connection(settings) as conn:
+    if settings.user_counts_daily_after_days > 0:
+      cutoff = _cutoff(settings.user_counts_daily_after_days)
+      removed += conn.execute(
+        """
+        DELETE FROM user_counts
+        WHERE period_key < :cutoff
+          AND period_key NOT IN (
+            SELECT MAX(period_key) FROM user_counts
+            WHERE period_key < :cutoff
+            GROUP BY substr(period_key, 1, 10)
+          )
+        """,
+        {"cutoff": cutoff},
+      ).rowcount
+    if settings.user_counts_retention_days > 0:
+      removed += conn.execute(
+        "DELETE FROM user_counts WHERE period_key < ?",
+        (_cutoff(settings.user_counts_retention_days),),
+      ).rowcount
+    if removed:
+      conn.execute(
+        "REPLACE INTO store_meta (key, value) VALUES (?, ?)", (PRUNED_AT_KEY, int(time.time() * 1000))
+      )
+  return removed
+
+
+def _analyze(conn: sqlite3.Connection, force: bool) -> bool:
+  conn.execute(f"PRAGMA analysis_limit = {_ANALYSIS_LIMIT}")
+  row = conn.execute("SELECT value FROM store_meta WHERE key = ?", (_LAST_ANALYZE_KEY,)).fetchone()
+  now = int(time.time())
+  if not force and row is not None and now - row[0] < _ANALYZE_INTERVAL:
+    conn.execute("PRAGMA optimize")
+    return False
+  conn.execute("ANALYZE")
+  with conn:
+    conn.execute(
+      "REPLACE INTO store_meta (key, value) VALUES (?, ?)", (_LAST_ANALYZE_KEY, now)
+    )
+  return True
+
+
+def _incremental_vacuum(conn: sqlite3.Connection, settings: Settings, deadline: float) -> int:
+  if _pragma(conn, "auto_vacuum") != _AUTO_VACUUM_INCREMENTAL:
+    logger.warning(
+      "users.db was created without auto_vacuum=INCREMENTAL, so free pages are not "
+      "returned to the filesystem; run `python manage.py vacuum` once while the app is stopped"
+    )
+    return 0
+  step = max(1, settings.db_maintenance_vacuum_pages)
+  reclaimed = 0
+  # Each step is its own short write transaction, so writers wait at most one step.
+  while time.monotonic() < deadline:
+    before = _pragma(conn, "freelist_count")
+    if not before:
+      break
+    conn.execute(f"PRAGMA incremental_vacuum({step})").fetchall()
+    freed = before - _pragma(conn, "freelist_count")
+    if freed <= 0:
+      break
+    reclaimed += freed
+  return reclaimed
+
+
+def run_maintenance(
+  settings: Settings, force_analyze: bool = False, checkpoint: Optional[str] = None
+) -> MaintenanceReport:
+  """
+  Keep users.db healthy: refresh planner statistics (PRAGMA optimize, with a
+  full ANALYZE weekly), give free pages back with bounded incremental_vacuum
+  steps for up to `db_maintenance_max_seconds`, checkpoint the WAL in
+  `checkpoint` mode (default `db_maintenance_checkpoint`), and apply the
+  `user_counts` retention policy.
+  """
+  mode = (checkpoint or settings.db_maintenance_checkpoint).lower()
+  if mode not in CHECKPOINT_MODES:
+    raise ValueError(
+      f"Unknown WAL checkpoint mode '{mode}'. Allowed: {', '.join(CHECKPOINT_MODES)}"
+    )
+  started = time.perf_counter()
+  deadline = time.monotonic() + max(0.0, settings.db_maintenance_max_seconds)
+  report = MaintenanceReport()
+
+  report.snapshots_removed = prune_user_counts(settings)
+  conn = get_connection(settings)
+  report.analyzed = _analyze(conn, force_analyze)
+  report.pages_reclaimed = _incremental_vacuum(conn, settings, deadline)
+  report.free_pages_left = _pragma(conn, "freelist_count")
+  # The pragma returns (busy, frames in the WAL, frames copied back); anything
+  # short of all of them is left for the next run.
+  busy, wal_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode.upper()})").fetchone()
+  report.checkpoint_busy = bool(busy)
+  report.wal_frames = max(0, wal_frames)
+  report.checkpointed_pages = max(0, checkpointed)
+  if busy or checkpointed < wal_frames:
+    logger.info(
+      "WAL checkpoint (%s) was partial: busy=%s, %s of %s frames copied; retrying next run",
+      mode,
+      busy,
+      checkpointed,
+      wal_frames,
+    )
+  report.duration_ms = (time.perf_counter() - started) * 1000
+
+  logger.info(
+    "Database maintenance finished in %.0f ms: %s pages reclaimed (%s free left), "
+    "WAL checkpoint %s busy=%s log=%s checkpointed=%s, %s snapshots pruned, %s",
+    report.duration_ms,
+    report.pages_reclaimed,
+    report.free_pages_left,
+    mode,
+    int(report.checkpoint_busy),
+    report.wal_frames,
+    report.checkpointed_pages,
+    report.snapshots_removed,
+    "full ANALYZE" if report.analyzed else "PRAGMA optimize",
+  )
+  return report
+
+
+def vacuum_database(settings: Settings) -> int:
+  """
+  Switch users.db to auto_vacuum=INCREMENTAL and rebuild it with a full VACUUM.
+  This holds the write lock for the whole rebuild, so run it with the app
+  stopped. Returns the file size saved, in pages.
+  """
+  conn = get_connection(settings)
+  before = _pragma(conn, "page_count")
+  conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+  conn.execute("VACUUM")
+  conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+  return before - _pragma(conn, "page_count")
+
+
+__all__ = [
+  "CHECKPOINT_MODES",
+  "MaintenanceReport",
+  "run_maintenance",
+  "prune_user_counts",
+  "vacuum_database",
+]
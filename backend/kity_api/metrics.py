@@ -1,50 +1,269 @@
 from __future__ import annotations
 
+import json
 import logging
 from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
 
 import sqlite3
 
 from .config import Settings
-from .storage import ensure_store, get_connection
+from .storage import STATUS_VALUES, ensure_store, get_connection
+from .utils import to_datetime
 
 logger = logging.getLogger(__name__)
 
+# store_meta key holding when retention last removed snapshots (epoch milliseconds).
+PRUNED_AT_KEY = "user_counts_pruned_at"
+
+# SQL expressions mapping a period_key to the first day of its bucket.
+BUCKET_EXPRESSIONS = {
+  "day": "substr(period_key, 1, 10)",
+  "week": "date(period_key, 'weekday 0', '-6 days')",
+  "month": "substr(period_key, 1, 7) || '-01'",
+}
+
+# Triggers keep user_status_counts in step with every write to users, whichever
+# code path makes it (single upserts, bulk syncs, imports).
+_ROLLUP_TRIGGERS = (
+  """
+  CREATE TRIGGER IF NOT EXISTS users_status_count_insert
+  AFTER INSERT ON users
+  BEGIN
+    INSERT INTO user_status_counts (status, total) VALUES (NEW.status, 1)
+    ON CONFLICT(status) DO UPDATE SET total = total + 1;
+  END
+  """,
+  """
+  CREATE TRIGGER IF NOT EXISTS users_status_count_update
+  AFTER UPDATE OF status ON users
+  WHEN OLD.status IS NOT NEW.status
+  BEGIN
+    UPDATE user_status_counts SET total = total - 1 WHERE status = OLD.status;
+    INSERT INTO user_status_counts (status, total) VALUES (NEW.status, 1)
+    ON CONFLICT(status) DO UPDATE SET total = total + 1;
+  END
+  """,
+  """
+  CREATE TRIGGER IF NOT EXISTS users_status_count_delete
+  AFTER DELETE ON users
+  BEGIN
+    UPDATE user_status_counts SET total = total - 1 WHERE status = OLD.status;
+  END
+  """,
+)
+
+
+def _scan_status_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+  return {
+    row[0]: row[1]
+    for row in conn.execute("SELECT status, COUNT(*) FROM users GROUP BY status")
+  }
+
+
+def _replace_status_counts(conn: sqlite3.Connection, counts: Dict[str, int]) -> None:
+  conn.execute("DELETE FROM user_status_counts")
+  conn.executemany(
+    "INSERT INTO user_status_counts (status, total) VALUES (?, ?)",
+    list(counts.items()),
+  )
+
 
 def ensure_metrics_table(settings: Settings) -> None:
-  """Create the user_counts table if it doesn't exist."""
+  """Create the user_counts table and the per-status rollup counters if they don't exist."""
   ensure_store(settings)
   with get_connection(settings) as conn:
+    conn.execute("BEGIN IMMEDIATE")
     conn.execute(
       """
       CREATE TABLE IF NOT EXISTS user_counts (
         period_key TEXT PRIMARY KEY,
         total_users INTEGER NOT NULL,
-        captured_at TEXT NOT NULL
+        captured_at TEXT NOT NULL,
+        status_breakdown TEXT
       )
       """
     )
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(user_counts)")}
+    if "status_breakdown" not in columns:
+      conn.execute("ALTER TABLE user_counts ADD COLUMN status_breakdown TEXT")
 
+    conn.execute(
+      """
+      CREATE TABLE IF NOT EXISTS user_status_counts (
+        status TEXT PRIMARY KEY,
+        total INTEGER NOT NULL
+      )
+      """
+    )
+    for trigger in _ROLLUP_TRIGGERS:
+      conn.execute(trigger)
+    # Seed the counters from one scan the first time they exist.
+    if not conn.execute("SELECT 1 FROM user_status_counts LIMIT 1").fetchone():
+      _replace_status_counts(conn, _scan_status_counts(conn))
+
+
+def read_status_counts(settings: Settings) -> Dict[str, int]:
+  """Current users per status, read from the rollup counters (no table scan)."""
+  counts = {status: 0 for status in sorted(STATUS_VALUES)}
+  with get_connection(settings) as conn:
+    for row in conn.execute("SELECT status, total FROM user_status_counts"):
+      counts[row["status"]] = row["total"]
+  return counts
 
-def snapshot_user_count(settings: Settings) -> None:
+
+def snapshot_user_count(settings: Settings) -> int:
   """
-  Count distinct users and store a twice-daily snapshot keyed by period (YYYY-MM-DDThh:00Z).
+  Store a twice-daily snapshot of the user total and per-status breakdown keyed by
+  period (YYYY-MM-DDThh:00Z), read from the rollup counters.
   Uses REPLACE to avoid duplicates for the same period.
   """
   ensure_metrics_table(settings)
   now = datetime.now(timezone.utc)
   period_key = now.strftime("%Y-%m-%dT%H:00:00Z")
 
+  breakdown = read_status_counts(settings)
+  total = sum(breakdown.values())
   with get_connection(settings) as conn:
-    total = conn.execute("SELECT COUNT(DISTINCT email) FROM users").fetchone()[0]
     conn.execute(
       """
-      REPLACE INTO user_counts (period_key, total_users, captured_at)
-      VALUES (?, ?, ?)
+      REPLACE INTO user_counts (period_key, total_users, captured_at, status_breakdown)
+      VALUES (?, ?, ?, ?)
       """,
-      (period_key, total, now.isoformat()),
+      (period_key, total, now.isoformat(), json.dumps(breakdown, sort_keys=True)),
     )
   logger.info("User count snapshot recorded for %s (total=%s)", period_key, total)
+  return total
+
+
+def reconcile_user_counts(settings: Settings) -> Dict[str, int]:
+  """
+  Compare the rollup counters with a real scan of users and repair any drift.
+  Returns the per-status difference (actual - counted) for statuses that drifted.
+  """
+  ensure_metrics_table(settings)
+  with get_connection(settings) as conn:
+    conn.execute("BEGIN IMMEDIATE")
+    actual = _scan_status_counts(conn)
+    counted = {
+      row["status"]: row["total"]
+      for row in conn.execute("SELECT status, total FROM user_status_counts")
+    }
+    drift = {
+      status: actual.get(status, 0) - counted.get(status, 0)
+      for status in set(actual) | set(counted)
+      if actual.get(status, 0) != counted.get(status, 0)
+    }
+    if drift:
+      _replace_status_counts(conn, actual)
+
+  if drift:
+    logger.warning("User status counters drifted and were repaired: %s", drift)
+  else:
+    logger.info("User status counters match a full scan")
+  return drift
+
+
+def parse_period_bound(value: Optional[str], end: bool = False) -> Optional[str]:
+  """
+  Convert a `from`/`to` query value (date or ISO datetime, UTC) into a period_key
+  bound. A bare date used as an upper bound covers that whole day.
+  """
+  if not value:
+    return None
+  parsed = to_datetime(value)
+  if parsed is None:
+    raise ValueError(f"Invalid ISO date '{value}'")
+  if parsed.tzinfo is not None:
+    parsed = parsed.astimezone(timezone.utc)
+  if end and len(value) == 10:
+    return parsed.strftime("%Y-%m-%dT23:59:59Z")
+  return parsed.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def latest_capture(settings: Settings) -> Optional[datetime]:
+  """captured_at of the newest snapshot; walks the period_key index backwards."""
+  with get_connection(settings) as conn:
+    row = conn.execute(
+      "SELECT captured_at FROM user_counts ORDER BY period_key DESC LIMIT 1"
+    ).fetchone()
+  return to_datetime(row["captured_at"]) if row else None
+
+
+def user_counts_version(settings: Settings) -> Tuple[Optional[datetime], Optional[int]]:
+  """
+  What validates a snapshot query: when user_counts last changed (its newest
+  capture or the last retention prune, whichever came later) plus the prune
+  marker itself, so a prune always yields a new ETag.
+  """
+  captured = latest_capture(settings)
+  with get_connection(settings) as conn:
+    row = conn.execute("SELECT value FROM store_meta WHERE key = ?", (PRUNED_AT_KEY,)).fetchone()
+  pruned_ms = row["value"] if row else None
+  if captured is not None and captured.tzinfo is None:
+    captured = captured.replace(tzinfo=timezone.utc)
+  candidates = [captured] if captured is not None else []
+  if pruned_ms is not None:
+    candidates.append(datetime.fromtimestamp(pruned_ms / 1000, timezone.utc))
+  return (max(candidates) if candidates else None), pruned_ms
+
+
+def query_user_counts(
+  settings: Settings,
+  bucket: str = "day",
+  start: Optional[str] = None,
+  end: Optional[str] = None,
+) -> Dict[str, object]:
+  """
+  Aggregate snapshots into day/week/month buckets, keeping the latest snapshot of
+  each bucket. Returns columnar arrays rather than one object per bucket.
+  """
+  expression = BUCKET_EXPRESSIONS[bucket]
+  clauses: List[str] = []
+  params: List[str] = []
+  if start:
+    clauses.append("period_key >= ?")
+    params.append(start)
+  if end:
+    clauses.append("period_key <= ?")
+    params.append(end)
+  where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+  timestamps: List[str] = []
+  totals: List[int] = []
+  breakdowns: List[Optional[Dict[str, int]]] = []
+  with get_connection(settings) as conn:
+    # SQLite takes the bare columns from the row that supplies MAX(period_key).
+    for row in conn.execute(
+      f"""
+      SELECT {expression} AS bucket, MAX(period_key), total_users, status_breakdown
+      FROM user_counts
+      {where}
+      GROUP BY bucket
+      ORDER BY bucket
+      """,
+      params,
+    ):
+      timestamps.append(row["bucket"])
+      totals.append(row["total_users"])
+      breakdowns.append(json.loads(row["status_breakdown"]) if row["status_breakdown"] else None)
+
+  statuses = {
+    status: [item.get(status, 0) if item is not None else None for item in breakdowns]
+    for status in sorted(STATUS_VALUES)
+  }
+  return {"bucket": bucket, "timestamps": timestamps, "totals": totals, "statuses": statuses}
 
 
-__all__ = ["snapshot_user_count", "ensure_metrics_table"]
+__all__ = [
+  "snapshot_user_count",
+  "ensure_metrics_table",
+  "read_status_counts",
+  "reconcile_user_counts",
+  "query_user_counts",
+  "latest_capture",
+  "user_counts_version",
+  "PRUNED_AT_KEY",
+  "parse_period_bound",
+  "BUCKET_EXPRESSIONS",
+]
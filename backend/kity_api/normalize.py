@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import hashlib
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from .storage import DEFAULT_STATUS, STATUS_VALUES
+from .utils import string_or_null
+
+# Upsert field -> entry keys tried in order; the first truthy one wins, like `a or b`.
+EXTPAY_SCHEMA: Dict[str, Tuple[str, ...]] = {
+  "email": ("email",),
+  "name": ("name",),
+  "plan": ("planNickname", "plan"),
+  "status": ("status", "planStatus"),
+  "trial_started_at": ("trialStartedAt", "trial_started_at"),
+  "subscription_started_at": ("subscriptionStartedAt", "subscription_started_at"),
+}
+
+# Statuses decided by the status string alone, before the plan is looked at.
+_STATUS_TABLE = {
+  **{alias: "active_trial" for alias in ("trial", "trialing", "active_trial")},
+  **{alias: "ended_trial" for alias in ("trial_ended", "canceled", "cancelled", "ended_trial")},
+}
+_MONTHLY = frozenset({"paid_monthly", "monthly"})
+_YEARLY = frozenset({"paid_annually", "yearly"})
+
+# Bounded memo tables; cleared wholesale when full, since real exports repeat a
+# handful of (status, plan) pairs and timestamps cluster heavily.
+_MEMO_LIMIT = 65_536
+
+NormalizedEntry = Tuple[int, Dict[str, Optional[str]], str]
+
+
+def _compile_getter(aliases: Sequence[str]) -> Callable[[Mapping[str, Any]], Any]:
+  if len(aliases) == 1:
+    (only,) = aliases
+    return lambda entry: entry.get(only)
+  first, second = aliases[0], aliases[1:]
+  rest = _compile_getter(second)
+  return lambda entry: entry.get(first) or rest(entry)
+
+
+class ExtPayNormalizer:
+  """
+  Validate ExtPay entries a batch at a time, producing the same upsert parameters
+  and fingerprints as `prepare_user_params` after `map_extpay_status`. Field
+  lookups are compiled from `EXTPAY_SCHEMA` once; status mapping and timestamp
+  parsing are memoized per distinct input.
+  """
+
+  def __init__(self, schema: Mapping[str, Sequence[str]] = EXTPAY_SCHEMA) -> None:
+    self._getters = {field: _compile_getter(tuple(aliases)) for field, aliases in schema.items()}
+    self._statuses: Dict[Tuple[Any, Any], str] = {}
+    self._timestamps: Dict[str, Optional[str]] = {}
+
+  def map_status(self, status: Any, plan: Any) -> str:
+    """Memoized `map_extpay_status`."""
+    # Falsy values all map like "", so they share one memo entry.
+    key = (status or None, plan or None)
+    try:
+      return self._statuses[key]
+    except KeyError:
+      pass
+    except TypeError:
+      raise ValueError("status and plan must be strings")
+    if not isinstance(status or "", str) or not isinstance(plan or "", str):
+      raise ValueError("status and plan must be strings")
+    normalized = (status or "").strip().lower().replace(" ", "_")
+    plan_text = (plan or "").strip().lower()
+    mapped = _STATUS_TABLE.get(normalized)
+    if mapped is None:
+      if "month" in plan_text or normalized in _MONTHLY:
+        mapped = "paid_monthly"
+      elif "year" in plan_text or "annual" in plan_text or normalized in _YEARLY:
+        mapped = "paid_annually"
+      elif normalized in STATUS_VALUES:
+        mapped = normalized
+      else:
+        mapped = DEFAULT_STATUS
+    if len(self._statuses) >= _MEMO_LIMIT:
+      self._statuses.clear()
+    self._statuses[key] = mapped
+    return mapped
+
+  def parse_timestamp(self, value: Any, field_name: str) -> Optional[str]:
+    """Memoized `normalize_iso`: None stays None, anything unparsable raises ValueError."""
+    if value is None:
+      return None
+    if isinstance(value, str):
+      try:
+        parsed = self._timestamps[value]
+      except KeyError:
+        try:
+          parsed = datetime.fromisoformat(value).isoformat() if value else None
+        except ValueError:
+          parsed = None
+        if len(self._timestamps) >= _MEMO_LIMIT:
+          self._timestamps.clear()
+        self._timestamps[value] = parsed
+    elif isinstance(value, datetime):
+      parsed = value.isoformat()
+    else:
+      parsed = None
+    if parsed is None:
+      raise ValueError(f"Invalid ISO datetime for '{field_name}'")
+    return parsed
+
+  def normalize(
+    self, entry: Any, created_at: Optional[str] = None
+  ) -> Tuple[Dict[str, Optional[str]], str]:
+    """Upsert parameters and change fingerprint for one entry; raises ValueError."""
+    if not isinstance(entry, dict):
+      raise ValueError("missing email")
+    get = self._getters
+    email = string_or_null(get["email"](entry))
+    if not email:
+      raise ValueError("missing email")
+    plan = get["plan"](entry)
+    status = self.map_status(get["status"](entry), plan)
+    name = string_or_null(get["name"](entry))
+    trial = self.parse_timestamp(get["trial_started_at"](entry), "trialStartedAt")
+    subscription = self.parse_timestamp(
+      get["subscription_started_at"](entry), "subscriptionStartedAt"
+    )
+    params = {
+      "id": str(uuid.uuid4()),
+      "email": email,
+      "name": name,
+      "status": status,
+      "requested_status": status,
+      "trial_started_at": trial,
+      "subscription_started_at": subscription,
+      "created_at": created_at or datetime.utcnow().isoformat(),
+    }
+    fingerprint = hashlib.blake2b(
+      "\x1f".join(
+        (status, plan if isinstance(plan, str) else "", name or "", trial or "", subscription or "")
+      ).encode("utf-8"),
+      digest_size=16,
+    ).hexdigest()
+    return params, fingerprint
+
+  def normalize_batch(
+    self, entries: Iterable[Tuple[int, Any]]
+  ) -> Tuple[List[NormalizedEntry], List[str]]:
+    """
+    Normalize `(index, entry)` pairs; returns the usable ones as
+    `(index, params, fingerprint)` plus `[index] reason` errors for the rest.
+    The batch shares one `created_at`, as it is written in one transaction.
+    """
+    normalized: List[NormalizedEntry] = []
+    errors: List[str] = []
+    normalize = self.normalize
+    created_at = datetime.utcnow().isoformat()
+    for idx, entry in entries:
+      try:
+        params, fingerprint = normalize(entry, created_at)
+      except ValueError as exc:
+        errors.append(f"[{idx}] {exc}")
+        continue
+      normalized.append((idx, params, fingerprint))
+    return normalized, errors
+
+
+__all__ = ["ExtPayNormalizer", "EXTPAY_SCHEMA", "NormalizedEntry"]
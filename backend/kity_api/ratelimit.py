@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import itertools
+import logging
+import math
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from flask import Blueprint, g, jsonify, request
+
+from .auth import authenticate
+from .config import Settings
+from .instrumentation import RATE_LIMITED
+from .storage import get_auxiliary_connection, get_connection, hash_token
+
+logger = logging.getLogger(__name__)
+
+# Past this many clients the memory backend forgets buckets that have fully refilled.
+_MAX_MEMORY_BUCKETS = 10_000
+# The sqlite backend deletes fully refilled buckets on every Nth request.
+_PRUNE_EVERY = 1000
+# A write-lock probe result is reused for this long, so the probe itself takes
+# the lock at most ~20 times a second per process rather than once per write.
+_PROBE_INTERVAL = 0.05
+_WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class MemoryBuckets:
+  """Token buckets held in this process only."""
+
+  def __init__(self, idle_after: float) -> None:
+    # A bucket untouched for `idle_after` seconds has refilled, so forgetting it is free.
+    self.idle_after = idle_after
+    self._buckets: Dict[str, Tuple[float, float]] = {}
+    self._lock = threading.Lock()
+
+  def take(self, key: str, rate: float, burst: int) -> float:
+    """Spend one token; returns 0 when allowed, otherwise seconds until one is available."""
+    now = time.monotonic()
+    with self._lock:
+      tokens, updated = self._buckets.get(key, (float(burst), now))
+      tokens = min(float(burst), tokens + (now - updated) * rate)
+      if tokens >= 1:
+        self._buckets[key] = (tokens - 1, now)
+        wait = 0.0
+      else:
+        self._buckets[key] = (tokens, now)
+        wait = (1 - tokens) / rate
+      if len(self._buckets) > _MAX_MEMORY_BUCKETS:
+        self._prune(now)
+    return wait
+
+  def _prune(self, now: float) -> None:
+    idle = [key for key, (_, updated) in self._buckets.items() if now - updated > self.idle_after]
+    for key in idle:
+      del self._buckets[key]
+
+
+class SqliteBuckets:
+  """
+  Token buckets in a side SQLite file (data/ratelimit.db) so every gunicorn worker
+  on the host shares the same limits without touching the users write lock.
+  """
+
+  def __init__(self, settings: Settings, idle_after: float) -> None:
+    self.settings = settings
+    self.path = settings.data_dir / "ratelimit.db"
+    # A bucket untouched for `idle_after` seconds is full again, so deleting it
+    # changes nothing; the next request recreates it at `burst`.
+    self.idle_after = idle_after
+    self._takes = itertools.count(1)
+    with get_auxiliary_connection(settings, self.path) as conn:
+      conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rate_buckets (
+          key TEXT PRIMARY KEY,
+          tokens REAL NOT NULL,
+          updated REAL NOT NULL
+        )
+        """
+      )
+
+  def take(self, key: str, rate: float, burst: int) -> float:
+    now = time.time()
+    params = {"key": key, "now": now, "rate": rate, "burst": float(burst)}
+    with get_auxiliary_connection(self.settings, self.path) as conn:
+      # Refill and spend in one statement; no row comes back when the bucket is empty.
+      row = conn.execute(
+        """
+        INSERT INTO rate_buckets (key, tokens, updated) VALUES (:key, :burst - 1, :now)
+        ON CONFLICT(key) DO UPDATE SET
+          tokens = MIN(:burst, tokens + (:now - updated) * :rate) - 1,
+          updated = :now
+        WHERE MIN(:burst, tokens + (:now - updated) * :rate) >= 1
+        RETURNING tokens
+        """,
+        params,
+      ).fetchone()
+      if next(self._takes) % _PRUNE_EVERY == 0:
+        conn.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - self.idle_after,))
+      if row is not None:
+        return 0.0
+      current = conn.execute(
+        "SELECT MIN(:burst, tokens + (:now - updated) * :rate) FROM rate_buckets WHERE key = :key",
+        params,
+      ).fetchone()[0]
+    return (1 - current) / rate
+
+
+def _client_key(settings: Settings) -> str:
+  header = request.headers.get("Authorization") or ""
+  token = header.replace("Bearer", "").strip()
+  # Only a token that resolves to a user gets its own bucket; otherwise made-up
+  # tokens would each start with a full burst.
+  if token and authenticate(settings, token) is not None:
+    return "token:" + hash_token(token)
+  return f"ip:{request.remote_addr or 'unknown'}"
+
+
+class _WriteLockProbe:
+  """
+  Probe the users.db write lock, waiting at most `shed_lock_wait_ms`. SQLite
+  holds this lock for every worker process on the host, so failing to get it
+  in time means writers are already queued up, however the server is run.
+  Results are reused for `_PROBE_INTERVAL`, and while one thread probes the
+  others take the last result instead of queueing behind it.
+  """
+
+  def __init__(self, settings: Settings) -> None:
+    self.settings = settings
+    self._free = True
+    self._checked_at = float("-inf")
+    self._lock = threading.Lock()
+
+  def free(self) -> bool:
+    if time.monotonic() - self._checked_at < _PROBE_INTERVAL:
+      return self._free
+    if not self._lock.acquire(blocking=False):
+      return self._free
+    try:
+      self._free = self._probe()
+      self._checked_at = time.monotonic()
+    finally:
+      self._lock.release()
+    return self._free
+
+  def _probe(self) -> bool:
+    settings = self.settings
+    conn = get_connection(settings)
+    if conn.in_transaction:
+      return True
+    conn.execute(f"PRAGMA busy_timeout = {max(0, int(settings.shed_lock_wait_ms))}")
+    try:
+      conn.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError:
+      return False
+    else:
+      conn.execute("ROLLBACK")
+      return True
+    finally:
+      conn.execute(f"PRAGMA busy_timeout = {max(0, int(settings.sqlite_busy_timeout_ms))}")
+
+
+def _retry_after(seconds: float) -> Dict[str, str]:
+  return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+def attach_rate_limiting(api: Blueprint, settings: Settings) -> None:
+  """
+  Per-client token buckets for the routes listed in `settings.rate_limits`, plus
+  load shedding for writes: once too many are in flight in this process, or
+  when the users.db write lock can't be had within `shed_lock_wait_ms`. Only
+  the lock probe sees other processes, so it is what sheds under sync workers.
+  With write-behind on, requests don't take the write lock themselves, so the
+  probe is skipped.
+  """
+  idle_after = max((burst / rate for rate, burst in settings.rate_limits.values()), default=0.0)
+  buckets: MemoryBuckets | SqliteBuckets
+  if settings.rate_limit_backend == "sqlite":
+    buckets = SqliteBuckets(settings, idle_after)
+  else:
+    buckets = MemoryBuckets(idle_after)
+
+  in_flight_writes = 0
+  in_flight_lock = threading.Lock()
+  lock_probe = (
+    _WriteLockProbe(settings)
+    if settings.shed_lock_wait_ms > 0 and not settings.write_behind
+    else None
+  )
+
+  def busy():
+    return (
+      jsonify({"error": "Server busy, retry shortly"}),
+      503,
+      _retry_after(settings.shed_retry_after),
+    )
+
+  @api.before_request
+  def _limit_request():
+    nonlocal in_flight_writes
+
+    rule = request.url_rule.rule if request.url_rule else request.path
+    route = f"{request.method} {rule}"
+    limit = settings.rate_limits.get(route)
+    if limit:
+      rate, burst = limit
+      wait = buckets.take(f"{route}|{_client_key(settings)}", rate, burst)
+      if wait > 0:
+        RATE_LIMITED.inc(route, "rate_limit")
+        return jsonify({"error": "Rate limit exceeded"}), 429, _retry_after(wait)
+
+    if request.method not in _WRITE_METHODS:
+      return None
+    if settings.max_pending_writes > 0:
+      with in_flight_lock:
+        if in_flight_writes >= settings.max_pending_writes:
+          logger.warning("Shedding %s: %s writes already in flight", route, in_flight_writes)
+          RATE_LIMITED.inc(route, "shed")
+          return busy()
+        in_flight_writes += 1
+      g.counted_write = True
+    if lock_probe is not None and not lock_probe.free():
+      logger.warning(
+        "Shedding %s: users.db write lock still held after %s ms", route, settings.shed_lock_wait_ms
+      )
+      RATE_LIMITED.inc(route, "shed")
+      return busy()
+    return None
+
+  @api.teardown_request
+  def _release_write(exc: Optional[BaseException]) -> None:
+    nonlocal in_flight_writes
+
+    if g.pop("counted_write", False):
+      with in_flight_lock:
+        in_flight_writes -= 1
+
+
+__all__ = ["attach_rate_limiting", "MemoryBuckets", "SqliteBuckets"]
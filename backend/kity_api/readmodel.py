@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from . import storage
+from .config import Settings
+from .instrumentation import gauge, record_cache_lookup
+from .storage import STATUS_VALUES, USER_FIELDS, add_user_write_listener, get_connection
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = tuple(USER_FIELDS.values())
+_FETCH_BATCH = 5000
+
+_model: "UserReadModel | None" = None
+_model_lock = threading.Lock()
+
+UserKey = Tuple[str, str]
+
+
+class _User:
+  """One users row; replaced, never mutated, so readers can hold it outside the lock."""
+
+  __slots__ = _COLUMNS
+
+  def __init__(self, row: Sequence[Optional[str]]) -> None:
+    for column, value in zip(_COLUMNS, row):
+      setattr(self, column, value)
+
+  @property
+  def key(self) -> UserKey:
+    return (self.created_at, self.id)  # type: ignore[attr-defined]
+
+  def project(self, fields: Optional[Sequence[str]]) -> Dict[str, Optional[str]]:
+    names = fields or USER_FIELDS
+    return {field: getattr(self, USER_FIELDS[field]) for field in names}
+
+
+class UserReadModel:
+  """
+  All users held in memory: an email index, a (created_at, id) ordered key list
+  for newest-first listings, and one ordered key list per status.
+
+  It loads once, then applies only rows whose `row_version` moved past the last
+  one seen. Writes from this process mark it stale straight away; writes from
+  other processes are picked up within `read_model_max_staleness_ms`, the
+  longest it goes without checking the store generation.
+  """
+
+  def __init__(self, settings: Settings) -> None:
+    self.settings = settings
+    self.max_staleness = max(0.0, settings.read_model_max_staleness_ms / 1000)
+    self._by_email: Dict[str, _User] = {}
+    self._keys: List[UserKey] = []
+    self._status_keys: Dict[str, List[UserKey]] = {status: [] for status in STATUS_VALUES}
+    self._by_key: Dict[UserKey, _User] = {}
+    self._row_version = -1
+    self._generation: Optional[int] = None
+    self._checked_at = 0.0
+    self._dirty = True
+    self._lock = threading.RLock()
+    add_user_write_listener(self._mark_dirty)
+
+  def __len__(self) -> int:
+    return len(self._by_email)
+
+  def _mark_dirty(self, emails: Iterable[str]) -> None:
+    self._dirty = True
+
+  def _store_state(self) -> Tuple[int, int]:
+    with get_connection(self.settings) as conn:
+      rows = dict(
+        conn.execute(
+          "SELECT key, value FROM store_meta WHERE key IN (?, ?)",
+          (storage._GENERATION_KEY, storage._ROW_VERSION_KEY),
+        ).fetchall()
+      )
+    return rows[storage._GENERATION_KEY], rows[storage._ROW_VERSION_KEY]
+
+  def _ensure_fresh(self) -> None:
+    now = time.monotonic()
+    if not self._dirty and now - self._checked_at < self.max_staleness:
+      record_cache_lookup("read_model", True)
+      return
+    with self._lock:
+      if not self._dirty and now - self._checked_at < self.max_staleness:
+        return
+      self._dirty = False
+      generation, row_version = self._store_state()
+      self._checked_at = now
+      if generation == self._generation:
+        record_cache_lookup("read_model", True)
+        return
+      record_cache_lookup("read_model", False)
+      started = time.perf_counter()
+      if self._row_version < 0:
+        changed = self._load_all(row_version)
+      else:
+        changed = self._apply_changes(row_version)
+      self._generation = generation
+      logger.debug(
+        "Read model refreshed %s users in %.1f ms", changed, (time.perf_counter() - started) * 1000
+      )
+
+  def sync_to(self, generation: int) -> None:
+    """
+    Refresh now unless the model already reflects store `generation`, e.g. one
+    just read to key a cached response, so the body matches its validators.
+    """
+    if self._generation != generation:
+      self._dirty = True
+    self._ensure_fresh()
+
+  def _fetch(self, sql: str, params: Sequence[object]) -> Iterator[Sequence[Optional[str]]]:
+    cursor = get_connection(self.settings).execute(sql, params)
+    while True:
+      rows = cursor.fetchmany(_FETCH_BATCH)
+      if not rows:
+        return
+      yield from rows
+
+  def _load_all(self, row_version: int) -> int:
+    by_email: Dict[str, _User] = {}
+    for row in self._fetch(f"SELECT {', '.join(_COLUMNS)} FROM users", ()):
+      user = _User(row)
+      by_email[user.email] = user  # type: ignore[attr-defined]
+    self._by_email = by_email
+    self._by_key = {user.key: user for user in by_email.values()}
+    self._keys = sorted(self._by_key)
+    self._status_keys = {status: [] for status in STATUS_VALUES}
+    for key in self._keys:
+      status = self._by_key[key].status  # type: ignore[attr-defined]
+      self._status_keys.setdefault(status, []).append(key)
+    self._row_version = row_version
+    return len(by_email)
+
+  def _apply_changes(self, row_version: int) -> int:
+    changed = 0
+    for row in self._fetch(
+      f"SELECT {', '.join(_COLUMNS)} FROM users WHERE row_version > ?", (self._row_version,)
+    ):
+      user = _User(row)
+      previous = self._by_email.get(user.email)  # type: ignore[attr-defined]
+      if previous is None:
+        insort(self._keys, user.key)
+      elif previous.status != user.status:  # type: ignore[attr-defined]
+        old_keys = self._status_keys[previous.status]  # type: ignore[attr-defined]
+        del old_keys[bisect_left(old_keys, previous.key)]
+      if previous is None or previous.status != user.status:  # type: ignore[attr-defined]
+        insort(self._status_keys.setdefault(user.status, []), user.key)  # type: ignore[attr-defined]
+      self._by_email[user.email] = user  # type: ignore[attr-defined]
+      self._by_key[user.key] = user
+      changed += 1
+    self._row_version = row_version
+
+    # Row versions don't cover deletes; a count mismatch means rows disappeared.
+    with get_connection(self.settings) as conn:
+      total = conn.execute("SELECT COALESCE(SUM(total), 0) FROM user_status_counts").fetchone()[0]
+    if total != len(self._by_email):
+      logger.info("Read model saw %s users but the store has %s; reloading", len(self), total)
+      return self._load_all(row_version)
+    return changed
+
+  def find_by_email(self, email: str) -> Optional[Dict[str, Optional[str]]]:
+    self._ensure_fresh()
+    user = self._by_email.get(email)
+    return user.project(None) if user else None
+
+  def status_counts(self) -> Dict[str, int]:
+    self._ensure_fresh()
+    with self._lock:
+      return {status: len(self._status_keys.get(status, ())) for status in sorted(STATUS_VALUES)}
+
+  def _select(
+    self, status: Optional[str], after: Optional[UserKey], limit: Optional[int]
+  ) -> List[_User]:
+    self._ensure_fresh()
+    with self._lock:
+      keys = self._keys if status is None else self._status_keys.get(status, [])
+      end = bisect_left(keys, after) if after is not None else len(keys)
+      start = 0 if limit is None else max(0, end - limit)
+      return [self._by_key[key] for key in reversed(keys[start:end])]
+
+  def iter_users(
+    self,
+    fields: Optional[Sequence[str]] = None,
+    status: Optional[str] = None,
+    after: Optional[UserKey] = None,
+    limit: Optional[int] = None,
+  ) -> Iterator[Dict[str, Optional[str]]]:
+    if status is not None:
+      status = storage.normalize_status(status)
+    for user in self._select(status, after, limit):
+      yield user.project(fields)
+
+  def read_users_page(
+    self,
+    limit: int,
+    fields: Optional[Sequence[str]] = None,
+    status: Optional[str] = None,
+    after: Optional[UserKey] = None,
+  ) -> Tuple[List[Dict[str, Optional[str]]], Optional[str]]:
+    if status is not None:
+      status = storage.normalize_status(status)
+    users = self._select(status, after, limit + 1)
+    next_cursor = None
+    if len(users) > limit:
+      users = users[:limit]
+      next_cursor = "{},{}".format(*users[-1].key)
+    return [user.project(fields) for user in users], next_cursor
+
+
+def get_read_model(settings: Settings) -> Optional[UserReadModel]:
+  """This process's read model, or None when `READ_MODEL` is off."""
+  global _model
+
+  if not settings.read_model_enabled:
+    return None
+  if _model is None:
+    with _model_lock:
+      if _model is None:
+        _model = UserReadModel(settings)
+  return _model
+
+
+def warm_read_model(settings: Settings) -> None:
+  """Load the read model up front (at app startup) instead of on the first read."""
+  model = get_read_model(settings)
+  if model is not None:
+    model._ensure_fresh()
+
+
+def sync_read_model(settings: Settings, generation: int) -> None:
+  """Bring the read model (when enabled) up to at least store `generation`."""
+  model = get_read_model(settings)
+  if model is not None:
+    model.sync_to(generation)
+
+
+# Drop-in replacements for the storage readers: served from the read model when it
+# is enabled, straight from SQLite otherwise.
+
+
+def iter_users(
+  settings: Settings,
+  fields: Optional[Sequence[str]] = None,
+  status: Optional[str] = None,
+  after: Optional[UserKey] = None,
+  limit: Optional[int] = None,
+) -> Iterator[Dict[str, Optional[str]]]:
+  model = get_read_model(settings)
+  if model is None:
+    return storage.iter_users(settings, fields=fields, status=status, after=after, limit=limit)
+  return model.iter_users(fields=fields, status=status, after=after, limit=limit)
+
+
+def read_users_page(
+  settings: Settings,
+  limit: int,
+  fields: Optional[Sequence[str]] = None,
+  status: Optional[str] = None,
+  after: Optional[UserKey] = None,
+) -> Tuple[List[Dict[str, Optional[str]]], Optional[str]]:
+  model = get_read_model(settings)
+  if model is None:
+    return storage.read_users_page(settings, limit, fields=fields, status=status, after=after)
+  return model.read_users_page(limit, fields=fields, status=status, after=after)
+
+
+def read_users(settings: Settings) -> List[Dict[str, Optional[str]]]:
+  model = get_read_model(settings)
+  if model is None:
+    return storage.read_users(settings)
+  return list(model.iter_users())
+
+
+def find_user_by_email(settings: Settings, email: str) -> Optional[Dict[str, Optional[str]]]:
+  model = get_read_model(settings)
+  if model is None:
+    return storage.find_user_by_email(settings, email)
+  return model.find_by_email(email)
+
+
+def read_status_counts(settings: Settings) -> Dict[str, int]:
+  model = get_read_model(settings)
+  if model is None:
+    from .metrics import read_status_counts as read_rollup_counts
+
+    return read_rollup_counts(settings)
+  return model.status_counts()
+
+
+gauge(
+  "kity_read_model_users",
+  "Users held by this process's in-memory read model (0 when disabled).",
+  lambda: len(_model) if _model is not None else 0,
+)
+
+
+__all__ = [
+  "UserReadModel",
+  "get_read_model",
+  "warm_read_model",
+  "sync_read_model",
+  "iter_users",
+  "read_users_page",
+  "read_users",
+  "find_user_by_email",
+  "read_status_counts",
+]
@@ -1,101 +1,339 @@
 from __future__ import annotations
 
-from decimal import Decimal, InvalidOperation
+import json
+import math
+from io import BytesIO
+from typing import Any, Dict, Iterator, List, Optional
 
-import stripe
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 
 from .config import Settings
-from .storage import STATUS_VALUES, read_users, upsert_user
+from .donations import (
+  CheckoutBusy,
+  CheckoutFailed,
+  CheckoutUnavailable,
+  create_checkout_session,
+  parse_amount_cents,
+)
+from .httpcache import (
+  ResponseCache,
+  add_validators,
+  is_not_modified,
+  make_etag,
+  not_modified_response,
+  static_json_response,
+)
+from .idempotency import HEADER as IDEMPOTENCY_HEADER, idempotent
+from .jsonstream import iter_json_users
+from .metrics import (
+  BUCKET_EXPRESSIONS,
+  parse_period_bound,
+  query_user_counts,
+  user_counts_version,
+)
+from .ratelimit import attach_rate_limiting
+from .readmodel import (
+  find_user_by_email,
+  iter_users,
+  read_status_counts,
+  read_users,
+  read_users_page,
+  sync_read_model,
+)
+from .storage import (
+  STATUS_VALUES,
+  normalize_status,
+  parse_user_cursor,
+  parse_user_fields,
+  prepare_user_params,
+  read_generation,
+  upsert_user,
+  upsert_users_bulk,
+)
 from .utils import string_or_null
+from .writebehind import WriteBehindFull, drain_writes, get_write_behind
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+_BODY_CHUNK_SIZE = 64 * 1024
+
+
+def _wants_ndjson() -> bool:
+  if request.args.get("format") == "ndjson":
+    return True
+  best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+  return best == NDJSON_MIMETYPE
+
+
+def _user_fields(payload: Dict[str, Any]) -> Dict[str, Optional[str]]:
+  """Pull the user write fields out of a request payload, accepting both key styles."""
+  return {
+    "email": string_or_null(payload.get("email")),
+    "name": string_or_null(payload.get("name")),
+    "status": string_or_null(payload.get("status")),
+    "trial_started_at": string_or_null(
+      payload.get("trialStartedAt") or payload.get("trial_started_at")
+    ),
+    "subscription_started_at": string_or_null(
+      payload.get("subscriptionStartedAt") or payload.get("subscription_started_at")
+    ),
+  }
+
+
+def _iter_batch_entries() -> Iterator[Any]:
+  """
+  Yield entries from a JSON array (or {"users": [...]}) or NDJSON request body,
+  one at a time, reading the body in chunks rather than all at once. An NDJSON
+  line that isn't valid JSON is yielded as a ValueError so it can be reported
+  with its index; any other array shape, or data after the array, raises
+  ValueError or RuntimeError.
+  """
+  # The idempotency check has already buffered the body when a key was sent.
+  if request.headers.get(IDEMPOTENCY_HEADER):
+    stream = BytesIO(request.get_data())
+  else:
+    stream = request.stream
+  if request.mimetype == NDJSON_MIMETYPE:
+    for line in stream:
+      if not line.strip():
+        continue
+      try:
+        entry = json.loads(line)
+      except ValueError as exc:
+        entry = ValueError(f"Invalid JSON: {getattr(exc, 'msg', exc)}")
+      yield entry
+    return
+  yield from iter_json_users(iter(lambda: stream.read(_BODY_CHUNK_SIZE), b""), strict=True)
 
 
 def create_api_blueprint(settings: Settings) -> Blueprint:
   api = Blueprint("kity_api", __name__)
+  attach_rate_limiting(api, settings)
 
-  if settings.stripe_secret_key:
-    stripe.api_key = settings.stripe_secret_key
+  response_cache = ResponseCache(
+    settings.response_cache_size,
+    settings.response_cache_ttl,
+    settings.response_cache_max_body_bytes,
+  )
+
+  # /donations/link only depends on Settings, so serialize it once.
+  if settings.stripe_donation_link:
+    donation_link_payload, donation_link_status = {"url": settings.stripe_donation_link}, 200
+  else:
+    donation_link_payload, donation_link_status = {"error": "Donation link not configured"}, 503
+  donation_link_body = (json.dumps(donation_link_payload) + "\n").encode("utf-8")
+  donation_link_etag = make_etag("donation-link", donation_link_body)
 
   @api.route("/users", methods=["POST"])
+  @idempotent(settings, "users")
   def create_user_route():
     payload = request.get_json(silent=True) or {}
-    email = string_or_null(payload.get("email"))
-    name = string_or_null(payload.get("name"))
-    user_status = string_or_null(payload.get("status"))
-    trial_started_at = string_or_null(
-      payload.get("trialStartedAt") or payload.get("trial_started_at")
-    )
-    subscription_started_at = string_or_null(
-      payload.get("subscriptionStartedAt") or payload.get("subscription_started_at")
-    )
+    fields = _user_fields(payload)
+    email = fields["email"]
+    name = fields["name"]
+    user_status = fields["status"]
+    trial_started_at = fields["trial_started_at"]
+    subscription_started_at = fields["subscription_started_at"]
 
     if not email:
       return jsonify({"error": "Email is required"}), 400
 
+    # With write-behind on, the write is validated and queued; the record returned
+    # is what the row will hold once the writer thread flushes it.
     try:
-      record, created = upsert_user(
-        settings=settings,
-        email=email,
-        name=name,
-        status=user_status,
-        trial_started_at=trial_started_at,
-        subscription_started_at=subscription_started_at,
-      )
+      if settings.write_behind:
+        record, created = get_write_behind(settings).enqueue(
+          email,
+          name=name,
+          status=user_status,
+          trial_started_at=trial_started_at,
+          subscription_started_at=subscription_started_at,
+        )
+      else:
+        record, created = upsert_user(
+          settings=settings,
+          email=email,
+          name=name,
+          status=user_status,
+          trial_started_at=trial_started_at,
+          subscription_started_at=subscription_started_at,
+        )
     except ValueError as exc:
       return jsonify({"error": str(exc), "allowedStatuses": sorted(STATUS_VALUES)}), 400
+    except WriteBehindFull as exc:
+      retry_after = str(max(1, math.ceil(settings.shed_retry_after)))
+      return jsonify({"error": str(exc)}), 503, {"Retry-After": retry_after}
 
     http_status = 201 if created else 200
     return jsonify({"user": record, "created": created}), http_status
 
+  @api.route("/users/batch", methods=["POST"])
+  @idempotent(settings, "users-batch")
+  def create_users_batch_route():
+    max_size = settings.users_batch_max_size
+    results: List[Dict[str, Any]] = []
+    valid: List[int] = []
+    params: List[Dict[str, Optional[str]]] = []
+    try:
+      for index, entry in enumerate(_iter_batch_entries()):
+        if index >= max_size:
+          return jsonify({"error": f"Batch is limited to {max_size} users"}), 413
+        if isinstance(entry, ValueError):
+          results.append({"index": index, "error": str(entry)})
+          continue
+        if not isinstance(entry, dict):
+          results.append({"index": index, "error": "Each entry must be an object"})
+          continue
+        fields = _user_fields(entry)
+        if not fields["email"]:
+          results.append({"index": index, "error": "Email is required"})
+          continue
+        try:
+          params.append(prepare_user_params(**fields))
+        except ValueError as exc:
+          results.append({"index": index, "email": fields["email"], "error": str(exc)})
+          continue
+        valid.append(len(results))
+        results.append({"index": index, "email": params[-1]["email"]})
+    except (ValueError, RuntimeError):
+      return jsonify({"error": "Body must be a JSON array of users or NDJSON"}), 400
+
+    # Queued single-user writes, including a batch the writer thread is
+    # committing right now, go first so they can't land on top of this batch.
+    drain_writes()
+    flags = upsert_users_bulk(settings, params)
+    for position, created in zip(valid, flags):
+      results[position]["result"] = "created" if created else "updated"
+    for item in results:
+      if "error" in item:
+        item["result"] = "error"
+
+    created_count = sum(flags)
+    return jsonify(
+      {
+        "results": results,
+        "created": created_count,
+        "updated": len(flags) - created_count,
+        "failed": len(results) - len(flags),
+      }
+    )
+
   @api.route("/users", methods=["GET"])
   def list_users():
-    users = read_users(settings)
-    return jsonify({"users": users})
+    args = request.args
+    try:
+      fields = parse_user_fields(args.get("fields"))
+      after = parse_user_cursor(args.get("after"))
+    except ValueError as exc:
+      return jsonify({"error": str(exc)}), 400
+    try:
+      raw_status = string_or_null(args.get("status"))
+      user_status = normalize_status(raw_status) if raw_status else None
+    except ValueError as exc:
+      return jsonify({"error": str(exc), "allowedStatuses": sorted(STATUS_VALUES)}), 400
+
+    limit = None
+    if "limit" in args:
+      try:
+        limit = int(args["limit"])
+      except ValueError:
+        limit = 0
+      if not 1 <= limit <= settings.users_page_max_limit:
+        return (
+          jsonify({"error": f"limit must be between 1 and {settings.users_page_max_limit}"}),
+          400,
+        )
+
+    if _wants_ndjson():
+      rows = iter_users(settings, fields=fields, status=user_status, after=after, limit=limit)
+
+      def generate():
+        for user in rows:
+          yield json.dumps(user, separators=(",", ":")) + "\n"
+
+      return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+    # The read model may lag writes from other workers; building from it at the
+    # generation the response is keyed and tagged with keeps the two in step.
+    generation = read_generation(settings)
+
+    def build():
+      sync_read_model(settings, generation)
+      if limit is None and after is None:
+        if fields is None and user_status is None:
+          return {"users": read_users(settings)}
+        return {"users": list(iter_users(settings, fields=fields, status=user_status))}
+      users, next_cursor = read_users_page(
+        settings,
+        limit or settings.users_page_max_limit,
+        fields=fields,
+        status=user_status,
+        after=after,
+      )
+      return {"users": users, "nextCursor": next_cursor}
+
+    key = ("users", tuple(fields or ()), user_status, after, limit)
+    return response_cache.json_response(key, generation, build)
+
+  @api.route("/users/<path:email>", methods=["GET"])
+  def get_user(email: str):
+    user = find_user_by_email(settings, email.strip())
+    if user is None:
+      return jsonify({"error": "User not found"}), 404
+    return jsonify({"user": user})
+
+  @api.route("/metrics/user-counts/current", methods=["GET"])
+  def current_user_counts():
+    counts = read_status_counts(settings)
+    return jsonify({"total": sum(counts.values()), "byStatus": counts})
+
+  @api.route("/metrics/user-counts", methods=["GET"])
+  def user_counts_route():
+    bucket = request.args.get("bucket", "day")
+    if bucket not in BUCKET_EXPRESSIONS:
+      return jsonify({"error": f"bucket must be one of {', '.join(BUCKET_EXPRESSIONS)}"}), 400
+    try:
+      start = parse_period_bound(request.args.get("from"))
+      end = parse_period_bound(request.args.get("to"), end=True)
+    except ValueError as exc:
+      return jsonify({"error": str(exc)}), 400
+
+    # Snapshots only change when one is captured or retention prunes old ones, so
+    # the later of the two validates every query over the table.
+    modified, pruned = user_counts_version(settings)
+    etag = make_etag("user-counts", modified, pruned, bucket, start, end)
+    if is_not_modified(etag, modified):
+      return not_modified_response(etag, modified)
+
+    payload = query_user_counts(settings, bucket=bucket, start=start, end=end)
+    return add_validators(jsonify(payload), etag, modified)
 
   @api.route("/donations/link", methods=["GET"])
   def donation_link():
-    if settings.stripe_donation_link:
-      return jsonify({"url": settings.stripe_donation_link})
-    return jsonify({"error": "Donation link not configured"}), 503
+    return static_json_response(donation_link_body, donation_link_etag, donation_link_status)
 
   @api.route("/donations/checkout", methods=["POST"])
+  @idempotent(settings, "donations-checkout")
   def create_donation_checkout():
     if not settings.stripe_secret_key:
       return jsonify({"error": "Stripe is not configured"}), 503
 
     payload = request.get_json(silent=True) or {}
-    amount = payload.get("amount")
-
     try:
-      amount_decimal = Decimal(str(amount))
-    except (InvalidOperation, TypeError):
-      return jsonify({"error": "Invalid amount"}), 400
-
-    if amount_decimal <= 0:
-      return jsonify({"error": "Amount must be greater than zero"}), 400
-
-    # Convert to smallest currency unit (cents) and enforce two decimal places.
-    cents = int((amount_decimal * 100).quantize(Decimal("1")))
+      cents = parse_amount_cents(payload.get("amount"))
+    except ValueError as exc:
+      return jsonify({"error": str(exc)}), 400
 
     try:
-      session = stripe.checkout.Session.create(
-        mode="payment",
-        line_items=[
-          {
-            "price_data": {
-              "currency": settings.stripe_currency,
-              "product_data": {"name": "Kity Support"},
-              "unit_amount": cents,
-            },
-            "quantity": 1,
-          }
-        ],
-        success_url=settings.stripe_success_url,
-        cancel_url=settings.stripe_cancel_url,
+      url = create_checkout_session(
+        settings, cents, idempotency_key=request.headers.get(IDEMPOTENCY_HEADER)
       )
-    except stripe.error.StripeError as exc:  # type: ignore[attr-defined]
+    except CheckoutBusy as exc:
+      return jsonify({"error": str(exc)}), 503, {"Retry-After": "1"}
+    except CheckoutUnavailable as exc:
+      return jsonify({"error": str(exc)}), 504
+    except CheckoutFailed as exc:
       return jsonify({"error": str(exc)}), 500
 
-    return jsonify({"url": session.url})
+    return jsonify({"url": url})
 
   return api
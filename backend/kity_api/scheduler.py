@@ -4,13 +4,16 @@ import atexit
 import logging
 import os
 from functools import partial
-
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
+from typing import TYPE_CHECKING, Callable, Optional
 
 from .config import Settings
 from .extensionpay import sync_extensionpay_users
-from .metrics import snapshot_user_count
+from .jobs import JobResult, run_exclusive
+from .maintenance import run_maintenance
+from .metrics import reconcile_user_counts, snapshot_user_count
+
+if TYPE_CHECKING:
+  from apscheduler.schedulers.background import BackgroundScheduler
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +31,32 @@ def _should_start_scheduler() -> bool:
   return main_flag.lower() == "true"
 
 
+def _extpay_sync_job(settings: Settings) -> JobResult:
+  created, updated, errors = sync_extensionpay_users(settings)
+  return created + updated, errors
+
+
+def _snapshot_job(settings: Settings) -> JobResult:
+  return snapshot_user_count(settings), []
+
+
+def _reconcile_job(settings: Settings) -> JobResult:
+  # Repaired drift is not a failure; rows counts the statuses that needed fixing.
+  return len(reconcile_user_counts(settings)), []
+
+
+def _maintenance_job(settings: Settings) -> JobResult:
+  report = run_maintenance(settings)
+  return report.pages_reclaimed, []
+
+
+def _exclusive(
+  settings: Settings, job_id: str, job: Callable[[Settings], JobResult]
+) -> Callable[[], Optional[int]]:
+  # Every worker's scheduler fires, but only the lease winner runs the job.
+  return partial(run_exclusive, settings, job_id, partial(job, settings))
+
+
 def start_scheduler(settings: Settings) -> None:
   global _scheduler
 
@@ -38,13 +67,16 @@ def start_scheduler(settings: Settings) -> None:
     logger.info("Skipping scheduler startup in Flask reloader parent process")
     return
 
+  # APScheduler is only imported by processes that actually run jobs.
+  from apscheduler.schedulers.background import BackgroundScheduler
+  from apscheduler.triggers.cron import CronTrigger
+
   scheduler = BackgroundScheduler(timezone=settings.extpay_sync_timezone or "UTC")
   # ExtPay sync (optional)
   if settings.extpay_sync_enabled:
     if settings.extpay_sync_url and settings.extpay_api_key:
-      job_fn = partial(sync_extensionpay_users, settings)
       scheduler.add_job(
-        job_fn,
+        _exclusive(settings, "extpay-sync", _extpay_sync_job),
         CronTrigger(hour="12,22", minute=0, timezone=settings.extpay_sync_timezone),
         id="extpay-sync",
         max_instances=1,
@@ -59,13 +91,31 @@ def start_scheduler(settings: Settings) -> None:
 
   # User count snapshots at 00:00 and 12:00 daily
   scheduler.add_job(
-    partial(snapshot_user_count, settings),
+    _exclusive(settings, "user-count-snapshot", _snapshot_job),
     CronTrigger(hour="0,12", minute=0, timezone=settings.extpay_sync_timezone),
     id="user-count-snapshot",
     max_instances=1,
     replace_existing=True,
   )
 
+  # Check the per-status rollup counters against a real scan once a day
+  scheduler.add_job(
+    _exclusive(settings, "user-count-reconcile", _reconcile_job),
+    CronTrigger(hour=3, minute=30, timezone=settings.extpay_sync_timezone),
+    id="user-count-reconcile",
+    max_instances=1,
+    replace_existing=True,
+  )
+
+  # Planner statistics, incremental vacuum, WAL checkpoint and snapshot retention
+  scheduler.add_job(
+    _exclusive(settings, "db-maintenance", _maintenance_job),
+    CronTrigger(hour=4, minute=15, timezone=settings.extpay_sync_timezone),
+    id="db-maintenance",
+    max_instances=1,
+    replace_existing=True,
+  )
+
   scheduler.start()
   atexit.register(lambda: scheduler.shutdown(wait=False))
 
@@ -1,13 +1,22 @@
 from __future__ import annotations
 
+import hashlib
+import os
+import secrets
 import sqlite3
+import threading
 import uuid
 from datetime import datetime
-from typing import Dict, List, Optional
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 from .config import Settings
+from .instrumentation import SQLITE_CONNECTIONS, timed
 from .utils import to_datetime, to_iso
 
+# Stay well below SQLite's bound-parameter limit for IN (...) lookups.
+_IN_CLAUSE_LIMIT = 500
+
 STATUS_VALUES = {
   "active_trial",
   "ended_trial",
@@ -18,31 +27,256 @@ STATUS_VALUES = {
 
 DEFAULT_STATUS = "free_user"
 
+# API field name -> users column, in response order.
+USER_FIELDS = {
+  "id": "id",
+  "email": "email",
+  "name": "name",
+  "status": "status",
+  "trialStartedAt": "trial_started_at",
+  "subscriptionStartedAt": "subscription_started_at",
+  "createdAt": "created_at",
+}
+
+
+_GENERATION_KEY = "users_generation"
+
+# Every real change to a users row bumps a persisted generation counter, so caches
+# in any worker can tell whether the store changed since they last looked.
+_GENERATION_TRIGGERS = (
+  f"""
+  CREATE TRIGGER IF NOT EXISTS users_generation_insert
+  AFTER INSERT ON users
+  BEGIN
+    UPDATE store_meta SET value = value + 1 WHERE key = '{_GENERATION_KEY}';
+  END
+  """,
+  f"""
+  CREATE TRIGGER IF NOT EXISTS users_generation_update
+  AFTER UPDATE ON users
+  WHEN OLD.name IS NOT NEW.name
+    OR OLD.status IS NOT NEW.status
+    OR OLD.trial_started_at IS NOT NEW.trial_started_at
+    OR OLD.subscription_started_at IS NOT NEW.subscription_started_at
+  BEGIN
+    UPDATE store_meta SET value = value + 1 WHERE key = '{_GENERATION_KEY}';
+  END
+  """,
+  f"""
+  CREATE TRIGGER IF NOT EXISTS users_generation_delete
+  AFTER DELETE ON users
+  BEGIN
+    UPDATE store_meta SET value = value + 1 WHERE key = '{_GENERATION_KEY}';
+  END
+  """,
+)
+
+_ROW_VERSION_KEY = "users_row_version"
+
+# Each inserted or changed row is stamped with the next value of its own sequence,
+# so an in-process read model can fetch just the rows changed since it last looked.
+_ROW_VERSION_TRIGGERS = (
+  f"""
+  CREATE TRIGGER IF NOT EXISTS users_row_version_insert
+  AFTER INSERT ON users
+  BEGIN
+    UPDATE store_meta SET value = value + 1 WHERE key = '{_ROW_VERSION_KEY}';
+    UPDATE users SET row_version = (
+      SELECT value FROM store_meta WHERE key = '{_ROW_VERSION_KEY}'
+    ) WHERE rowid = NEW.rowid;
+  END
+  """,
+  f"""
+  CREATE TRIGGER IF NOT EXISTS users_row_version_update
+  AFTER UPDATE ON users
+  WHEN OLD.name IS NOT NEW.name
+    OR OLD.status IS NOT NEW.status
+    OR OLD.trial_started_at IS NOT NEW.trial_started_at
+    OR OLD.subscription_started_at IS NOT NEW.subscription_started_at
+  BEGIN
+    UPDATE store_meta SET value = value + 1 WHERE key = '{_ROW_VERSION_KEY}';
+    UPDATE users SET row_version = (
+      SELECT value FROM store_meta WHERE key = '{_ROW_VERSION_KEY}'
+    ) WHERE rowid = NEW.rowid;
+  END
+  """,
+)
+
+# Connections are pooled per thread (and per process, so a fork under gunicorn
+# never inherits its parent's handles). Schema bootstrap runs once per database.
+_local = threading.local()
+_bootstrap_lock = threading.Lock()
+_bootstrapped: set[str] = set()
+
+# Called with the emails touched by every user write (e.g. to invalidate caches).
+_user_write_listeners: List[Callable[[Iterable[str]], None]] = []
+# Called with the hash of every token revoked by this process.
+_token_revoke_listeners: List[Callable[[str], None]] = []
+
+
+def _open_connection(settings: Settings, path: Path) -> sqlite3.Connection:
+  busy_timeout_ms = max(0, int(settings.sqlite_busy_timeout_ms))
+  conn = sqlite3.connect(path)
+  conn.row_factory = sqlite3.Row
+  conn.execute(f"PRAGMA busy_timeout = {busy_timeout_ms}")
+  # Only takes effect on a brand-new file, and only before WAL mode is set;
+  # existing databases are converted with `manage.py vacuum`.
+  conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+  conn.execute("PRAGMA journal_mode = WAL")
+  conn.execute("PRAGMA synchronous = NORMAL")
+  # Negative cache_size is expressed in KiB rather than pages.
+  conn.execute(f"PRAGMA cache_size = {-abs(int(settings.sqlite_cache_size_kib))}")
+  return conn
+
+
+def _thread_pool() -> Dict[str, sqlite3.Connection]:
+  pid = os.getpid()
+  pool = getattr(_local, "connections", None)
+  if pool is None or getattr(_local, "pid", None) != pid:
+    pool = {}
+    _local.connections = pool
+    _local.pid = pid
+  return pool
+
+
+def _pooled_connection(settings: Settings, path: Optional[Path] = None) -> sqlite3.Connection:
+  path = path or settings.db_path
+  pool = _thread_pool()
+  key = str(path)
+  conn = pool.get(key)
+  SQLITE_CONNECTIONS.inc(path.name, "miss" if conn is None else "hit")
+  if conn is None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = _open_connection(settings, path)
+    pool[key] = conn
+  return conn
+
 
 def ensure_store(settings: Settings) -> None:
-  """Create the SQLite database and users table if they don't exist."""
-  settings.data_dir.mkdir(parents=True, exist_ok=True)
-  with sqlite3.connect(settings.db_path) as conn:
-    conn.execute(
-      """
-      CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        email TEXT UNIQUE NOT NULL,
-        name TEXT,
-        status TEXT NOT NULL,
-        trial_started_at TEXT,
-        subscription_started_at TEXT,
-        created_at TEXT NOT NULL
+  """Create the SQLite database and users table if they don't exist (once per process)."""
+  key = str(settings.db_path)
+  if key in _bootstrapped:
+    return
+  with _bootstrap_lock:
+    if key in _bootstrapped:
+      return
+    conn = _pooled_connection(settings)
+    with conn:
+      conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+          id TEXT PRIMARY KEY,
+          email TEXT UNIQUE NOT NULL,
+          name TEXT,
+          status TEXT NOT NULL,
+          trial_started_at TEXT,
+          subscription_started_at TEXT,
+          created_at TEXT NOT NULL,
+          row_version INTEGER NOT NULL DEFAULT 0
+        )
+        """
       )
-      """
-    )
+      columns = {row["name"] for row in conn.execute("PRAGMA table_info(users)")}
+      if "row_version" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0")
+      # Listings walk (created_at, id) newest-first, optionally within one status.
+      conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at, id)"
+      )
+      conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_row_version ON users (row_version)"
+      )
+      conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_users_status_created_at
+        ON users (status, created_at, id)
+        """
+      )
+      # API tokens are stored hashed; the primary key is the lookup index.
+      conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tokens (
+          token_hash TEXT PRIMARY KEY,
+          user_id TEXT NOT NULL REFERENCES users (id),
+          created_at TEXT NOT NULL
+        )
+        """
+      )
+      conn.execute("CREATE INDEX IF NOT EXISTS idx_tokens_user_id ON tokens (user_id)")
+      conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS store_meta (
+          key TEXT PRIMARY KEY,
+          value INTEGER NOT NULL
+        )
+        """
+      )
+      # Start from a random value so validators derived from the generation never
+      # repeat across a recreated database file.
+      conn.execute(
+        "INSERT OR IGNORE INTO store_meta (key, value) VALUES (?, ?)",
+        (_GENERATION_KEY, secrets.randbits(48)),
+      )
+      conn.execute(
+        "INSERT OR IGNORE INTO store_meta (key, value) VALUES (?, 0)", (_ROW_VERSION_KEY,)
+      )
+      for trigger in (*_GENERATION_TRIGGERS, *_ROW_VERSION_TRIGGERS):
+        conn.execute(trigger)
+    _bootstrapped.add(key)
 
 
 def get_connection(settings: Settings) -> sqlite3.Connection:
+  """
+  Return this thread's pooled connection for the configured database.
+  The connection stays open between calls; `with get_connection(...) as conn`
+  scopes a transaction, not the connection's lifetime.
+  """
   ensure_store(settings)
-  conn = sqlite3.connect(settings.db_path)
-  conn.row_factory = sqlite3.Row
-  return conn
+  return _pooled_connection(settings)
+
+
+def get_auxiliary_connection(settings: Settings, path: Path) -> sqlite3.Connection:
+  """
+  Pooled connection (same pragmas) to a side database next to users.db, for
+  state that shouldn't contend for the users write lock. No schema is created.
+  """
+  return _pooled_connection(settings, path)
+
+
+@timed("read_generation")
+def read_generation(settings: Settings) -> int:
+  """Current users generation; changes whenever any process writes a users row."""
+  with get_connection(settings) as conn:
+    row = conn.execute(
+      "SELECT value FROM store_meta WHERE key = ?", (_GENERATION_KEY,)
+    ).fetchone()
+  return row["value"]
+
+
+def add_user_write_listener(listener: Callable[[Iterable[str]], None]) -> None:
+  """Register a callback that receives the emails of users written by this process."""
+  if listener not in _user_write_listeners:
+    _user_write_listeners.append(listener)
+
+
+def add_token_revoke_listener(listener: Callable[[str], None]) -> None:
+  """Register a callback that receives the hash of each token revoked by this process."""
+  if listener not in _token_revoke_listeners:
+    _token_revoke_listeners.append(listener)
+
+
+def _notify_user_writes(emails: Iterable[str]) -> None:
+  emails = list(emails)
+  for listener in _user_write_listeners:
+    listener(emails)
+
+
+def close_connections() -> None:
+  """Close every pooled connection owned by the calling thread."""
+  pool = getattr(_local, "connections", None) or {}
+  for conn in pool.values():
+    conn.close()
+  pool.clear()
 
 
 def normalize_status(status: Optional[str], fallback: Optional[str] = None) -> str:
@@ -77,20 +311,190 @@ def row_to_user(row: sqlite3.Row) -> Dict[str, Optional[str]]:
   }
 
 
+def parse_user_fields(value: Optional[str]) -> Optional[List[str]]:
+  """Parse a comma-separated `fields` projection; None means every field."""
+  if not value:
+    return None
+  fields = [field.strip() for field in value.split(",") if field.strip()]
+  unknown = [field for field in fields if field not in USER_FIELDS]
+  if unknown:
+    raise ValueError(
+      f"Unknown field(s) {', '.join(unknown)}. Allowed: {', '.join(USER_FIELDS)}"
+    )
+  return fields or None
+
+
+def parse_user_cursor(value: Optional[str]) -> Optional[Tuple[str, str]]:
+  """Parse an `after` cursor of the form `<createdAt>,<id>`."""
+  if not value:
+    return None
+  created_at, sep, record_id = value.partition(",")
+  if not sep or not created_at or not record_id:
+    raise ValueError("Invalid cursor; expected '<createdAt>,<id>'")
+  return created_at, record_id
+
+
+def _iter_user_rows(
+  settings: Settings,
+  fields: Optional[Sequence[str]] = None,
+  status: Optional[str] = None,
+  after: Optional[Tuple[str, str]] = None,
+  limit: Optional[int] = None,
+) -> Iterator[sqlite3.Row]:
+  # created_at and id are always selected so callers can build the next cursor.
+  columns = {"id", "created_at"}
+  columns.update(USER_FIELDS[field] for field in (fields or USER_FIELDS))
+  clauses: List[str] = []
+  params: List[object] = []
+  if status is not None:
+    clauses.append("status = ?")
+    params.append(normalize_status(status))
+  if after is not None:
+    clauses.append("(created_at, id) < (?, ?)")
+    params.extend(after)
+  sql = f"SELECT {', '.join(sorted(columns))} FROM users"
+  if clauses:
+    sql += " WHERE " + " AND ".join(clauses)
+  sql += " ORDER BY created_at DESC, id DESC"
+  if limit is not None:
+    sql += " LIMIT ?"
+    params.append(limit)
+  yield from get_connection(settings).execute(sql, params)
+
+
+def _project(row: sqlite3.Row, fields: Optional[Sequence[str]]) -> Dict[str, Optional[str]]:
+  if fields is None:
+    return row_to_user(row)
+  return {field: row[USER_FIELDS[field]] for field in fields}
+
+
+def iter_users(
+  settings: Settings,
+  fields: Optional[Sequence[str]] = None,
+  status: Optional[str] = None,
+  after: Optional[Tuple[str, str]] = None,
+  limit: Optional[int] = None,
+) -> Iterator[Dict[str, Optional[str]]]:
+  """Yield users newest-first straight off the cursor, without building a list."""
+  for row in _iter_user_rows(settings, fields, status, after, limit):
+    yield _project(row, fields)
+
+
+@timed("read_users_page")
+def read_users_page(
+  settings: Settings,
+  limit: int,
+  fields: Optional[Sequence[str]] = None,
+  status: Optional[str] = None,
+  after: Optional[Tuple[str, str]] = None,
+) -> Tuple[List[Dict[str, Optional[str]]], Optional[str]]:
+  """Return one keyset page of users and the cursor for the next page (None at the end)."""
+  rows = list(_iter_user_rows(settings, fields, status, after, limit + 1))
+  next_cursor = None
+  if len(rows) > limit:
+    rows = rows[:limit]
+    next_cursor = f"{rows[-1]['created_at']},{rows[-1]['id']}"
+  return [_project(row, fields) for row in rows], next_cursor
+
+
+@timed("read_users")
 def read_users(settings: Settings) -> List[Dict[str, Optional[str]]]:
-  ensure_store(settings)
-  with get_connection(settings) as conn:
-    rows = conn.execute("SELECT * FROM users ORDER BY created_at DESC").fetchall()
-  return [row_to_user(row) for row in rows]
+  return list(iter_users(settings))
 
 
+@timed("find_user_by_email")
 def find_user_by_email(settings: Settings, email: str) -> Optional[Dict[str, Optional[str]]]:
-  ensure_store(settings)
   with get_connection(settings) as conn:
     row = conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
   return row_to_user(row) if row else None
 
 
+def hash_token(token: str) -> str:
+  return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+@timed("find_user_by_token")
+def find_user_by_token(settings: Settings, token: str) -> Optional[Dict[str, Optional[str]]]:
+  """Resolve a bearer token to its user with a single primary-key lookup."""
+  with get_connection(settings) as conn:
+    row = conn.execute(
+      """
+      SELECT users.* FROM tokens
+      JOIN users ON users.id = tokens.user_id
+      WHERE tokens.token_hash = ?
+      """,
+      (hash_token(token),),
+    ).fetchone()
+  return row_to_user(row) if row else None
+
+
+@timed("issue_token")
+def issue_token(settings: Settings, email: str) -> str:
+  """Create a new API token for an existing user. Only its hash is stored."""
+  user = find_user_by_email(settings, email.strip())
+  if not user:
+    raise LookupError(f"No user with email '{email}'")
+  token = secrets.token_urlsafe(32)
+  with get_connection(settings) as conn:
+    conn.execute(
+      "INSERT INTO tokens (token_hash, user_id, created_at) VALUES (?, ?, ?)",
+      (hash_token(token), user["id"], datetime.utcnow().isoformat()),
+    )
+  return token
+
+
+@timed("revoke_token")
+def revoke_token(settings: Settings, token: str) -> bool:
+  token_hash = hash_token(token)
+  with get_connection(settings) as conn:
+    cursor = conn.execute("DELETE FROM tokens WHERE token_hash = ?", (token_hash,))
+  for listener in _token_revoke_listeners:
+    listener(token_hash)
+  return cursor.rowcount > 0
+
+
+# One statement per upsert: the UNIQUE(email) conflict decides between insert and
+# update atomically, and null incoming values keep whatever is already stored.
+_UPSERT_USER_SQL = """
+  INSERT INTO users (
+    id, email, name, status, trial_started_at, subscription_started_at, created_at
+  ) VALUES (
+    :id, :email, :name, :status, :trial_started_at, :subscription_started_at, :created_at
+  )
+  ON CONFLICT(email) DO UPDATE SET
+    name = COALESCE(excluded.name, users.name),
+    status = COALESCE(:requested_status, users.status),
+    trial_started_at = COALESCE(excluded.trial_started_at, users.trial_started_at),
+    subscription_started_at = COALESCE(
+      excluded.subscription_started_at, users.subscription_started_at
+    )
+"""
+
+
+def prepare_user_params(
+  email: str,
+  name: Optional[str] = None,
+  status: Optional[str] = None,
+  trial_started_at: Optional[str] = None,
+  subscription_started_at: Optional[str] = None,
+) -> Dict[str, Optional[str]]:
+  """Validate one user write and build the parameters for the upsert statement."""
+  normalized_status = normalize_status(status) if status is not None else None
+  return {
+    "id": str(uuid.uuid4()),
+    "email": email.strip(),
+    "name": name or None,
+    "status": normalized_status or DEFAULT_STATUS,
+    "requested_status": normalized_status,
+    "trial_started_at": normalize_iso(trial_started_at, "trialStartedAt"),
+    "subscription_started_at": normalize_iso(
+      subscription_started_at, "subscriptionStartedAt"
+    ),
+    "created_at": datetime.utcnow().isoformat(),
+  }
+
+
+@timed("upsert_user")
 def upsert_user(
   settings: Settings,
   email: str,
@@ -99,76 +503,76 @@ def upsert_user(
   trial_started_at: Optional[str] = None,
   subscription_started_at: Optional[str] = None,
 ) -> tuple[Dict[str, Optional[str]], bool]:
-  ensure_store(settings)
-  clean_email = email.strip()
+  params = prepare_user_params(
+    email,
+    name=name,
+    status=status,
+    trial_started_at=trial_started_at,
+    subscription_started_at=subscription_started_at,
+  )
   with get_connection(settings) as conn:
-    existing = conn.execute("SELECT * FROM users WHERE email = ?", (clean_email,)).fetchone()
-
-    if existing:
-      normalized_status = normalize_status(status, existing["status"])
-      normalized_trial = (
-        normalize_iso(trial_started_at, "trialStartedAt")
-        if trial_started_at is not None
-        else existing["trial_started_at"]
-      )
-      normalized_subscription = (
-        normalize_iso(subscription_started_at, "subscriptionStartedAt")
-        if subscription_started_at is not None
-        else existing["subscription_started_at"]
-      )
-      conn.execute(
-        """
-        UPDATE users
-        SET name = ?, status = ?, trial_started_at = ?, subscription_started_at = ?
-        WHERE email = ?
-        """,
-        (
-          name or existing["name"],
-          normalized_status,
-          normalized_trial,
-          normalized_subscription,
-          clean_email,
-        ),
-      )
-      updated = conn.execute(
-        "SELECT * FROM users WHERE email = ?", (clean_email,)
-      ).fetchone()
-      return row_to_user(updated), False
+    row = conn.execute(f"{_UPSERT_USER_SQL} RETURNING *", params).fetchone()
+  _notify_user_writes([row["email"]])
+  # An existing row keeps its id, so a matching id means this call inserted it.
+  return row_to_user(row), row["id"] == params["id"]
 
-    normalized_status = normalize_status(status)
-    normalized_trial = normalize_iso(trial_started_at, "trialStartedAt")
-    normalized_subscription = normalize_iso(subscription_started_at, "subscriptionStartedAt")
-    created_at = datetime.utcnow().isoformat()
-    record_id = str(uuid.uuid4())
 
-    conn.execute(
-      """
-      INSERT INTO users (
-        id, email, name, status, trial_started_at, subscription_started_at, created_at
-      ) VALUES (?, ?, ?, ?, ?, ?, ?)
-      """,
-      (
-        record_id,
-        clean_email,
-        name,
-        normalized_status,
-        normalized_trial,
-        normalized_subscription,
-        created_at,
-      ),
-    )
+@timed("upsert_users_bulk")
+def upsert_users_bulk(
+  settings: Settings, rows: Sequence[Dict[str, Optional[str]]]
+) -> List[bool]:
+  """
+  Apply many prepared upserts (see `prepare_user_params`) in one transaction.
+  Returns a created flag per row, in input order.
+  """
+  if not rows:
+    return []
 
-    inserted = conn.execute(
-      "SELECT * FROM users WHERE email = ?", (clean_email,)
-    ).fetchone()
-    return row_to_user(inserted), True
+  emails = list({row["email"] for row in rows})
+  existing: set[str] = set()
+  with get_connection(settings) as conn:
+    conn.execute("BEGIN IMMEDIATE")
+    for start in range(0, len(emails), _IN_CLAUSE_LIMIT):
+      batch = emails[start : start + _IN_CLAUSE_LIMIT]
+      placeholders = ", ".join("?" for _ in batch)
+      existing.update(
+        row[0]
+        for row in conn.execute(
+          f"SELECT email FROM users WHERE email IN ({placeholders})", batch
+        )
+      )
+    conn.executemany(_UPSERT_USER_SQL, rows)
+  _notify_user_writes(emails)
+
+  created: List[bool] = []
+  for row in rows:
+    created.append(row["email"] not in existing)
+    existing.add(row["email"])
+  return created
 
 
 __all__ = [
   "upsert_user",
+  "prepare_user_params",
+  "upsert_users_bulk",
   "read_users",
+  "read_users_page",
+  "iter_users",
+  "parse_user_fields",
+  "parse_user_cursor",
+  "USER_FIELDS",
   "find_user_by_email",
+  "find_user_by_token",
+  "issue_token",
+  "revoke_token",
+  "hash_token",
+  "add_user_write_listener",
+  "add_token_revoke_listener",
+  "read_generation",
   "ensure_store",
+  "get_connection",
+  "get_auxiliary_connection",
+  "close_connections",
   "STATUS_VALUES",
   "DEFAULT_STATUS",
 ]
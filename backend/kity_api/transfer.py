@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import csv
+import json
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Callable, Dict, Iterator, List, Optional, Sequence
+
+from .config import Settings
+from .storage import (
+  USER_FIELDS,
+  get_connection,
+  iter_users,
+  normalize_iso,
+  prepare_user_params,
+  upsert_users_bulk,
+)
+from .utils import string_or_null
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("ndjson", "csv")
+
+# Rows per import transaction; large enough to amortize the commit, small enough
+# that the write lock is held for well under a second.
+DEFAULT_IMPORT_BATCH = 5000
+# Database pages copied per backup step (4 KiB pages by default, so 4 MiB).
+DEFAULT_BACKUP_PAGES = 1024
+# SQLite restarts a stepped backup whenever another connection writes to the
+# source; after this many restarts the rest is copied in one step instead.
+_MAX_BACKUP_RESTARTS = 3
+# Only the first errors are kept verbatim; the rest are just counted.
+_MAX_REPORTED_ERRORS = 100
+
+
+@dataclass
+class ImportResult:
+  processed: int = 0
+  created: int = 0
+  updated: int = 0
+  failed: int = 0
+  errors: List[str] = field(default_factory=list)
+
+  def add_error(self, line: int, message: str) -> None:
+    self.failed += 1
+    if len(self.errors) < _MAX_REPORTED_ERRORS:
+      self.errors.append(f"[{line}] {message}")
+
+
+def format_for_path(path: str, default: str = "ndjson") -> str:
+  """Pick the export/import format from a file name (`.csv` or `.ndjson`/`.jsonl`)."""
+  suffix = Path(path).suffix.lower()
+  if suffix == ".csv":
+    return "csv"
+  if suffix in {".ndjson", ".jsonl"}:
+    return "ndjson"
+  return default
+
+
+def export_users(
+  settings: Settings,
+  out: IO[str],
+  fmt: str = "ndjson",
+  fields: Optional[Sequence[str]] = None,
+  status: Optional[str] = None,
+) -> int:
+  """
+  Stream users newest-first to `out` as NDJSON or CSV, straight off one SQLite
+  cursor, so memory stays flat however many rows there are. The single SELECT
+  reads one consistent snapshot even while other processes keep writing.
+  Returns the number of rows written.
+  """
+  if fmt not in EXPORT_FORMATS:
+    raise ValueError(f"Unknown export format '{fmt}'. Allowed: {', '.join(EXPORT_FORMATS)}")
+  columns = list(fields or USER_FIELDS)
+  rows = iter_users(settings, fields=columns, status=status)
+  count = 0
+  if fmt == "csv":
+    writer = csv.DictWriter(out, fieldnames=columns, lineterminator="\n")
+    writer.writeheader()
+    for user in rows:
+      writer.writerow(user)
+      count += 1
+  else:
+    for user in rows:
+      out.write(json.dumps(user, separators=(",", ":"), ensure_ascii=False))
+      out.write("\n")
+      count += 1
+  return count
+
+
+def _read_records(source: IO[str], fmt: str) -> Iterator[tuple[int, object]]:
+  if fmt == "csv":
+    # Line 1 is the header; CSV has no nulls, so empty cells mean "not given".
+    for line, record in enumerate(csv.DictReader(source), start=2):
+      yield line, {key: value or None for key, value in record.items() if key is not None}
+    return
+  for line, text in enumerate(source, start=1):
+    text = text.strip()
+    if not text:
+      continue
+    try:
+      yield line, json.loads(text)
+    except json.JSONDecodeError as exc:
+      yield line, ValueError(f"invalid JSON: {exc.msg}")
+
+
+def _record_to_params(record: object) -> Dict[str, Optional[str]]:
+  if isinstance(record, ValueError):
+    raise record
+  if not isinstance(record, dict):
+    raise ValueError("expected an object")
+  email = string_or_null(record.get("email"))
+  if not email:
+    raise ValueError("email is required")
+  status = record.get("status")
+  if status is not None and not isinstance(status, str):
+    raise ValueError("status must be a string")
+  params = prepare_user_params(
+    email,
+    name=string_or_null(record.get("name")),
+    status=status,
+    trial_started_at=record.get("trialStartedAt"),
+    subscription_started_at=record.get("subscriptionStartedAt"),
+  )
+  # Restoring an export keeps each new row's original creation time; ids are
+  # always fresh, so an import never collides with users already stored.
+  created_at = normalize_iso(record.get("createdAt"), "createdAt")
+  if created_at:
+    params["created_at"] = created_at
+  return params
+
+
+class _BackupRestarted(Exception):
+  pass
+
+
+def import_users(
+  settings: Settings,
+  source: IO[str],
+  fmt: str = "ndjson",
+  batch_size: int = DEFAULT_IMPORT_BATCH,
+  progress: Optional[Callable[[ImportResult], None]] = None,
+) -> ImportResult:
+  """
+  Upsert users read from NDJSON or CSV (the shape `export_users` writes),
+  validating each record like `upsert_user` and committing `batch_size` rows per
+  transaction. Invalid records are reported by line and skipped. `progress` is
+  called after every batch.
+  """
+  if fmt not in EXPORT_FORMATS:
+    raise ValueError(f"Unknown import format '{fmt}'. Allowed: {', '.join(EXPORT_FORMATS)}")
+  batch_size = max(1, batch_size)
+  result = ImportResult()
+  batch: List[Dict[str, Optional[str]]] = []
+
+  def flush() -> None:
+    flags = upsert_users_bulk(settings, batch)
+    created = sum(flags)
+    result.created += created
+    result.updated += len(flags) - created
+    batch.clear()
+    if progress:
+      progress(result)
+
+  for line, record in _read_records(source, fmt):
+    result.processed += 1
+    try:
+      batch.append(_record_to_params(record))
+    except ValueError as exc:
+      result.add_error(line, str(exc))
+      continue
+    if len(batch) >= batch_size:
+      flush()
+  if batch:
+    flush()
+  return result
+
+
+def backup_database(
+  settings: Settings,
+  destination: Path,
+  pages: int = DEFAULT_BACKUP_PAGES,
+  pause: float = 0.0,
+  progress: Optional[Callable[[int, int], None]] = None,
+) -> Path:
+  """
+  Copy the live users database to `destination` with SQLite's online backup API,
+  `pages` pages per step. Each step holds only a short read lock, which in WAL
+  mode never blocks writers; `pause` seconds between steps leaves more room for
+  them. Writes from other processes restart a stepped copy; if that keeps
+  happening, the copy falls back to a single step, which in WAL mode still only
+  holds a read lock. The copy goes to a temporary file first, so `destination`
+  is either the previous file or a complete snapshot. `progress(remaining,
+  total)` is called after every step.
+  """
+  destination = Path(destination)
+  destination.parent.mkdir(parents=True, exist_ok=True)
+  partial = destination.with_name(f".{destination.name}.partial")
+  partial.unlink(missing_ok=True)
+
+  # Make sure the schema exists before copying.
+  get_connection(settings)
+  source = sqlite3.connect(settings.db_path)
+  source.execute(f"PRAGMA busy_timeout = {max(0, int(settings.sqlite_busy_timeout_ms))}")
+  target = sqlite3.connect(partial)
+
+  restarts = 0
+  last_remaining: Optional[int] = None
+  last_total = 0
+
+  def on_step(status: int, remaining: int, total: int) -> None:
+    nonlocal restarts, last_remaining, last_total
+    if last_remaining is not None and remaining > last_remaining:
+      restarts += 1
+      if restarts > _MAX_BACKUP_RESTARTS:
+        raise _BackupRestarted()
+    last_remaining, last_total = remaining, total
+    if progress:
+      progress(remaining, total)
+    if pause and remaining:
+      time.sleep(pause)
+
+  started = time.perf_counter()
+  try:
+    try:
+      source.backup(target, pages=max(1, pages), progress=on_step)
+    except _BackupRestarted:
+      logger.warning(
+        "Backup restarted %s times under concurrent writes; copying in one step", restarts
+      )
+      source.backup(target, pages=-1)
+      if progress:
+        progress(0, last_total)
+  except BaseException:
+    target.close()
+    partial.unlink(missing_ok=True)
+    raise
+  finally:
+    source.close()
+  target.close()
+  os.replace(partial, destination)
+  logger.info(
+    "Backed up %s to %s in %.1f s", settings.db_path, destination, time.perf_counter() - started
+  )
+  return destination
+
+
+__all__ = [
+  "EXPORT_FORMATS",
+  "ImportResult",
+  "format_for_path",
+  "export_users",
+  "import_users",
+  "backup_database",
+]
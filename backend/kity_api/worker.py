@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import logging
+import signal
+import threading
+
+from .config import load_settings
+from .instrumentation import set_recording
+from .scheduler import start_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker() -> None:
+  """
+  Run the scheduled jobs without serving HTTP, until SIGINT or SIGTERM.
+  Pair it with web processes started with APP_ROLE=web.
+  """
+  from . import ensure_schema
+
+  settings = load_settings()
+  if settings.app_role == "web":
+    raise RuntimeError("APP_ROLE=web never runs jobs; use APP_ROLE=worker or all")
+
+  set_recording(settings.metrics_enabled)
+  ensure_schema(settings)
+  start_scheduler(settings)
+
+  stopped = threading.Event()
+  for signum in (signal.SIGINT, signal.SIGTERM):
+    signal.signal(signum, lambda *_: stopped.set())
+  logger.info("Job worker running; waiting for SIGINT or SIGTERM")
+  stopped.wait()
+  logger.info("Job worker stopping")
+
+
+__all__ = ["run_worker"]
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from .config import Settings
+from .instrumentation import gauge
+from .storage import find_user_by_email, prepare_user_params, upsert_users_bulk
+
+logger = logging.getLogger(__name__)
+
+# Upsert parameters that a later write only overrides when it carries a value.
+_MERGED_PARAMS = ("name", "requested_status", "trial_started_at", "subscription_started_at")
+# Matching API field for each of them in the returned record.
+_RECORD_FIELDS = {
+  "name": "name",
+  "requested_status": "status",
+  "trial_started_at": "trialStartedAt",
+  "subscription_started_at": "subscriptionStartedAt",
+}
+
+_queue: "WriteBehindQueue | None" = None
+_queue_lock = threading.Lock()
+
+
+class WriteBehindFull(RuntimeError):
+  """Raised when the queue already holds `write_behind_max_pending` distinct emails."""
+
+
+class _Pending(NamedTuple):
+  params: Dict[str, Optional[str]]
+  record: Dict[str, Optional[str]]
+
+
+def _merge_params(
+  older: Dict[str, Optional[str]], newer: Dict[str, Optional[str]]
+) -> Dict[str, Optional[str]]:
+  """Fold `newer` over `older` the same way the upsert statement would apply both in turn."""
+  merged = dict(older)
+  for key in _MERGED_PARAMS:
+    if newer[key] is not None:
+      merged[key] = newer[key]
+  merged["status"] = merged["requested_status"] or older["status"]
+  return merged
+
+
+def _apply_to_record(
+  record: Dict[str, Optional[str]], params: Dict[str, Optional[str]]
+) -> Dict[str, Optional[str]]:
+  updated = dict(record)
+  for key, field in _RECORD_FIELDS.items():
+    if params[key] is not None:
+      updated[field] = params[key]
+  return updated
+
+
+def _params_to_record(params: Dict[str, Optional[str]]) -> Dict[str, Optional[str]]:
+  return {
+    "id": params["id"],
+    "email": params["email"],
+    "name": params["name"],
+    "status": params["status"],
+    "trialStartedAt": params["trial_started_at"],
+    "subscriptionStartedAt": params["subscription_started_at"],
+    "createdAt": params["created_at"],
+  }
+
+
+class WriteBehindQueue:
+  """
+  Validates user upserts synchronously, merges writes for the same email while
+  they wait, and lets one writer thread apply them with `upsert_users_bulk`.
+  A flush happens every `write_behind_window_ms`, or sooner once
+  `write_behind_batch_size` emails are pending.
+  """
+
+  def __init__(self, settings: Settings) -> None:
+    self.settings = settings
+    self.window = max(0.001, settings.write_behind_window_ms / 1000)
+    self.batch_size = max(1, settings.write_behind_batch_size)
+    self.max_pending = settings.write_behind_max_pending
+    self._pending: Dict[str, _Pending] = {}
+    # Batch currently being written, so concurrent callers still see its values.
+    self._inflight: Dict[str, _Pending] = {}
+    self._cond = threading.Condition()
+    # Held from taking a batch until it is committed, so batches land in order
+    # and `drain` can wait out one that is mid-write.
+    self._flush_lock = threading.Lock()
+    self._stopping = False
+    self._pid = os.getpid()
+    self._thread = threading.Thread(target=self._run, name="kity-write-behind", daemon=True)
+    self._thread.start()
+
+  def __len__(self) -> int:
+    with self._cond:
+      return len(self._pending)
+
+  def enqueue(
+    self,
+    email: str,
+    name: Optional[str] = None,
+    status: Optional[str] = None,
+    trial_started_at: Optional[str] = None,
+    subscription_started_at: Optional[str] = None,
+  ) -> Tuple[Dict[str, Optional[str]], bool]:
+    """
+    Queue one upsert and return the record as it will be once written, plus
+    whether it creates the user. Raises ValueError for invalid input.
+    """
+    params = prepare_user_params(
+      email,
+      name=name,
+      status=status,
+      trial_started_at=trial_started_at,
+      subscription_started_at=subscription_started_at,
+    )
+    key = params["email"]
+    with self._cond:
+      base = self._pending.get(key) or self._inflight.get(key)
+      if base is not None:
+        pending = _Pending(
+          _merge_params(base.params, params), _apply_to_record(base.record, params)
+        )
+        self._pending[key] = pending
+        return pending.record, False
+      if self.max_pending and len(self._pending) >= self.max_pending:
+        raise WriteBehindFull("Too many queued user writes; retry shortly")
+
+    # Read the stored row outside the lock; the writer never blocks on it.
+    existing = find_user_by_email(self.settings, key)
+    record = _apply_to_record(existing, params) if existing else _params_to_record(params)
+
+    with self._cond:
+      # Another caller may have queued the same email while we were reading.
+      base = self._pending.get(key) or self._inflight.get(key)
+      if base is not None:
+        pending = _Pending(
+          _merge_params(base.params, params), _apply_to_record(base.record, params)
+        )
+        created = False
+      else:
+        pending = _Pending(params, record)
+        created = existing is None
+      self._pending[key] = pending
+      if len(self._pending) >= self.batch_size:
+        self._cond.notify()
+    return pending.record, created
+
+  def flush(self) -> int:
+    """
+    Write everything queued so far; returns the number of rows written. A batch
+    another thread is already writing is waited out first, so every write
+    queued before the call is committed when it returns.
+    """
+    with self._flush_lock:
+      return self._write_pending()
+
+  def _write_pending(self) -> int:
+    with self._cond:
+      if not self._pending:
+        return 0
+      self._inflight, self._pending = self._pending, {}
+      batch = self._inflight
+    try:
+      upsert_users_bulk(self.settings, [pending.params for pending in batch.values()])
+    except Exception:
+      logger.exception("Write-behind flush of %s users failed; requeueing", len(batch))
+      with self._cond:
+        # Newer writes queued during the failed flush still win over the old batch.
+        for key, older in batch.items():
+          newer = self._pending.get(key)
+          self._pending[key] = (
+            _Pending(_merge_params(older.params, newer.params), newer.record)
+            if newer
+            else older
+          )
+        self._inflight = {}
+      raise
+    with self._cond:
+      self._inflight = {}
+    return len(batch)
+
+  def _run(self) -> None:
+    while True:
+      with self._cond:
+        if not self._stopping and len(self._pending) < self.batch_size:
+          self._cond.wait(self.window)
+        stopping = self._stopping
+      try:
+        written = self.flush()
+      except Exception:
+        # Already logged; back off before retrying the requeued batch.
+        time.sleep(self.window)
+        written = 0
+      if stopping and not written:
+        return
+
+  def close(self, timeout: float = 10.0) -> None:
+    """Stop the writer thread after it has flushed everything still queued."""
+    if os.getpid() != self._pid:
+      return
+    with self._cond:
+      self._stopping = True
+      self._cond.notify()
+    self._thread.join(timeout)
+    if self._thread.is_alive() or len(self):
+      logger.error("Write-behind queue closed with %s users unwritten", len(self))
+
+
+def get_write_behind(settings: Settings) -> WriteBehindQueue:
+  """Return this process's queue, starting its writer thread on first use."""
+  global _queue
+
+  # A forked gunicorn worker doesn't inherit the parent's writer thread.
+  if _queue is None or _queue._pid != os.getpid():
+    with _queue_lock:
+      if _queue is None or _queue._pid != os.getpid():
+        _queue = WriteBehindQueue(settings)
+        atexit.register(_queue.close)
+  return _queue
+
+
+def pending_writes() -> int:
+  """Number of emails waiting in this process's queue (0 when write-behind is off)."""
+  queue = _queue
+  if queue is None or queue._pid != os.getpid():
+    return 0
+  return len(queue)
+
+
+def drain_writes() -> int:
+  """Commit everything this process has queued or is writing (no-op when write-behind is off)."""
+  queue = _queue
+  if queue is None or queue._pid != os.getpid():
+    return 0
+  return queue.flush()
+
+
+gauge(
+  "kity_write_behind_pending_users",
+  "User upserts queued in this process and not yet written.",
+  pending_writes,
+)
+
+
+__all__ = [
+  "WriteBehindQueue",
+  "WriteBehindFull",
+  "get_write_behind",
+  "pending_writes",
+  "drain_writes",
+]
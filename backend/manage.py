@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+import logging
+import sys
+
+from dotenv import load_dotenv
+
+from kity_api.cli import main
+
+# Load environment variables from .env file
+load_dotenv()
+
+if __name__ == "__main__":
+  # Progress goes to stderr, so `export -` can be piped.
+  logging.basicConfig(level=logging.INFO, format="%(message)s")
+  sys.exit(main())
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import pytest
+from flask import Flask
+
+from kity_api import create_app
+from kity_api.asgi import AsgiApp
+from kity_api.config import load_settings
+
+AsgiCall = Callable[..., Tuple[int, bytes]]
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch) -> Flask:
+  """The API on a fresh data directory, without rate limits or background jobs."""
+  monkeypatch.setenv("DATA_DIR", str(tmp_path))
+  monkeypatch.setenv("RATE_LIMITS", "")
+  monkeypatch.setenv("APP_ROLE", "web")
+  return create_app()
+
+
+@pytest.fixture
+def client(app: Flask):
+  return app.test_client()
+
+
+@pytest.fixture
+def asgi_call(app: Flask) -> AsgiCall:
+  """
+  Call the app through `AsgiApp`, sending the body as separate `http.request`
+  messages the way a server relays a chunked upload. With `complete=False` the
+  client disconnects after the last chunk instead of ending the body. Returns
+  (status, body), or (0, b"") when nothing was sent back.
+  """
+
+  def call(
+    method: str,
+    path: str,
+    chunks: Sequence[bytes] = (),
+    headers: Sequence[Tuple[bytes, bytes]] = (),
+    complete: bool = True,
+  ) -> Tuple[int, bytes]:
+    asgi = AsgiApp(app, load_settings())
+    messages: List[Dict[str, Any]] = [
+      {"type": "http.request", "body": chunk, "more_body": not complete or index < len(chunks) - 1}
+      for index, chunk in enumerate(chunks)
+    ] or [{"type": "http.request", "body": b"", "more_body": False}]
+    sent: List[Dict[str, Any]] = []
+
+    async def receive() -> Dict[str, Any]:
+      return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+      sent.append(message)
+
+    scope = {
+      "type": "http",
+      "method": method,
+      "path": path,
+      "query_string": b"",
+      "headers": list(headers),
+    }
+    asyncio.run(asgi(scope, receive, send))
+    if not sent:
+      return 0, b""
+    return sent[0]["status"], b"".join(message.get("body", b"") for message in sent[1:])
+
+  return call
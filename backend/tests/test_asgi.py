@@ -0,0 +1,32 @@
+"""The ASGI adapter, driven directly with ASGI messages."""
+from __future__ import annotations
+
+import json
+
+
+def test_body_without_content_length_reaches_the_view(asgi_call, client):
+  body = json.dumps({"email": "chunked@example.com", "status": "free_user"}).encode()
+  status, _ = asgi_call(
+    "POST", "/users", [body[:10], body[10:]], [(b"content-type", b"application/json")]
+  )
+  assert status == 201
+  assert client.get("/users/chunked@example.com").status_code == 200
+
+
+def test_body_over_the_limit_is_rejected(asgi_call, monkeypatch):
+  monkeypatch.setenv("MAX_BODY_BYTES", "16")
+  status, body = asgi_call("POST", "/users", [b"x" * 10, b"x" * 10])
+  assert status == 413
+  assert "16 bytes" in json.loads(body)["error"]
+
+
+def test_disconnect_mid_body_never_runs_the_view(asgi_call, client):
+  status, _ = asgi_call(
+    "POST",
+    "/users/batch",
+    [b'{"email": "partial@example.com"}\n'],
+    [(b"content-type", b"application/x-ndjson")],
+    complete=False,
+  )
+  assert status == 0
+  assert client.get("/users/partial@example.com").status_code == 404
@@ -0,0 +1,23 @@
+"""Origin checks through the shared, compiled-once CORS policy."""
+from __future__ import annotations
+
+from kity_api.config import load_settings
+from kity_api.cors import get_cors_policy, is_origin_allowed
+
+
+def test_helper_reuses_the_policy_built_for_the_app(monkeypatch, tmp_path):
+  monkeypatch.setenv("DATA_DIR", str(tmp_path))
+  monkeypatch.setenv("ALLOWED_ORIGINS", "https://kity.app,https://*.kity.app")
+  settings = load_settings()
+  policy = get_cors_policy(settings)
+
+  assert is_origin_allowed("https://kity.app", settings)
+  assert is_origin_allowed("https://beta.kity.app", settings)
+  assert not is_origin_allowed("https://kity.app.evil.example", settings)
+  assert get_cors_policy(settings) is policy
+  assert get_cors_policy(load_settings()) is not policy
+
+
+def test_disallowed_origin_is_refused(client):
+  assert client.get("/health", headers={"Origin": "https://evil.example"}).status_code == 403
+  assert client.get("/health").status_code == 200
@@ -0,0 +1,31 @@
+"""METRICS_ENABLED switches recording off, not just the /metrics endpoint."""
+from __future__ import annotations
+
+from kity_api import create_app
+from kity_api.instrumentation import STORAGE_CALL_SECONDS, set_recording
+
+
+def _app(monkeypatch, tmp_path, enabled: str):
+  monkeypatch.setenv("DATA_DIR", str(tmp_path))
+  monkeypatch.setenv("RATE_LIMITS", "")
+  monkeypatch.setenv("APP_ROLE", "web")
+  monkeypatch.setenv("METRICS_ENABLED", enabled)
+  return create_app().test_client()
+
+
+def test_storage_timers_stop_recording_when_disabled(monkeypatch, tmp_path):
+  client = _app(monkeypatch, tmp_path, "false")
+  try:
+    before = STORAGE_CALL_SECONDS.count("upsert_user")
+    assert client.post("/users", json={"email": "quiet@example.com"}).status_code == 201
+    assert STORAGE_CALL_SECONDS.count("upsert_user") == before
+    assert client.get("/metrics").status_code == 404
+  finally:
+    set_recording(True)
+
+
+def test_storage_timers_record_when_enabled(monkeypatch, tmp_path):
+  client = _app(monkeypatch, tmp_path, "true")
+  before = STORAGE_CALL_SECONDS.count("upsert_user")
+  client.post("/users", json={"email": "loud@example.com"})
+  assert STORAGE_CALL_SECONDS.count("upsert_user") == before + 1
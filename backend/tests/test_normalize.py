@@ -0,0 +1,136 @@
+"""
+Parity between `ExtPayNormalizer` and the per-entry path it replaced
+(`benchmarks.normalize.reference_normalize`), including entries that hit the
+memo tables on a second pass.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Tuple
+
+import pytest
+
+from benchmarks.common import synthetic_entries
+from benchmarks.normalize import check_parity, reference_normalize
+from kity_api import normalize as normalize_module
+from kity_api.normalize import ExtPayNormalizer
+
+# Fields the two paths fill with fresh values on every call.
+_VOLATILE = ("id", "created_at")
+
+# Shapes real exports send besides the common case: alias keys, plan-only
+# statuses, blanks, bad timestamps and unusable entries.
+EDGE_CASES = [
+  {"email": "  padded@bench.example  ", "name": "  Padded  ", "status": "Trialing"},
+  {"email": "alias@bench.example", "planStatus": "active", "planNickname": "Pro Monthly"},
+  {"email": "plan@bench.example", "status": "active", "plan": "Annual"},
+  {"email": "yearly@bench.example", "status": "", "planStatus": "yearly", "plan": "Yearly"},
+  {"email": "cancel@bench.example", "status": "Cancelled", "planNickname": "Monthly"},
+  {"email": "spaces@bench.example", "status": "Paid Monthly"},
+  {"email": "unknown@bench.example", "status": "something-else", "plan": ""},
+  {"email": "nostatus@bench.example"},
+  {"email": "blank-name@bench.example", "name": "   ", "status": "free_user"},
+  {"email": "number-name@bench.example", "name": 42, "status": "free_user"},
+  {"email": "snake@bench.example", "trial_started_at": "2024-02-03T04:05:06+00:00"},
+  {"email": "empty-ts@bench.example", "trialStartedAt": "", "trial_started_at": None},
+  {"email": "date-only@bench.example", "subscriptionStartedAt": "2024-02-03"},
+  {"email": "bad-ts@bench.example", "trialStartedAt": "yesterday"},
+  {"email": "int-ts@bench.example", "subscriptionStartedAt": 1706918400},
+  {"email": "blank-plan@bench.example", "status": "trial", "plan": None, "planNickname": ""},
+  {"email": "   ", "status": "trial"},
+  {"email": None},
+  {"name": "No Email"},
+  "not-an-object",
+  None,
+]
+
+# Inputs that share or nearly share a memo key with a valid one.
+MEMO_CASES = [
+  {"email": "zero@bench.example", "status": 0, "plan": ""},
+  {"email": "false@bench.example", "status": False, "planStatus": "trial"},
+  {"email": "zero-plan@bench.example", "status": "active", "plan": 0},
+  {"email": "empty-list-plan@bench.example", "status": "monthly", "planNickname": []},
+  {"email": "padded-ts@bench.example", "trialStartedAt": " 2024-02-03"},
+  {"email": "bad-date@bench.example", "subscriptionStartedAt": "2024-02-30"},
+  {"email": "same-bad-ts@bench.example", "trialStartedAt": "yesterday"},
+  {"email": "datetime-ts@bench.example", "trialStartedAt": datetime(2024, 2, 3, 4, 5, 6)},
+  {"email": "float-ts@bench.example", "trialStartedAt": 1706918400.0},
+  {"email": "bool-ts@bench.example", "trialStartedAt": True},
+]
+
+# The old path crashed with AttributeError on these; the normalizer reports them.
+NON_STRING_CASES = [
+  {"email": "int-status@bench.example", "status": 1},
+  {"email": "true-status@bench.example", "status": True},
+  {"email": "list-status@bench.example", "status": ["trial"]},
+  {"email": "dict-status@bench.example", "planStatus": {"name": "trial"}},
+  {"email": "int-plan@bench.example", "status": "active", "plan": 12},
+  {"email": "list-plan@bench.example", "status": "trial", "planNickname": ["Monthly"]},
+]
+
+
+def _outcome(normalize, entry: Any) -> Tuple[Any, ...]:
+  try:
+    params, fingerprint = normalize(entry)
+  except ValueError as exc:
+    return ("error", str(exc))
+  stable = {key: value for key, value in params.items() if key not in _VOLATILE}
+  return ("ok", stable, fingerprint, sorted(params))
+
+
+@pytest.mark.parametrize("entry", EDGE_CASES + MEMO_CASES, ids=repr)
+def test_matches_reference_fresh_and_memoized(entry):
+  normalizer = ExtPayNormalizer()
+  expected = _outcome(reference_normalize, entry)
+  assert _outcome(normalizer.normalize, entry) == expected
+  assert _outcome(normalizer.normalize, entry) == expected
+
+
+def test_shared_normalizer_matches_reference_across_corpus():
+  # One normalizer for the whole corpus, twice over, so every entry also runs
+  # against memo entries left behind by the others.
+  entries = EDGE_CASES + MEMO_CASES + list(synthetic_entries(500))
+  assert check_parity(entries + entries) == []
+
+
+@pytest.mark.parametrize("entry", NON_STRING_CASES, ids=repr)
+def test_non_string_status_or_plan_is_rejected_every_time(entry):
+  normalizer = ExtPayNormalizer()
+  for _ in range(2):
+    with pytest.raises(ValueError, match="must be strings"):
+      normalizer.normalize(entry)
+
+
+def test_rejected_status_does_not_poison_the_memo():
+  normalizer = ExtPayNormalizer()
+  valid = {"email": "one@bench.example", "status": "1"}
+  expected = _outcome(reference_normalize, valid)
+  for bad in ({"email": "one@bench.example", "status": 1}, {"email": "t@bench.example", "status": True}):
+    with pytest.raises(ValueError):
+      normalizer.normalize(bad)
+  assert _outcome(normalizer.normalize, valid) == expected
+  with pytest.raises(ValueError):
+    normalizer.normalize({"email": "one@bench.example", "status": 1})
+
+
+def test_unparseable_timestamp_raises_after_being_memoized():
+  normalizer = ExtPayNormalizer()
+  good = {"email": "good@bench.example", "trialStartedAt": "2024-02-03T04:05:06"}
+  bad = {"email": "bad@bench.example", "trialStartedAt": "not a date"}
+  for _ in range(3):
+    assert _outcome(normalizer.normalize, good) == _outcome(reference_normalize, good)
+    with pytest.raises(ValueError, match="trialStartedAt"):
+      normalizer.normalize(bad)
+  # The same bad string under the other field reports that field's name.
+  with pytest.raises(ValueError, match="subscriptionStartedAt"):
+    normalizer.normalize({"email": "bad@bench.example", "subscriptionStartedAt": "not a date"})
+
+
+def test_results_survive_memo_tables_being_cleared(monkeypatch):
+  monkeypatch.setattr(normalize_module, "_MEMO_LIMIT", 2)
+  normalizer = ExtPayNormalizer()
+  entries = EDGE_CASES + MEMO_CASES
+  for entry in entries + entries:
+    assert _outcome(normalizer.normalize, entry) == _outcome(reference_normalize, entry)
+  assert len(normalizer._statuses) <= 2
+  assert len(normalizer._timestamps) <= 2
@@ -0,0 +1,47 @@
+"""Write shedding on the cross-process users.db write-lock probe."""
+from __future__ import annotations
+
+import sqlite3
+
+import pytest
+
+from kity_api import create_app, ratelimit
+from kity_api.config import load_settings
+
+
+def test_write_is_shed_while_another_process_holds_the_lock(monkeypatch, tmp_path):
+  monkeypatch.setenv("DATA_DIR", str(tmp_path))
+  monkeypatch.setenv("RATE_LIMITS", "")
+  monkeypatch.setenv("APP_ROLE", "web")
+  monkeypatch.setenv("SHED_LOCK_WAIT_MS", "50")
+  client = create_app().test_client()
+  conn = sqlite3.connect(load_settings().db_path, isolation_level=None)
+  conn.execute("BEGIN IMMEDIATE")
+  try:
+    response = client.post("/users", json={"email": "shed@example.com"})
+  finally:
+    conn.execute("ROLLBACK")
+  assert response.status_code == 503
+  assert response.headers["Retry-After"] == "1"
+  assert client.get("/health").status_code == 200
+
+
+def test_probe_result_is_reused_within_the_interval(monkeypatch, tmp_path):
+  monkeypatch.setenv("DATA_DIR", str(tmp_path))
+  probe = ratelimit._WriteLockProbe(load_settings())
+  calls = []
+  monkeypatch.setattr(probe, "_probe", lambda: calls.append(1) or True)
+  assert all(probe.free() for _ in range(50))
+  assert len(calls) == 1
+
+
+def test_write_behind_skips_the_probe(monkeypatch, tmp_path):
+  monkeypatch.setenv("DATA_DIR", str(tmp_path))
+  monkeypatch.setenv("RATE_LIMITS", "")
+  monkeypatch.setenv("APP_ROLE", "web")
+  monkeypatch.setenv("WRITE_BEHIND", "true")
+  monkeypatch.setattr(
+    ratelimit._WriteLockProbe, "free", lambda self: pytest.fail("probe ran under write-behind")
+  )
+  client = create_app().test_client()
+  assert client.post("/users", json={"email": "queued@example.com"}).status_code in {200, 201}
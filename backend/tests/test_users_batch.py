@@ -0,0 +1,101 @@
+"""POST /users/batch over JSON arrays and NDJSON."""
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from kity_api import create_app
+
+NDJSON = "application/x-ndjson"
+
+
+def _ndjson(*lines: str) -> bytes:
+  return "".join(line + "\n" for line in lines).encode()
+
+
+def test_json_array_creates_and_updates(client):
+  client.post("/users", json={"email": "old@example.com"})
+  response = client.post(
+    "/users/batch",
+    json=[{"email": "new@example.com", "status": "paid_monthly"}, {"email": "old@example.com"}],
+  )
+  assert response.status_code == 200
+  body = response.get_json()
+  assert (body["created"], body["updated"], body["failed"]) == (1, 1, 0)
+  assert [item["result"] for item in body["results"]] == ["created", "updated"]
+  assert client.get("/users/new@example.com").get_json()["user"]["status"] == "paid_monthly"
+
+
+def test_users_object_is_accepted(client):
+  response = client.post("/users/batch", json={"users": [{"email": "wrapped@example.com"}]})
+  assert response.status_code == 200
+  assert response.get_json()["created"] == 1
+
+
+def test_invalid_entries_are_reported_and_skipped(client):
+  response = client.post(
+    "/users/batch",
+    json=[
+      {"email": "ok@example.com"},
+      {"name": "No Email"},
+      "nope",
+      {"email": "x@example.com", "status": "bogus"},
+    ],
+  )
+  body = response.get_json()
+  assert response.status_code == 200
+  assert (body["created"], body["failed"]) == (1, 3)
+  assert [item["result"] for item in body["results"]] == ["created", "error", "error", "error"]
+  assert body["results"][1]["error"] == "Email is required"
+
+
+@pytest.mark.parametrize(
+  "body",
+  [
+    b'{"email": "single@example.com"}',
+    b'{"other": []}',
+    b'[{"email": "a@example.com"}] trailing',
+    b"[{",
+  ],
+  ids=["single-object", "no-users-key", "trailing-data", "truncated"],
+)
+def test_malformed_json_body_is_rejected(client, body):
+  response = client.post("/users/batch", data=body, content_type="application/json")
+  assert response.status_code == 400
+  assert client.get("/users/single@example.com").status_code == 404
+
+
+def test_ndjson_bad_line_is_reported_with_its_index(client):
+  response = client.post(
+    "/users/batch",
+    data=_ndjson(
+      '{"email": "first@example.com"}', "{not json", "", '{"email": "second@example.com"}'
+    ),
+    content_type=NDJSON,
+  )
+  body = response.get_json()
+  assert response.status_code == 200
+  assert (body["created"], body["failed"]) == (2, 1)
+  assert body["results"][1]["index"] == 1
+  assert body["results"][1]["result"] == "error"
+  assert body["results"][1]["error"].startswith("Invalid JSON")
+  assert [item["result"] for item in body["results"]] == ["created", "error", "created"]
+
+
+def test_oversized_batch_is_rejected(client, monkeypatch):
+  monkeypatch.setenv("USERS_BATCH_MAX_SIZE", "2")
+  small = create_app().test_client()
+  response = small.post("/users/batch", json=[{"email": f"u{i}@example.com"} for i in range(3)])
+  assert response.status_code == 413
+  assert small.get("/users/u0@example.com").status_code == 404
+
+
+def test_chunked_ndjson_batch_through_asgi(asgi_call, client):
+  body = _ndjson('{"email": "c1@example.com"}', '{"email": "c2@example.com"}')
+  status, payload = asgi_call(
+    "POST", "/users/batch", [body[:7], body[7:30], body[30:]], [(b"content-type", NDJSON.encode())]
+  )
+  assert status == 200
+  assert json.loads(payload)["created"] == 2
+  assert client.get("/users/c2@example.com").status_code == 200
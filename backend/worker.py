@@ -0,0 +1,14 @@
+from __future__ import annotations
+
+import logging
+
+from dotenv import load_dotenv
+
+from kity_api.worker import run_worker
+
+# Load environment variables from .env file
+load_dotenv()
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  run_worker()